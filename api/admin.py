@@ -1,3 +1,111 @@
+from datetime import timedelta
+
 from django.contrib import admin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html, format_html_join
+
+from .models import LLMCall, RequestProfile
+from .services import ledger, profiling
+
+REPORT_GROUPS = ('endpoint', 'username', 'model', 'caller')
+PROFILE_TOP = 30
+
+
+@admin.register(LLMCall)
+class LLMCallAdmin(admin.ModelAdmin):
+	list_display = ('created_at', 'endpoint', 'username', 'caller', 'model', 'outcome', 'latency_ms', 'prompt_tokens', 'completion_tokens', 'cache_hit', 'cost_usd')
+	list_filter = ('outcome', 'model', 'caller', 'cache_hit')
+	search_fields = ('username', 'endpoint', 'prompt_hash')
+	date_hierarchy = 'created_at'
+	change_list_template = 'admin/api/llmcall/change_list.html'
+
+	# Журнал только дополняется
+	def has_add_permission(self, request):
+		return False
+
+	def has_change_permission(self, request, obj=None):
+		return False
+
+	def get_urls(self):
+		return [
+			path('report/', self.admin_site.admin_view(self.report_view), name='api_llmcall_report'),
+		] + super().get_urls()
+
+	def report_view(self, request):
+		days = int(request.GET.get('days') or 7)
+		since = timezone.now() - timedelta(days=days)
+		context = {
+			**self.admin_site.each_context(request),
+			'opts': self.model._meta,
+			'title': f'LLM calls: latency and spend, last {days} days',
+			'days': days,
+			'reports': [(group, ledger.report(group, since=since)) for group in REPORT_GROUPS],
+		}
+		return TemplateResponse(request, 'admin/api/llmcall/report.html', context)
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+	list_display = ('created_at', 'method', 'path', 'view_name', 'username', 'status_code', 'duration_ms', 'sql_count', 'sql_ms', 'llm_count', 'llm_ms')
+	list_filter = ('view_name', 'method', 'status_code')
+	search_fields = ('path', 'view_name', 'username')
+	date_hierarchy = 'created_at'
+	fields = ('created_at', 'method', 'path', 'view_name', 'username', 'status_code', 'duration_ms', 'samples', 'sql_count', 'sql_ms', 'llm_count', 'llm_ms', 'size', 'folded_link', 'hot_stacks', 'llm_spans', 'slow_queries')
+	readonly_fields = fields
+
+	def has_add_permission(self, request):
+		return False
+
+	def has_change_permission(self, request, obj=None):
+		return False
+
+	def get_urls(self):
+		return [
+			path('<int:pk>/folded/', self.admin_site.admin_view(self.folded_view), name='api_requestprofile_folded'),
+		] + super().get_urls()
+
+	def folded_view(self, request, pk):
+		profile = get_object_or_404(RequestProfile, pk=pk)
+		response = HttpResponse(profiling.folded(profile), content_type='text/plain; charset=utf-8')
+		response['Content-Disposition'] = f'attachment; filename="profile-{pk}.folded"'
+		return response
+
+	@admin.display(description='Flame graph input')
+	def folded_link(self, obj):
+		return format_html('<a href="{}">profile-{}.folded</a> (flamegraph.pl, speedscope)', reverse('admin:api_requestprofile_folded', args=[obj.pk]), obj.pk)
+
+	@admin.display(description='Hottest stacks')
+	def hot_stacks(self, obj):
+		stacks = list(obj.data['stacks'].items())[:PROFILE_TOP]
+		total = obj.samples or 1
+		# Стек длинный, показываем листовой кадр, полный — в подсказке
+		return format_html(
+			'<table>{}</table>',
+			format_html_join('', '<tr><td>{}</td><td>{}%</td><td title="{}"><code>{}</code></td></tr>', (
+				(n, round(100 * n / total, 1), stack.replace(';', '\n'), stack.rsplit(';', 1)[-1])
+				for stack, n in stacks
+			)),
+		)
+
+	@admin.display(description='LLM calls')
+	def llm_spans(self, obj):
+		return format_html(
+			'<table>{}</table>',
+			format_html_join('', '<tr><td>+{} ms</td><td>{} ms</td><td>{}</td><td>{}</td><td>{}</td></tr>', (
+				(span['at_ms'], span['ms'], span['caller'], span['model'], span['outcome']) for span in obj.data['llm']
+			)),
+		)
 
-# Register your models here.
+	@admin.display(description='Slowest SQL')
+	def slow_queries(self, obj):
+		queries = sorted(obj.data['queries'], key=lambda q: -q['ms'])[:PROFILE_TOP]
+		return format_html(
+			'<table>{}</table>',
+			format_html_join('', '<tr><td>+{} ms</td><td>{} ms</td><td>{}</td><td><code>{}</code></td></tr>', (
+				(q['at_ms'], q['ms'], q['db'], q['sql']) for q in queries
+			)),
+		)
@@ -0,0 +1,17 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.services import cascade
+
+
+class Command(BaseCommand):
+    help = "Print per-stage model cascade metrics as JSON lines (calls, latency, escalation rate)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kind", choices=[cascade.KIND_RATION, cascade.KIND_UPDATE], action="append")
+
+    def handle(self, *args, **options):
+        for kind in options["kind"] or [cascade.KIND_RATION, cascade.KIND_UPDATE]:
+            for row in cascade.stats(kind):
+                self.stdout.write(json.dumps({"kind": kind, **row}))
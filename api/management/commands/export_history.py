@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.db import use_replica
+from api.services import export
+
+
+class Command(BaseCommand):
+    help = "Stream plan or intake history as CSV/JSONL, for one user or everyone, in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=export.KINDS)
+        parser.add_argument("--format", choices=export.FORMATS, default="jsonl")
+        parser.add_argument("--username", type=str, help="Export one user; all users by default")
+        parser.add_argument("--since", type=str, help="First day, YYYY-MM-DD (inclusive)")
+        parser.add_argument("--until", type=str, help="Last day, YYYY-MM-DD (inclusive)")
+        parser.add_argument("--output", type=str, help="Path to write to; defaults to stdout")
+
+    def handle(self, *args, **options):
+        try:
+            since, until = export.parse_range(options["since"], options["until"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        out = open(options["output"], "w", encoding="utf-8", newline="") if options["output"] else None
+        # Строки уже с переводом строки; OutputWrapper добавил бы свой
+        write = out.write if out else (lambda line: self.stdout.write(line, ending=""))
+        rows = 0
+        try:
+            with use_replica():
+                for line in export.render(
+                    options["kind"], options["format"], username=options["username"], since=since, until=until
+                ):
+                    write(line)
+                    rows += 1
+        finally:
+            if out:
+                out.close()
+        if options["output"]:
+            self.stderr.write(f"{rows} lines written to {options['output']}")
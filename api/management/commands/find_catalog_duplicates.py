@@ -0,0 +1,18 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.models import CatalogVector
+from api.services import text_index
+
+
+class Command(BaseCommand):
+    help = "List near-duplicate catalog entries as JSON lines (a_id, b_id, similarity)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kind", choices=[CatalogVector.KIND_MEAL, CatalogVector.KIND_PRODUCT], default=CatalogVector.KIND_MEAL)
+        parser.add_argument("--threshold", type=float)
+
+    def handle(self, *args, **options):
+        for a, b, sim in text_index.near_duplicates(options["kind"], options["threshold"]):
+            self.stdout.write(json.dumps({"kind": options["kind"], "a": a, "b": b, "similarity": round(sim, 4)}))
@@ -1,52 +1,19 @@
+import asyncio
+import json
 import os
 import sys
-import json
-import argparse
-from typing import Any, Dict, List, Optional
-
-# Bootstrap Django
-BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-sys.path.insert(0, BASE_DIR)
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nutrition.settings")
-import django  # noqa: E402
-
-django.setup()
-
-from api.models import (  # noqa: E402
-    UserIntake,
-    Product,
-    Meal,
-    DailyRationPlan,
-    DailyRationItem,
-)
-
-def build_args() -> argparse.Namespace:
-    parser = argparse.ArgumentParser(description="Generate a 5-meal daily ration using ChatGPT.")
-    parser.add_argument("--username", type=str, help="Username to load profile from DB")
-
-    # Optional overrides if username not provided or to override
-    parser.add_argument("--display-name", type=str)
-    parser.add_argument("--gender", type=str, choices=["male", "female", "prefer_not_to_say"])
-    parser.add_argument("--age", type=int)
-    parser.add_argument("--height", type=float, help="cm")
-    parser.add_argument("--weight", type=float, help="kg")
-    parser.add_argument("--goal", type=str, choices=["lose_weight", "maintain_weight", "gain_weight"])
-    parser.add_argument("--activity-level", type=str, choices=["low", "medium", "high"])
-    parser.add_argument("--dietary-restrictions", type=str, help="Comma-separated list (e.g. vegetarian,vegan,...) or 'none'")
-    parser.add_argument("--allergies", type=str, help="Comma-separated list of allergies")
-    parser.add_argument("--cooking-skill", type=str, choices=["beginner", "intermediate", "advanced"])
-    parser.add_argument(
-        "--kitchen-equipment",
-        type=str,
-        help="Comma-separated list (e.g. oven,microwave,stovetop,...)",
-    )
-    parser.add_argument("--preferred-units", type=str, choices=["metric", "imperial"], default="metric")
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
 
-    parser.add_argument("--max-products", type=int, default=100)
-    parser.add_argument("--max-meals", type=int, default=100)
-    parser.add_argument("--model", type=str, default=os.getenv("OPENAI_MODEL", "gpt-4o-mini"))
-    parser.add_argument("--output", type=str, help="Path to write JSON output; defaults to stdout")
-    return parser.parse_args()
+from api.models import UserIntake
+from api.services import ledger, llm, prompts
+from api.services.catalog import load_catalog
+from api.services.ration_generator import agenerate_plan, profile_from_intake, save_plan
+
+DEFAULT_CONCURRENCY = 8
 
 
 def _split_list(value: Optional[str]) -> List[str]:
@@ -61,196 +28,243 @@ def load_profile(username: str) -> Optional[Dict[str, Any]]:
         .order_by("-created_at")
         .first()
     )
-    if rec is None:
-        return None
-    return {
-        "username": rec.username,
-        "display_name": rec.display_name,
-        "gender": rec.gender,
-        "age": rec.age,
-        "height_cm": rec.height,
-        "weight_kg": rec.weight,
-        "goal": rec.goal,
-        "activity_level": rec.activity_level,
-        "dietary_restrictions": rec.dietary_restrictions or [],
-        "allergies": rec.allergies or [],
-        "cooking_skill": rec.cooking_skill,
-        "kitchen_equipment": rec.kitchen_equipment or [],
-        "preferred_units": rec.preferred_units,
-    }
+    return profile_from_intake(rec) if rec is not None else None
 
-def build_profile_from_args(args: argparse.Namespace) -> Dict[str, Any]:
-    dr = _split_list(args.dietary_restrictions)
+
+def build_profile_from_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    dr = _split_list(options["dietary_restrictions"])
     if dr == ["none"]:
         dr = []
     return {
-        "username": args.username or "unknown",
-        "display_name": args.display_name or "User",
-        "gender": args.gender or "prefer_not_to_say",
-        "age": args.age or 25,
-        "height_cm": args.height or 175.0,
-        "weight_kg": args.weight or 70.0,
-        "goal": args.goal or "maintain_weight",
-        "activity_level": args.activity_level or "medium",
+        "username": options["username"] or "unknown",
+        "display_name": options["display_name"] or "User",
+        "gender": options["gender"] or "prefer_not_to_say",
+        "age": options["age"] or 25,
+        "height_cm": options["height"] or 175.0,
+        "weight_kg": options["weight"] or 70.0,
+        "goal": options["goal"] or "maintain_weight",
+        "activity_level": options["activity_level"] or "medium",
         "dietary_restrictions": dr,
-        "allergies": _split_list(args.allergies),
-        "cooking_skill": args.cooking_skill or "beginner",
-        "kitchen_equipment": _split_list(args.kitchen_equipment),
-        "preferred_units": args.preferred_units,
+        "allergies": _split_list(options["allergies"]),
+        "cooking_skill": options["cooking_skill"] or "beginner",
+        "kitchen_equipment": _split_list(options["kitchen_equipment"]),
+        "preferred_units": options["preferred_units"],
     }
 
 
-def load_catalog(max_products: int, max_meals: int) -> Dict[str, Any]:
-    products = list(Product.objects.order_by("id")[: max_products or 100])
-    meals = list(Meal.objects.order_by("id")[: max_meals or 100])
-
-    def product_to_dict(p: Product) -> Dict[str, Any]:
-        return {
-            "id": p.id,
-            "name": p.name,
-            "calories": p.calories,
-            "proteins": p.proteins,
-            "carbohydrates": p.carbohydrates,
-            "fats": p.fats,
-            "type": p.type,
-        }
-
-    def meal_to_dict(m: Meal) -> Dict[str, Any]:
-        return {
-            "id": m.id,
-            "name": m.name,
-            "calories": m.calories,
-            "proteins": m.proteins,
-            "carbohydrates": m.carbohydrates,
-            "fats": m.fats,
-            "type": m.type,
-            "recipe": m.recipe,
-        }
+def parse_job(line: str) -> Optional[Dict[str, Any]]:
+    """One input line: ``{"username": ..., "model": ...}``, a JSON string or a bare username."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        job = json.loads(line)
+    except json.JSONDecodeError:
+        job = line
+    if isinstance(job, (int, float)) and not isinstance(job, bool):
+        # Имя из одних цифр разбирается как JSON-число
+        job = line
+    if isinstance(job, str):
+        job = {"username": job}
+    if not isinstance(job, dict) or not job.get("username"):
+        raise CommandError(f"Bad batch line (expected a username): {line[:200]}")
+    return job
 
-    return {
-        "products": [product_to_dict(p) for p in products],
-        "meals": [meal_to_dict(m) for m in meals],
-    }
 
-def build_prompt(profile: Dict[str, Any], catalog: Dict[str, Any]) -> List[Dict[str, str]]:
-    system = (
-        "You are a nutrition assistant. Create a practical daily meal plan using ONLY the provided meals/products. "
-        "Respect the user's allergies, dietary restrictions, goal, and available kitchen equipment. "
-        "Daily ration must have exactly 5 meals. Keep recipes feasible for the user's cooking skill. "
-        "Return only valid JSON that conforms to the specified schema."
-    )
+def parse_where(pairs: List[str]) -> Dict[str, str]:
+    lookups = {}
+    for pair in pairs:
+        field, sep, value = pair.partition("=")
+        if not sep:
+            raise CommandError(f"--where expects field=value, got {pair!r}")
+        lookups[field.strip()] = value.strip()
+    return lookups
 
-    user = {
-        "task": "Generate a 5-meal daily ration.",
-        "constraints": {
-            "use_only_from_catalog": True,
-            "avoid_allergens": profile.get("allergies", []),
-            "dietary_restrictions": profile.get("dietary_restrictions", []),
-            "kitchen_equipment": profile.get("kitchen_equipment", []),
-            "preferred_units": profile.get("preferred_units", "metric"),
-        },
-        "user_profile": profile,
-        "catalog": catalog,
-        "output_schema": {
-            "daily_ration": [
-                {
-                    "name": "string",
-                    "recipe": "string",
-                    "proteins_g": "number",
-                    "carbohydrates_g": "number",
-                    "fats_g": "number",
-                    "fiber_g": "number",
-                }
-            ],
-        },
-        "requirements": [
-            "Exactly 5 items in daily_ration.",
-            "Each item must specify name, recipe, proteins_g, carbohydrates_g, fats_g, fiber_g.",
-            "Prefer existing meals; if needed, compose simple meals from products.",
-            "Macros should be realistic and sum up consistent with goal and activity.",
-            "Exclude any item violating allergies or dietary restrictions.",
-        ],
-    }
 
-    return [
-        {"role": "system", "content": system},
-        {"role": "user", "content": json.dumps(user, ensure_ascii=False)},
-    ]
+def read_checkpoint(path: Optional[str]) -> Set[str]:
+    if not path or not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["username"])
+            except (ValueError, KeyError):
+                # Строка, оборванная падением процесса
+                continue
+    return done
 
-def main() -> None:
-    # Lazy import to avoid dependency if not used
-    try:
-        from openai import OpenAI  # type: ignore
-    except Exception as e:  # pragma: no cover
-        raise RuntimeError("The 'openai' package is required. Install with: pip install openai") from e
 
-    args = build_args()
+class Command(BaseCommand):
+    help = (
+        "Generate a 5-meal daily ration using ChatGPT. With --batch, generate plans for many users "
+        "(JSONL usernames on --input/stdin, or --where filters on intakes) concurrently and stream results as JSONL."
+    )
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY environment variable is not set")
+    def add_arguments(self, parser):
+        parser.add_argument("--username", type=str, help="Username to load profile from DB")
 
-    if args.username:
-        profile = load_profile(args.username)
-    else:
-        profile = None
-    if profile is None:
-        profile = build_profile_from_args(args)
+        # Optional overrides if username not provided or to override
+        parser.add_argument("--display-name", type=str)
+        parser.add_argument("--gender", type=str, choices=["male", "female", "prefer_not_to_say"])
+        parser.add_argument("--age", type=int)
+        parser.add_argument("--height", type=float, help="cm")
+        parser.add_argument("--weight", type=float, help="kg")
+        parser.add_argument("--goal", type=str, choices=["lose_weight", "maintain_weight", "gain_weight"])
+        parser.add_argument("--activity-level", type=str, choices=["low", "medium", "high"])
+        parser.add_argument("--dietary-restrictions", type=str, help="Comma-separated list (e.g. vegetarian,vegan,...) or 'none'")
+        parser.add_argument("--allergies", type=str, help="Comma-separated list of allergies")
+        parser.add_argument("--cooking-skill", type=str, choices=["beginner", "intermediate", "advanced"])
+        parser.add_argument(
+            "--kitchen-equipment",
+            type=str,
+            help="Comma-separated list (e.g. oven,microwave,stovetop,...)",
+        )
+        parser.add_argument("--preferred-units", type=str, choices=["metric", "imperial"], default="metric")
 
-    catalog = load_catalog(args.max_products, args.max_meals)
+        parser.add_argument("--max-products", type=int, help="Defaults to CATALOG_MAX_PRODUCTS")
+        parser.add_argument("--max-meals", type=int, help="Defaults to CATALOG_MAX_MEALS")
+        parser.add_argument("--model", type=str, help="Single mode: defaults to OPENAI_MODEL; batch: the model cascade")
+        parser.add_argument("--output", type=str, help="Path to write JSON output (appended to in batch mode); defaults to stdout")
 
-    messages = build_prompt(profile, catalog)
+        batch = parser.add_argument_group("batch mode")
+        batch.add_argument("--batch", action="store_true", help="Generate plans for many users")
+        batch.add_argument("--input", type=str, default="-", help="JSONL with a username per line; '-' for stdin")
+        batch.add_argument(
+            "--where", action="append", default=[], metavar="FIELD=VALUE",
+            help="Take users whose intake matches these lookups instead of --input, e.g. --where goal=lose_weight",
+        )
+        batch.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Generations in flight at once")
+        batch.add_argument(
+            "--checkpoint", type=str,
+            help="JSONL of finished users; they are skipped on the next run, so a crashed job resumes where it stopped",
+        )
+        batch.add_argument("--include-data", action="store_true", help="Include the generated ration in each result line")
 
-    client = OpenAI(api_key=api_key)
-    completion = client.chat.completions.create(
-        model=args.model,
-        messages=messages,
-        temperature=0.6,
-        response_format={"type": "json_object"},
-    )
+    def handle(self, *args, **options):
+        if options["batch"]:
+            asyncio.run(self.run_batch(options))
+        else:
+            self.run_single(options)
+
+    def run_single(self, options):
+        username = options["username"]
+        profile = load_profile(username) if username else None
+        if profile is None:
+            profile = build_profile_from_options(options)
+
+        catalog = load_catalog(username, options["max_products"], options["max_meals"])
+        messages = prompts.daily_ration(profile, catalog)
+        model = options["model"] or llm.default_model()
+
+        with ledger.context(endpoint="generate_daily_ration", username=username or ""):
+            data = llm.chat_json(messages, model=model, temperature=0.6, caller="ration")
+        if "raw" in data:
+            # Fallback: return raw string if not valid JSON
+            self._write(options["output"], data["raw"] or "")
+            return
 
-    content = completion.choices[0].message.content or "{}"
-    try:
-        data = json.loads(content)
         # Optional persistence
-        if args.username and isinstance(data, dict) and isinstance(data.get("daily_ration"), list):
-            plan = DailyRationPlan.objects.create(
-                username=args.username,
-                model=args.model,
-                raw_response=data,
-            )
-            items: List[dict] = data.get("daily_ration", [])
-            bulk = []
-            for idx, item in enumerate(items, start=1):
-                bulk.append(
-                    DailyRationItem(
-                        plan=plan,
-                        position=idx,
-                        name=str(item.get("name", ""))[:256],
-                        recipe=str(item.get("recipe", "")),
-                        proteins=float(item.get("proteins_g", 0) or 0),
-                        carbohydrates=float(item.get("carbohydrates_g", 0) or 0),
-                        fats=float(item.get("fats_g", 0) or 0),
-                        fiber=float(item.get("fiber_g", 0) or 0),
-                        eaten=False,
-                    )
-                )
-            if bulk:
-                DailyRationItem.objects.bulk_create(bulk)
-        # Output
-        if args.output:
-            with open(args.output, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        else:
-            print(json.dumps(data, ensure_ascii=False, indent=2))
-    except json.JSONDecodeError:
-        # Fallback: return raw string if not valid JSON
-        if args.output:
-            with open(args.output, "w", encoding="utf-8") as f:
+        if username and isinstance(data.get("daily_ration"), list):
+            save_plan(username, model, data, **llm.last_usage())
+        self._write(options["output"], json.dumps(data, ensure_ascii=False, indent=2))
+
+    def _write(self, path: Optional[str], content: str) -> None:
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
                 f.write(content)
         else:
-            print(content)
+            self.stdout.write(content)
+
+    def _usernames(self, options) -> Iterator[Dict[str, Any]]:
+        # Нужны только имена: десятки тысяч строк спокойно помещаются в память
+        qs = (
+            UserIntake.objects.filter(**parse_where(options["where"]))
+            .order_by("username").values_list("username", flat=True).distinct()
+        )
+        return iter([{"username": name} for name in qs])
+
+    def _lines(self, options) -> Iterator[Dict[str, Any]]:
+        stream = sys.stdin if options["input"] == "-" else open(options["input"], encoding="utf-8")
+        with stream:
+            for line in stream:
+                try:
+                    job = parse_job(line)
+                except CommandError as e:
+                    # Плохая строка — отказ по ней одной, а не всей партии
+                    job = {"username": None, "error": str(e)}
+                if job is not None:
+                    yield job
+
+    async def run_batch(self, options):
+        done = read_checkpoint(options["checkpoint"])
+        if options["where"]:
+            jobs = await sync_to_async(self._usernames)(options)
+        else:
+            jobs = self._lines(options)
+        out = open(options["output"], "a", encoding="utf-8") if options["output"] else self.stdout
+        checkpoint = open(options["checkpoint"], "a", encoding="utf-8") if options["checkpoint"] else None
+        semaphore = asyncio.Semaphore(max(options["concurrency"], 1))
+        counts = {"ok": 0, "failed": 0, "skipped": 0}
+        tasks: Set[asyncio.Task] = set()
+        started = time.monotonic()
+
+        def emit(result: Dict[str, Any]) -> None:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            if result["ok"] and checkpoint is not None:
+                # Отметка после сохранения плана: упавший посередине пользователь будет сгенерирован заново
+                checkpoint.write(json.dumps({"username": result["username"], "plan_id": result["plan_id"]}) + "\n")
+                checkpoint.flush()
+            counts["ok" if result["ok"] else "failed"] += 1
 
+        async def generate(job: Dict[str, Any]) -> None:
+            username = job["username"]
+            t0 = time.monotonic()
+            try:
+                with ledger.context(endpoint="generate_daily_ration", username=username):
+                    plan, data = await agenerate_plan(username, job.get("model") or options["model"])
+                result = {"username": username, "ok": True, "plan_id": plan.pk, "model": plan.model}
+                if options["include_data"]:
+                    result["data"] = data
+            except Exception as e:
+                result = {"username": username, "ok": False, "error": f"{type(e).__name__}: {e}"}
+            finally:
+                semaphore.release()
+            result["ms"] = int((time.monotonic() - t0) * 1000)
+            emit(result)
 
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+        try:
+            while True:
+                # Чтение stdin блокирует, поэтому в потоке: event loop продолжает обслуживать генерации
+                job = await asyncio.to_thread(next, jobs, None)
+                if job is None:
+                    break
+                if "error" in job:
+                    emit({"username": job["username"], "ok": False, "error": job["error"]})
+                    continue
+                if job["username"] in done:
+                    counts["skipped"] += 1
+                    continue
+                done.add(job["username"])
+                # Задача создаётся только при свободном слоте: входной поток читается не быстрее, чем идут генерации
+                await semaphore.acquire()
+                task = asyncio.create_task(generate(job))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            # При сбое генерации в полёте отменяются и дожидаются: их emit() не должен писать в закрытые файлы
+            for task in list(tasks):
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            if checkpoint is not None:
+                checkpoint.close()
+            if out is not self.stdout:
+                out.close()
+        self.stderr.write(
+            f"{counts['ok']} generated, {counts['failed']} failed, {counts['skipped']} skipped (checkpoint) "
+            f"in {time.monotonic() - started:.1f}s"
+        )
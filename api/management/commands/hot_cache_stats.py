@@ -0,0 +1,13 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.services import hot_cache
+
+
+class Command(BaseCommand):
+    help = "Print hot_cache hit rates per namespace as JSON lines (summed over all processes)."
+
+    def handle(self, *args, **options):
+        for namespace, row in sorted(hot_cache.stats().items()):
+            self.stdout.write(json.dumps({"namespace": namespace, **row}))
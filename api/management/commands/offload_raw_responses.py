@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import DailyRationPlan, DailyRationResponse
+from api.services.compression import compress_json
+
+
+class Command(BaseCommand):
+    help = "Move legacy DailyRationPlan.raw_response JSON into the compressed DailyRationResponse table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        # Базовый менеджер без defer: здесь нам нужен именно столбец raw_response
+        legacy = DailyRationPlan._base_manager.filter(raw_response__isnull=False).order_by("pk")
+        last_pk = 0
+        moved = 0
+        while True:
+            rows = list(legacy.filter(pk__gt=last_pk).values_list("pk", "raw_response")[:batch_size])
+            if not rows:
+                break
+            archived = []
+            for pk, data in rows:
+                codec, body, size = compress_json(data)
+                archived.append(DailyRationResponse(plan_id=pk, codec=codec, body=body, size=size))
+            with transaction.atomic():
+                DailyRationResponse.objects.bulk_create(archived, ignore_conflicts=True)
+                DailyRationPlan._base_manager.filter(pk__in=[pk for pk, _ in rows]).update(raw_response=None)
+            moved += len(rows)
+            last_pk = rows[-1][0]
+            self.stdout.write(f"offloaded {moved} responses (last plan id {last_pk})")
+        self.stdout.write(self.style.SUCCESS(f"Done: {moved} responses offloaded"))
@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.services import plan_history
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive daily ration plans older than the hot retention window and purge "
+        "archived history past the retention policy, in small chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hot-days", type=int, default=settings.RATION_HISTORY_HOT_DAYS)
+        parser.add_argument("--retention-months", type=int, default=settings.RATION_HISTORY_RETENTION_MONTHS,
+                            help="Drop archived plans older than this many months; 0 keeps them forever")
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--sleep", type=float, default=0.05, help="Pause between chunks, seconds")
+        parser.add_argument("--max-chunks", type=int, default=0, help="Stop after N chunks per phase; 0 = no limit")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        hot_cutoff, archive_cutoff = plan_history.retention_cutoffs(options["hot_days"], options["retention_months"])
+
+        oldest = plan_history.oldest_hot_plan()
+        if oldest and oldest < hot_cutoff:
+            plan_history.ensure_partitions(oldest, hot_cutoff)
+        archived = self._run_chunks(lambda: plan_history.archive_chunk(hot_cutoff, chunk_size), options)
+        self.stdout.write(f"archived {archived} plans created before {hot_cutoff:%Y-%m-%d}")
+
+        if archive_cutoff is None:
+            return
+        dropped = plan_history.drop_expired_partitions(archive_cutoff.date())
+        for name in dropped:
+            self.stdout.write(f"dropped partition {name}")
+        # Остатки (DEFAULT-секция или не-Postgres) удаляем порциями
+        purged = self._run_chunks(lambda: plan_history.purge_archive_chunk(archive_cutoff, chunk_size), options)
+        self.stdout.write(f"purged {purged} archived plans created before {archive_cutoff:%Y-%m-%d}")
+
+    def _run_chunks(self, step, options) -> int:
+        total = 0
+        chunks = 0
+        while True:
+            done = step()
+            total += done
+            chunks += 1
+            if not done or (options["max_chunks"] and chunks >= options["max_chunks"]):
+                return total
+            time.sleep(options["sleep"])
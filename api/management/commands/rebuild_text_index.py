@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.models import CatalogVector
+from api.services import text_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the hashed TF-IDF vectors for catalog meals and products."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--kind", choices=[CatalogVector.KIND_MEAL, CatalogVector.KIND_PRODUCT], action="append")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for kind in options["kind"] or [CatalogVector.KIND_MEAL, CatalogVector.KIND_PRODUCT]:
+            total = text_index.rebuild(kind, batch_size=options["batch_size"])
+            self.stdout.write(f"{kind}: indexed {total} rows")
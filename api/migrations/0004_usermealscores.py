@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 23:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0003_meal_user_meal_weight_product_user_product_weight_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserMealScores",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("username", models.CharField(max_length=64, unique=True)),
+                ("scores", models.JSONField(default=list)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
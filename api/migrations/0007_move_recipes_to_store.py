@@ -0,0 +1,88 @@
+import hashlib
+import zlib
+
+from django.db import migrations
+
+CHUNK_SIZE = 1000
+
+
+# Копии api.services.compression на момент миграции: исторические миграции не импортируют
+# код приложения, который может измениться
+def content_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress_text(text):
+    return zlib.compress(text.encode("utf-8"), 9)
+
+
+def decompress_text(blob):
+    return zlib.decompress(bytes(blob)).decode("utf-8")
+
+
+def _intern_batch(Recipe, Model, batch):
+    by_digest = {}
+    for row in batch:
+        row.recipe_ref_id = content_digest(row.recipe)
+        by_digest[row.recipe_ref_id] = row.recipe
+    existing = set(
+        Recipe.objects.filter(digest__in=by_digest).values_list("digest", flat=True)
+    )
+    Recipe.objects.bulk_create(
+        [
+            Recipe(digest=d, body=compress_text(t), size=len(t))
+            for d, t in by_digest.items()
+            if d not in existing
+        ],
+        ignore_conflicts=True,
+    )
+    Model.objects.bulk_update(batch, ["recipe_ref"], batch_size=CHUNK_SIZE)
+
+
+def _intern_rows(apps, model_name):
+    Recipe = apps.get_model("api", "Recipe")
+    Model = apps.get_model("api", model_name)
+    rows = (
+        Model.objects.filter(recipe_ref__isnull=True)
+        .exclude(recipe="")
+        .order_by("pk")
+        .only("pk", "recipe")
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= CHUNK_SIZE:
+            _intern_batch(Recipe, Model, batch)
+            batch = []
+    if batch:
+        _intern_batch(Recipe, Model, batch)
+
+
+def forwards(apps, schema_editor):
+    _intern_rows(apps, "Meal")
+    _intern_rows(apps, "DailyRationItem")
+
+
+def backwards(apps, schema_editor):
+    Recipe = apps.get_model("api", "Recipe")
+    for model_name in ("Meal", "DailyRationItem"):
+        Model = apps.get_model("api", model_name)
+        for digest in (
+            Model.objects.filter(recipe_ref__isnull=False)
+            .values_list("recipe_ref_id", flat=True)
+            .distinct()
+            .iterator()
+        ):
+            text = decompress_text(Recipe.objects.get(pk=digest).body)
+            Model.objects.filter(recipe_ref_id=digest).update(recipe=text)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0006_recipe"),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
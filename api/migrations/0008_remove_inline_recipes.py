@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0007_move_recipes_to_store"),
+    ]
+
+    # The default only exists so the migration can be reversed on populated tables.
+    operations = [
+        migrations.AlterField(
+            model_name="dailyrationitem",
+            name="recipe",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AlterField(
+            model_name="meal",
+            name="recipe",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.RemoveField(
+            model_name="dailyrationitem",
+            name="recipe",
+        ),
+        migrations.RemoveField(
+            model_name="meal",
+            name="recipe",
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-18 23:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0008_remove_inline_recipes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyRationResponse",
+            fields=[
+                (
+                    "plan",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to="api.dailyrationplan",
+                    ),
+                ),
+                ("codec", models.CharField(max_length=8)),
+                ("body", models.BinaryField()),
+                ("size", models.PositiveIntegerField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,77 @@
+from django.db import migrations, models
+
+ARCHIVE_TABLE = "api_dailyrationplanarchive"
+
+POSTGRES_SQL = [
+    f"""
+    CREATE TABLE {ARCHIVE_TABLE} (
+        plan_id bigint NOT NULL,
+        username varchar(64) NOT NULL,
+        model varchar(64) NULL,
+        created_at timestamp with time zone NOT NULL,
+        items jsonb NOT NULL,
+        archived_at timestamp with time zone NOT NULL,
+        PRIMARY KEY (plan_id, created_at)
+    ) PARTITION BY RANGE (created_at)
+    """,
+    f"CREATE TABLE {ARCHIVE_TABLE}_default PARTITION OF {ARCHIVE_TABLE} DEFAULT",
+    f"CREATE INDEX api_planarchive_user_idx ON {ARCHIVE_TABLE} (username, created_at)",
+]
+
+
+def create_archive(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        for sql in POSTGRES_SQL:
+            schema_editor.execute(sql)
+    else:
+        schema_editor.create_model(apps.get_model("api", "DailyRationPlanArchive"))
+
+
+def drop_archive(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model("api", "DailyRationPlanArchive"))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0009_dailyrationresponse"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="DailyRationPlanArchive",
+                    fields=[
+                        (
+                            "plan_id",
+                            models.BigIntegerField(primary_key=True, serialize=False),
+                        ),
+                        ("username", models.CharField(max_length=64)),
+                        (
+                            "model",
+                            models.CharField(blank=True, max_length=64, null=True),
+                        ),
+                        ("created_at", models.DateTimeField()),
+                        ("items", models.JSONField(default=list)),
+                        ("archived_at", models.DateTimeField(auto_now_add=True)),
+                    ],
+                    options={
+                        "indexes": [
+                            models.Index(
+                                fields=["username", "created_at"],
+                                name="api_planarchive_user_idx",
+                            )
+                        ],
+                    },
+                ),
+            ],
+        ),
+        # The table itself is created by hand so Postgres gets a partitioned one.
+        migrations.RunPython(create_archive, drop_archive),
+        migrations.AddIndex(
+            model_name="dailyrationplan",
+            index=models.Index(
+                fields=["username", "-created_at"], name="api_plan_user_created_idx"
+            ),
+        ),
+    ]
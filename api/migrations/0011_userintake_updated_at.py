@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-18 23:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0010_plan_history"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userintake",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-18 23:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0011_userintake_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WeeklyRationPlan",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("username", models.CharField(max_length=64)),
+                ("model", models.CharField(blank=True, max_length=64, null=True)),
+                ("start_date", models.DateField()),
+                ("days", models.PositiveSmallIntegerField(default=7)),
+                ("variety_issues", models.JSONField(blank=True, default=list)),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="dailyrationplan",
+            name="day_index",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="dailyrationplan",
+            name="plan_date",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="dailyrationplan",
+            name="week",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="day_plans",
+                to="api.weeklyrationplan",
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 23:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0013_dailyrationplan_llm_usage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dailyrationplan",
+            name="intake",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="api.userintake",
+            ),
+        ),
+        migrations.AddField(
+            model_name="dailyrationplan",
+            name="speculative",
+            field=models.BooleanField(default=False),
+        ),
+    ]
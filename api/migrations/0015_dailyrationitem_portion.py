@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-18 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0014_speculative_plans"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dailyrationitem",
+            name="portion",
+            field=models.FloatField(default=1.0),
+        ),
+        migrations.AddField(
+            model_name="dailyrationitem",
+            name="weight",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
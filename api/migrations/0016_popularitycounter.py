@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 23:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0015_dailyrationitem_portion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PopularityCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("kind", models.CharField(max_length=16)),
+                ("object_id", models.BigIntegerField()),
+                ("likes", models.IntegerField(default=0)),
+                ("dislikes", models.IntegerField(default=0)),
+                ("favorites", models.IntegerField(default=0)),
+                ("score", models.IntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["kind", "-score"], name="api_popularity_score_idx"
+                    )
+                ],
+                "unique_together": {("kind", "object_id")},
+            },
+        ),
+    ]
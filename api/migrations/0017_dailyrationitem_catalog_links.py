@@ -0,0 +1,58 @@
+# Generated by Django 5.2.5 on 2026-10-18 23:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _source(apps, model_name):
+    # Личная запись владельца плана важнее одноимённой глобальной
+    Plan = apps.get_model("api", "DailyRationPlan")
+    owner = Plan.objects.filter(pk=OuterRef(OuterRef("plan_id"))).values("username")[:1]
+    rows = apps.get_model("api", model_name).objects.filter(
+        name__iexact=OuterRef("name")
+    )
+    personal = rows.filter(user__username=Subquery(owner)).values("id")[:1]
+    shared = rows.filter(user__isnull=True).values("id")[:1]
+    return Coalesce(Subquery(personal), Subquery(shared))
+
+
+def link_items(apps, schema_editor):
+    Item = apps.get_model("api", "DailyRationItem")
+    Item.objects.filter(meal__isnull=True).update(meal_id=_source(apps, "Meal"))
+    Item.objects.filter(meal__isnull=True, product__isnull=True).update(
+        product_id=_source(apps, "Product")
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0016_popularitycounter"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dailyrationitem",
+            name="meal",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="api.meal",
+            ),
+        ),
+        migrations.AddField(
+            model_name="dailyrationitem",
+            name="product",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="api.product",
+            ),
+        ),
+        migrations.RunPython(link_items, migrations.RunPython.noop),
+    ]
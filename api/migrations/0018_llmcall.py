@@ -0,0 +1,57 @@
+# Generated by Django 5.2.5 on 2026-10-18 23:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0017_dailyrationitem_catalog_links"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LLMCall",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(db_index=True)),
+                ("model", models.CharField(max_length=64)),
+                ("prompt_hash", models.CharField(max_length=64)),
+                ("caller", models.CharField(blank=True, max_length=64)),
+                ("endpoint", models.CharField(blank=True, max_length=128)),
+                ("username", models.CharField(blank=True, max_length=64)),
+                ("outcome", models.CharField(max_length=16)),
+                ("error", models.CharField(blank=True, max_length=256)),
+                ("latency_ms", models.IntegerField()),
+                ("first_token_ms", models.IntegerField(blank=True, null=True)),
+                ("prompt_tokens", models.IntegerField(blank=True, null=True)),
+                ("cached_tokens", models.IntegerField(blank=True, null=True)),
+                ("completion_tokens", models.IntegerField(blank=True, null=True)),
+                ("cache_hit", models.BooleanField(default=False)),
+                (
+                    "cost_usd",
+                    models.DecimalField(
+                        blank=True, decimal_places=6, max_digits=12, null=True
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["endpoint", "created_at"],
+                        name="api_llmcall_endpoint_idx",
+                    ),
+                    models.Index(
+                        fields=["username", "created_at"], name="api_llmcall_user_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-19 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0018_llmcall"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RequestProfile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+                ("username", models.CharField(max_length=64)),
+                ("method", models.CharField(max_length=8)),
+                ("path", models.CharField(max_length=512)),
+                ("view_name", models.CharField(blank=True, max_length=128)),
+                (
+                    "status_code",
+                    models.PositiveSmallIntegerField(blank=True, null=True),
+                ),
+                ("duration_ms", models.IntegerField()),
+                ("sql_count", models.IntegerField(default=0)),
+                ("sql_ms", models.IntegerField(default=0)),
+                ("llm_count", models.IntegerField(default=0)),
+                ("llm_ms", models.IntegerField(default=0)),
+                ("samples", models.IntegerField(default=0)),
+                ("codec", models.CharField(max_length=8)),
+                ("body", models.BinaryField()),
+                ("size", models.PositiveIntegerField()),
+            ],
+        ),
+    ]
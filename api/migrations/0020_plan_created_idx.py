@@ -0,0 +1,16 @@
+# Generated by Django 5.2.5 on 2026-10-19 00:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api", "0019_requestprofile"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="dailyrationplan",
+            index=models.Index(fields=["created_at"], name="api_plan_created_idx"),
+        ),
+    ]
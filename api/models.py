@@ -1,5 +1,11 @@
 from django.db import models
+from django.db.models.functions import Coalesce, TruncDate
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from api.services.compression import (
+	content_digest, compress_text, decompress_text, compress_json, decompress_json,
+)
 
 # Create your models here.
 class UserIntake(models.Model):
@@ -25,10 +31,80 @@ class UserIntake(models.Model):
 	target_carbohydrates = models.FloatField(null=True, blank=True)
 	target_fats = models.FloatField(null=True, blank=True)
 	created_at = models.DateTimeField(auto_now_add=True)
+	# Версия записи для ETag/кэша; меняется и при пересчёте целей
+	updated_at = models.DateTimeField(auto_now=True)
 
 	class Meta:
 		indexes = [models.Index(fields=["username"])]
 
+class RecipeManager(models.Manager):
+	def intern(self, text):
+		"""Return the shared Recipe row for ``text``, creating it if needed."""
+		if not text:
+			return None
+		digest = content_digest(text)
+		recipe, _ = self.get_or_create(
+			digest=digest,
+			defaults={'body': compress_text(text), 'size': len(text)},
+		)
+		return recipe
+
+	def intern_many(self, texts):
+		"""Bulk variant of ``intern``: returns {text: digest}, two queries at most."""
+		by_digest = {content_digest(t): t for t in set(texts) if t}
+		if not by_digest:
+			return {}
+		existing = set(self.filter(digest__in=by_digest).values_list('digest', flat=True))
+		self.bulk_create(
+			[Recipe(digest=d, body=compress_text(t), size=len(t)) for d, t in by_digest.items() if d not in existing],
+			ignore_conflicts=True,
+		)
+		return {t: d for d, t in by_digest.items()}
+
+	def attach(self, objs):
+		"""Intern pending recipe texts of unsaved objects before ``bulk_create``."""
+		digests = self.intern_many(o._recipe_text for o in objs if o._recipe_dirty)
+		for o in objs:
+			if o._recipe_dirty:
+				o.recipe_ref_id = digests.get(o._recipe_text)
+				o._recipe_dirty = False
+		return objs
+
+class Recipe(models.Model):
+	# sha256 текста рецепта; одинаковые рецепты хранятся один раз
+	digest = models.CharField(max_length=64, primary_key=True)
+	body = models.BinaryField()
+	size = models.PositiveIntegerField()
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	objects = RecipeManager()
+
+	@property
+	def text(self):
+		return decompress_text(self.body)
+
+class RecipeTextMixin:
+	"""Exposes ``recipe`` as plain text while storing it in the shared Recipe table."""
+	_recipe_text = None
+	_recipe_dirty = False
+
+	@property
+	def recipe(self):
+		if self._recipe_text is None:
+			self._recipe_text = self.recipe_ref.text if self.recipe_ref_id else ''
+		return self._recipe_text
+
+	@recipe.setter
+	def recipe(self, value):
+		self._recipe_text = value or ''
+		self._recipe_dirty = True
+
+	def save(self, *args, **kwargs):
+		if self._recipe_dirty:
+			self.recipe_ref = Recipe.objects.intern(self._recipe_text)
+			self._recipe_dirty = False
+		super().save(*args, **kwargs)
+
 class Product(models.Model):
 	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='products', null=True, blank=True)
 	name = models.CharField(max_length=128)
@@ -40,7 +116,7 @@ class Product(models.Model):
 	weight = models.FloatField()
 	created_at = models.DateTimeField(auto_now_add=True)
 	
-class Meal(models.Model):
+class Meal(RecipeTextMixin, models.Model):
 	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='meals', null=True, blank=True)
 	name = models.CharField(max_length=128)
 	calories = models.FloatField()
@@ -49,7 +125,7 @@ class Meal(models.Model):
 	carbohydrates = models.FloatField()
 	fats = models.FloatField()
 	weight = models.FloatField()
-	recipe = models.TextField()
+	recipe_ref = models.ForeignKey(Recipe, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
 	created_at = models.DateTimeField(auto_now_add=True)
 
 class ProductFavorite(models.Model):
@@ -86,20 +162,221 @@ class MealReaction(models.Model):
 	class Meta:
 		unique_together = ("meal", "username")
 
+class WeeklyRationPlan(models.Model):
+	username = models.CharField(max_length=64)
+	model = models.CharField(max_length=64, null=True, blank=True)
+	start_date = models.DateField()
+	days = models.PositiveSmallIntegerField(default=7)
+	# Нарушения ограничений разнообразия, найденные локальной проверкой
+	variety_issues = models.JSONField(default=list, blank=True)
+	completed_at = models.DateTimeField(null=True, blank=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+
+class DailyRationPlanManager(models.Manager):
+	def get_queryset(self):
+		# Сырой ответ LLM живёт в DailyRationResponse; старый столбец не тянем в списки
+		return super().get_queryset().defer('raw_response')
+
+	def current_for(self, username, day=None):
+		"""Plans of ``username`` relevant on ``day`` (today by default), latest day first.
+
+		Days of a weekly plan dated in the future are skipped until their date comes;
+		speculative plans stay hidden until claimed.
+		"""
+		day = day or timezone.localdate()
+		return (
+			self.filter(username=username, speculative=False)
+			.filter(models.Q(plan_date__isnull=True) | models.Q(plan_date__lte=day))
+			# День недельного плана относится к plan_date, а не ко времени генерации всей недели
+			.order_by(Coalesce('plan_date', TruncDate('created_at')).desc(), '-created_at')
+		)
+
 class DailyRationPlan(models.Model):
 	username = models.CharField(max_length=64)
 	model = models.CharField(max_length=64, null=True, blank=True)
+	week = models.ForeignKey(WeeklyRationPlan, on_delete=models.CASCADE, null=True, blank=True, related_name='day_plans')
+	day_index = models.PositiveSmallIntegerField(null=True, blank=True)
+	plan_date = models.DateField(null=True, blank=True)
+	# Анкета, по которой сгенерирован план
+	intake = models.ForeignKey(UserIntake, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+	# Сгенерирован заранее после анкеты; становится видимым при первом нажатии Generate
+	speculative = models.BooleanField(default=False)
+	# Учёт LLM-вызова, породившего план (cached_tokens — попадание в кэш префикса)
+	prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+	cached_tokens = models.PositiveIntegerField(null=True, blank=True)
+	completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+	latency_ms = models.PositiveIntegerField(null=True, blank=True)
+	# Legacy: заполняется только у старых строк до offload_raw_responses
 	raw_response = models.JSONField(null=True, blank=True)
 	created_at = models.DateTimeField(auto_now_add=True)
 
-class DailyRationItem(models.Model):
+	objects = DailyRationPlanManager()
+
+	class Meta:
+		indexes = [
+			# "План на сегодня" — всегда последний план пользователя
+			models.Index(fields=["username", "-created_at"], name="api_plan_user_created_idx"),
+			# Диапазоны дат по всем пользователям: выгрузка для аналитиков, архивация
+			models.Index(fields=["created_at"], name="api_plan_created_idx"),
+		]
+
+	@property
+	def response(self):
+		"""The full LLM response, loaded lazily from the side table."""
+		if not hasattr(self, '_response'):
+			archived = DailyRationResponse.objects.filter(plan_id=self.pk).first()
+			self._response = archived.data if archived else self.raw_response
+		return self._response
+
+	def store_response(self, data):
+		DailyRationResponse.objects.store(self, data)
+		self._response = data
+
+class DailyRationResponseManager(models.Manager):
+	def store(self, plan, data):
+		codec, body, size = compress_json(data)
+		return self.update_or_create(plan=plan, defaults={'codec': codec, 'body': body, 'size': size})[0]
+
+class DailyRationResponse(models.Model):
+	plan = models.OneToOneField(DailyRationPlan, on_delete=models.CASCADE, primary_key=True, related_name='+')
+	codec = models.CharField(max_length=8)
+	body = models.BinaryField()
+	# Размер несжатого JSON в байтах
+	size = models.PositiveIntegerField()
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	objects = DailyRationResponseManager()
+
+	@property
+	def data(self):
+		return decompress_json(self.codec, self.body)
+
+class DailyRationItem(RecipeTextMixin, models.Model):
 	plan = models.ForeignKey(DailyRationPlan, on_delete=models.CASCADE)
 	position = models.PositiveIntegerField()
 	name = models.CharField(max_length=256)
-	recipe = models.TextField()
+	# Источник позиции в каталоге, определяется при генерации (см. catalog.link_items)
+	meal = models.ForeignKey(Meal, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+	product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+	recipe_ref = models.ForeignKey(Recipe, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
 	proteins = models.FloatField()
 	carbohydrates = models.FloatField()
 	fats = models.FloatField()
 	fiber = models.FloatField()
+	# Множитель порции относительно базовой (Meal.weight / Product.weight); макросы уже умножены на него
+	portion = models.FloatField(default=1.0)
+	# Вес порции в граммах, если позиция связана с блюдом/продуктом каталога
+	weight = models.FloatField(null=True, blank=True)
 	eaten = models.BooleanField(default=False)
-	created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+	created_at = models.DateTimeField(auto_now_add=True)
+
+class UserMealScores(models.Model):
+	username = models.CharField(max_length=64, unique=True)
+	# [[meal_id, score], ...] — top-N по убыванию score, пересчитывается офлайн
+	scores = models.JSONField(default=list)
+	updated_at = models.DateTimeField(auto_now=True)
+
+
+class CatalogVector(models.Model):
+	KIND_MEAL = 'meal'
+	KIND_PRODUCT = 'product'
+
+	kind = models.CharField(max_length=16)
+	object_id = models.BigIntegerField()
+	# float32 hashed term-frequency vector (см. api/services/text_index.py)
+	vector = models.BinaryField()
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		unique_together = ("kind", "object_id")
+
+
+class PopularityCounter(models.Model):
+	"""Like/dislike/favorite counts per catalog item (см. api/services/popularity.py)."""
+	KIND_MEAL = 'meal'
+	KIND_PRODUCT = 'product'
+
+	kind = models.CharField(max_length=16)
+	object_id = models.BigIntegerField()
+	likes = models.IntegerField(default=0)
+	dislikes = models.IntegerField(default=0)
+	favorites = models.IntegerField(default=0)
+	# likes + favorites - dislikes; по нему сортируется каталог
+	score = models.IntegerField(default=0)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		unique_together = ("kind", "object_id")
+		indexes = [models.Index(fields=["kind", "-score"], name="api_popularity_score_idx")]
+
+
+class LLMCall(models.Model):
+	"""Append-only ledger of LLM calls, written in batches (см. api/services/ledger.py)."""
+	OUTCOME_OK = 'ok'
+	OUTCOME_INVALID_JSON = 'invalid_json'
+	OUTCOME_ERROR = 'error'
+
+	created_at = models.DateTimeField(db_index=True)
+	model = models.CharField(max_length=64)
+	# sha256 сообщений промпта: одинаковые запросы видны без хранения текста
+	prompt_hash = models.CharField(max_length=64)
+	caller = models.CharField(max_length=64, blank=True)
+	# Имя view или Celery-задачи, из которой сделан вызов
+	endpoint = models.CharField(max_length=128, blank=True)
+	username = models.CharField(max_length=64, blank=True)
+	outcome = models.CharField(max_length=16)
+	error = models.CharField(max_length=256, blank=True)
+	latency_ms = models.IntegerField()
+	first_token_ms = models.IntegerField(null=True, blank=True)
+	prompt_tokens = models.IntegerField(null=True, blank=True)
+	cached_tokens = models.IntegerField(null=True, blank=True)
+	completion_tokens = models.IntegerField(null=True, blank=True)
+	cache_hit = models.BooleanField(default=False)
+	cost_usd = models.DecimalField(max_digits=12, decimal_places=6, null=True, blank=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=["endpoint", "created_at"], name="api_llmcall_endpoint_idx"),
+			models.Index(fields=["username", "created_at"], name="api_llmcall_user_idx"),
+		]
+
+
+class RequestProfile(models.Model):
+	"""A staff-requested profile of one request (см. api/services/profiling.py)."""
+	created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+	username = models.CharField(max_length=64)
+	method = models.CharField(max_length=8)
+	path = models.CharField(max_length=512)
+	view_name = models.CharField(max_length=128, blank=True)
+	status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+	duration_ms = models.IntegerField()
+	sql_count = models.IntegerField(default=0)
+	sql_ms = models.IntegerField(default=0)
+	llm_count = models.IntegerField(default=0)
+	llm_ms = models.IntegerField(default=0)
+	samples = models.IntegerField(default=0)
+	# Сжатый JSON: {"stacks": {свёрнутый стек: число сэмплов}, "queries": [...], "llm": [...]}
+	codec = models.CharField(max_length=8)
+	body = models.BinaryField()
+	size = models.PositiveIntegerField()
+
+	@property
+	def data(self):
+		return decompress_json(self.codec, self.body)
+
+
+class DailyRationPlanArchive(models.Model):
+	# На Postgres таблица секционирована по месяцам (RANGE по created_at) и
+	# имеет составной PK (plan_id, created_at); см. миграцию 0010 и
+	# api/services/plan_history.py. На других БД это обычная таблица.
+	plan_id = models.BigIntegerField(primary_key=True)
+	username = models.CharField(max_length=64)
+	model = models.CharField(max_length=64, null=True, blank=True)
+	created_at = models.DateTimeField()
+	# [{position, name, recipe_digest, meal_id, product_id, proteins, carbohydrates, fats, fiber,
+	#   portion, weight, eaten}, ...]; сырой ответ LLM в архив не переносится
+	items = models.JSONField(default=list)
+	archived_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		indexes = [models.Index(fields=["username", "created_at"], name="api_planarchive_user_idx")]
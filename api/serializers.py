@@ -12,6 +12,8 @@ class ProductSerializer(serializers.ModelSerializer):
 		fields = '__all__'
 
 class MealSerializer(serializers.ModelSerializer):
+	recipe = serializers.CharField(allow_blank=True)
+
 	class Meta:
 		model = models.Meal
 		fields = '__all__'
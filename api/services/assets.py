@@ -0,0 +1,186 @@
+# api/services/assets.py
+"""Dependency-free CSS/JS bundling and minification for the static pipeline.
+
+The minifiers are deliberately conservative: comments and redundant
+whitespace go away, string/template/regex literals are copied verbatim and
+JS keeps its line breaks so automatic semicolon insertion is unaffected.
+"""
+import re
+from pathlib import Path
+from typing import Iterable, List
+
+# Символы, после которых "/" в JS начинает регулярное выражение, а не деление
+_REGEX_PREFIX = set("(,=:[!&|?{};+-*%<>~^")
+_REGEX_KEYWORDS = ("return", "typeof", "case", "do", "else", "in", "of", "void", "yield", "await")
+
+_JS_BLANK_RE = re.compile(r"[ \t]*\n\s*")
+_JS_SPACES_RE = re.compile(r"[ \t]+")
+
+_CSS_SPACES_RE = re.compile(r"\s+")
+# Пробел перед ":" не трогаем: "a :hover" и "a:hover" — разные селекторы
+_CSS_PUNCT_RE = re.compile(r"\s*([{};,>])\s*")
+_CSS_COLON_RE = re.compile(r":\s+")
+
+
+def _read_string(src: str, i: int) -> int:
+    """Index just past the quoted string starting at ``src[i]``."""
+    quote = src[i]
+    i += 1
+    while i < len(src):
+        ch = src[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == quote or ch == "\n":
+            return i + 1
+        i += 1
+    return i
+
+
+def _read_template(src: str, i: int) -> int:
+    """Index just past the template literal starting at ``src[i]``; handles nested ``${}``."""
+    i += 1
+    while i < len(src):
+        ch = src[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == "`":
+            return i + 1
+        if src.startswith("${", i):
+            i = _read_code_block(src, i + 2)
+            continue
+        i += 1
+    return i
+
+
+def _read_code_block(src: str, i: int) -> int:
+    """Index just past the ``}`` closing a ``${`` expression."""
+    depth = 1
+    while i < len(src):
+        ch = src[i]
+        if ch in "'\"":
+            i = _read_string(src, i)
+            continue
+        if ch == "`":
+            i = _read_template(src, i)
+            continue
+        if ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+
+def _read_regex(src: str, i: int) -> int:
+    i += 1
+    in_class = False
+    while i < len(src):
+        ch = src[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == "\n":
+            return i
+        if ch == "[":
+            in_class = True
+        elif ch == "]":
+            in_class = False
+        elif ch == "/" and not in_class:
+            i += 1
+            while i < len(src) and (src[i].isalnum() or src[i] == "_"):
+                i += 1
+            return i
+        i += 1
+    return i
+
+
+def _regex_allowed(out: List[str]) -> bool:
+    text = "".join(out[-3:]).rstrip()
+    if not text:
+        return True
+    if text[-1] in _REGEX_PREFIX:
+        return True
+    return any(text.endswith(k) and (len(text) == len(k) or not (text[-len(k) - 1].isalnum() or text[-len(k) - 1] in "_$"))
+               for k in _REGEX_KEYWORDS)
+
+
+def _squeeze_js(code: str) -> str:
+    code = _JS_BLANK_RE.sub("\n", code)
+    return _JS_SPACES_RE.sub(" ", code)
+
+
+def minify_js(src: str) -> str:
+    out: List[str] = []
+    i = 0
+    n = len(src)
+    while i < n:
+        ch = src[i]
+        if ch in "'\"":
+            j = _read_string(src, i)
+            out.append(src[i:j])
+            i = j
+        elif ch == "`":
+            j = _read_template(src, i)
+            out.append(src[i:j])
+            i = j
+        elif src.startswith("//", i):
+            j = src.find("\n", i)
+            i = n if j == -1 else j
+        elif src.startswith("/*", i):
+            j = src.find("*/", i + 2)
+            j = n if j == -1 else j + 2
+            # Перевод строки внутри комментария важен для ASI
+            out.append("\n" if "\n" in src[i:j] else " ")
+            i = j
+        elif ch == "/" and _regex_allowed(out):
+            j = _read_regex(src, i)
+            out.append(src[i:j])
+            i = j
+        else:
+            j = i + 1
+            while j < n and src[j] not in "'\"`/":
+                j += 1
+            out.append(_squeeze_js(src[i:j]))
+            i = j
+    return "".join(out).strip() + "\n"
+
+
+def minify_css(src: str) -> str:
+    out: List[str] = []
+    i = 0
+    n = len(src)
+    while i < n:
+        ch = src[i]
+        if ch in "'\"":
+            j = _read_string(src, i)
+            out.append(src[i:j])
+        elif src.startswith("/*", i):
+            j = src.find("*/", i + 2)
+            j = n if j == -1 else j + 2
+        else:
+            j = i + 1
+            while j < n and src[j] not in "'\"" and not src.startswith("/*", j):
+                j += 1
+            code = _CSS_SPACES_RE.sub(" ", src[i:j])
+            code = _CSS_PUNCT_RE.sub(r"\1", code)
+            out.append(_CSS_COLON_RE.sub(":", code))
+        i = j
+    return "".join(out).replace(";}", "}").strip() + "\n"
+
+
+def bundle(paths: Iterable[Path], kind: str) -> str:
+    """Concatenate and minify ``paths`` (``kind`` is ``"css"`` or ``"js"``)."""
+    minify = minify_css if kind == "css" else minify_js
+    parts = []
+    for path in paths:
+        body = minify(Path(path).read_text(encoding="utf-8"))
+        if kind == "js":
+            # Файлы общаются через window.*, а их верхнеуровневые const/let
+            # пересекаются по именам; блок изолирует их, как отдельный <script>
+            body = "{\n" + body + "}\n"
+        parts.append(body)
+    return "".join(parts)
@@ -0,0 +1,123 @@
+# api/services/breaker.py
+"""Per-process circuit breaker and latency tracking for the LLM provider.
+
+Every call reports its latency and whether it failed. A model's breaker opens
+when, over the last LLM_BREAKER_WINDOW calls, the error rate or the p95
+latency crosses its threshold; while open, calls fail fast and callers switch
+to the local engines. After LLM_BREAKER_COOLDOWN seconds one probe call is let
+through (half-open): success closes the breaker, failure opens it again.
+
+The same samples give ``hedge_delay()``: the observed p95 after which a
+second, hedged request is worth sending.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _p95(values) -> float:
+    values = sorted(values)
+    return values[int(round(0.95 * (len(values) - 1)))]
+
+
+class CircuitBreaker:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = 0.0
+        # (ok, latency_ms) последних вызовов
+        self.calls: Deque[Tuple[bool, int]] = deque(maxlen=settings.LLM_BREAKER_WINDOW)
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= settings.LLM_BREAKER_COOLDOWN:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                # Пробный вызов — один на весь процесс
+                self._probing = True
+                return True
+            return False
+
+    def record(self, ok: bool, latency_ms: int) -> None:
+        with self._lock:
+            self.calls.append((ok, latency_ms))
+            if self.state == HALF_OPEN and self._probing:
+                self._probing = False
+                if ok:
+                    self.state = CLOSED
+                    self.calls.clear()
+                    logger.info("LLM circuit %s closed", self.name)
+                else:
+                    self._open("probe failed")
+                return
+            if self.state == CLOSED and len(self.calls) >= settings.LLM_BREAKER_MIN_CALLS:
+                errors = sum(1 for ok, _ in self.calls if not ok) / len(self.calls)
+                p95 = _p95(ms for _, ms in self.calls)
+                if errors >= settings.LLM_BREAKER_ERROR_RATE:
+                    self._open(f"error rate {errors:.0%}")
+                elif p95 >= settings.LLM_BREAKER_SLOW_MS:
+                    self._open(f"p95 latency {p95} ms")
+
+    def abort(self) -> None:
+        """A call ended without an outcome (cancelled, generator closed): free the probe slot, keep the state."""
+        with self._lock:
+            self._probing = False
+
+    def _open(self, reason: str) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        logger.warning("LLM circuit %s opened: %s", self.name, reason)
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {"state": self.state, "calls": len(self.calls), "errors": sum(1 for ok, _ in self.calls if not ok)}
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[Tuple[str, str], Deque[int]] = {}
+_lock = threading.Lock()
+
+
+def breaker_for(model: str) -> CircuitBreaker:
+    with _lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(model)
+        return _breakers[model]
+
+
+def observe(caller: str, model: str, latency_ms: int) -> None:
+    """Remember a successful call's latency for hedging decisions."""
+    with _lock:
+        samples = _latencies.setdefault((caller, model), deque(maxlen=settings.LLM_HEDGE_WINDOW))
+        samples.append(latency_ms)
+
+
+def hedge_delay(caller: str, model: str) -> Optional[float]:
+    """Seconds after which to send a hedged duplicate, or None while there are too few samples."""
+    if not settings.LLM_HEDGE_ENABLED:
+        return None
+    with _lock:
+        samples = list(_latencies.get((caller, model), ()))
+    if len(samples) < settings.LLM_HEDGE_MIN_SAMPLES:
+        return None
+    return _p95(samples) / 1000
+
+
+def states() -> Dict[str, Dict[str, object]]:
+    with _lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
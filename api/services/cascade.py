@@ -0,0 +1,188 @@
+# api/services/cascade.py
+"""Model cascade: ask the fast model first, escalate only when its answer fails local checks.
+
+Each stage records calls, validation failures and total latency in the cache,
+so ``stats()`` can report per-model latency and the escalation rate.
+"""
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from api.services import llm
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = "llm_cascade"
+KIND_RATION = "ration"
+KIND_UPDATE = "update"
+MACROS = ("proteins", "carbohydrates", "fats")
+
+
+class Rejected(llm.LLMUnavailable):
+    """Every model answered, but the last answer still failed validation; callers fall back as if unavailable."""
+
+
+Validator = Callable[[Dict[str, Any]], List[str]]
+
+
+def models_for(model: Optional[str] = None) -> List[str]:
+    """An explicitly requested model bypasses the cascade."""
+    if model:
+        return [model]
+    return list(settings.OPENAI_MODEL_CASCADE) or [llm.default_model()]
+
+
+def _float(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def item_totals(items: Iterable[Dict[str, Any]], suffix: str = "_g") -> Dict[str, float]:
+    totals = dict.fromkeys(MACROS, 0.0)
+    for item in items:
+        for macro in MACROS:
+            totals[macro] += _float(item.get(macro + suffix))
+    return totals
+
+
+def check_count(items, count: int) -> List[str]:
+    if not isinstance(items, list):
+        return ["items missing"]
+    if not all(isinstance(item, dict) for item in items):
+        return ["items must be JSON objects"]
+    return [] if len(items) == count else [f"expected {count} items, got {len(items)}"]
+
+
+def _allergen_pattern(allergen: str) -> re.Pattern:
+    # Целые слова с необязательным окончанием множественного числа: "egg" находит "eggs", но не "eggplant"
+    return re.compile(r"\b" + re.escape(allergen) + r"(?:s|es)?\b")
+
+
+def check_allergens(items: Iterable[Dict[str, Any]], allergies: Iterable[str]) -> List[str]:
+    allergies = [(a, _allergen_pattern(a)) for a in (a.strip().lower() for a in allergies or [] if a) if a]
+    problems = []
+    for item in items:
+        text = f"{item.get('name', '')} {item.get('recipe', '')}".lower()
+        problems += [f"'{item.get('name', '')}' contains {a}" for a, pattern in allergies if pattern.search(text)]
+    return problems
+
+
+def check_totals(
+    totals: Dict[str, float],
+    targets: Dict[str, Optional[float]],
+    tolerance: Optional[float] = None,
+    upper_only: bool = False,
+) -> List[str]:
+    """Compare macro totals with targets; macros without a target are not checked."""
+    tolerance = settings.CASCADE_MACRO_TOLERANCE if tolerance is None else tolerance
+    problems = []
+    for macro, target in targets.items():
+        if not target:
+            continue
+        value = totals.get(macro, 0.0)
+        if value > target * (1 + tolerance) or (not upper_only and value < target * (1 - tolerance)):
+            problems.append(f"{macro} {value:.0f}g vs target {target:.0f}g")
+    return problems
+
+
+def _key(kind: str, model: str, field: str) -> str:
+    return f"{METRICS_PREFIX}:{kind}:{model}:{field}"
+
+
+def _metric_deltas(ok: bool, started: float) -> Dict[str, int]:
+    return {"calls": 1, "failures": 0 if ok else 1, "latency_ms": int((time.monotonic() - started) * 1000)}
+
+
+def _record(kind: str, model: str, ok: bool, started: float) -> None:
+    for field, delta in _metric_deltas(ok, started).items():
+        key = _key(kind, model, field)
+        cache.add(key, 0, None)
+        cache.incr(key, delta)
+
+
+async def _arecord(kind: str, model: str, ok: bool, started: float) -> None:
+    for field, delta in _metric_deltas(ok, started).items():
+        key = _key(kind, model, field)
+        await cache.aadd(key, 0, None)
+        await cache.aincr(key, delta)
+
+
+def _log_failure(kind: str, model: str, problems: List[str], last: bool) -> None:
+    logger.info(
+        "%s: %s failed validation (%s)%s",
+        kind, model, "; ".join(problems[:5]), "" if last else ", escalating",
+    )
+
+
+def _unavailable(kind: str, model: str, error: llm.LLMUnavailable) -> None:
+    logger.warning("%s: %s unavailable (%s), trying the next model", kind, model, error)
+
+
+def run(kind: str, messages: List[Dict[str, str]], validate: Validator, models: List[str], temperature: float = 0.6) -> Tuple[Dict[str, Any], str]:
+    """Returns (data, model) of the first answer that passes validation.
+
+    A model that is unavailable (``llm.LLMUnavailable``) is skipped; if none answered, the error is raised.
+    If the last answer still fails validation, ``Rejected`` is raised: invalid output is never returned.
+    """
+    error = None
+    for i, model in enumerate(models):
+        started = time.monotonic()
+        try:
+            data = llm.chat_json(messages, model=model, temperature=temperature, caller=kind)
+        except llm.LLMUnavailable as e:
+            _unavailable(kind, model, e)
+            error = e
+            continue
+        problems = validate(data)
+        _record(kind, model, not problems, started)
+        if not problems:
+            return data, model
+        _log_failure(kind, model, problems, i == len(models) - 1)
+        error = Rejected(f"{model}: {'; '.join(problems[:5])}")
+    raise error
+
+
+async def arun(kind: str, messages: List[Dict[str, str]], validate: Validator, models: List[str], temperature: float = 0.6) -> Tuple[Dict[str, Any], str]:
+    error = None
+    for i, model in enumerate(models):
+        started = time.monotonic()
+        try:
+            data = await llm.achat_json(messages, model=model, temperature=temperature, caller=kind)
+        except llm.LLMUnavailable as e:
+            _unavailable(kind, model, e)
+            error = e
+            continue
+        problems = validate(data)
+        await _arecord(kind, model, not problems, started)
+        if not problems:
+            return data, model
+        _log_failure(kind, model, problems, i == len(models) - 1)
+        error = Rejected(f"{model}: {'; '.join(problems[:5])}")
+    raise error
+
+
+def stats(kind: str, models: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Per-stage calls, average latency, validation failure and escalation rates."""
+    models = models or models_for()
+    rows = []
+    for i, model in enumerate(models):
+        values = cache.get_many([_key(kind, model, f) for f in ("calls", "failures", "latency_ms")])
+        calls = values.get(_key(kind, model, "calls"), 0)
+        failures = values.get(_key(kind, model, "failures"), 0)
+        latency = values.get(_key(kind, model, "latency_ms"), 0)
+        rows.append({
+            "model": model,
+            "calls": calls,
+            "failures": failures,
+            "avg_latency_ms": round(latency / calls) if calls else None,
+            "failure_rate": round(failures / calls, 3) if calls else None,
+        })
+        # Провал на последней ступени — уже не эскалация
+        rows[-1]["escalation_rate"] = rows[-1]["failure_rate"] if i < len(models) - 1 else None
+    return rows
@@ -0,0 +1,195 @@
+# api/services/catalog.py
+"""The meal/product catalog sent to the LLM, shared by the views, tasks and commands.
+
+A user sees the global catalog (rows without an owner) overlaid with their own
+products and meals: a personal entry hides a global one with the same name.
+Products are read with a single streamed ``values()`` query, personal rows
+first, so the limit cuts global rows before personal ones. Meals are streamed
+in the user's ranking order (popularity is ordered by the database) and the
+walk stops at the limit; ``prompts`` re-sorts them by id for the cacheable
+catalog message and sends the ranking separately.
+"""
+from functools import reduce
+from itertools import chain
+from operator import or_
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from django.conf import settings
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from app.db import use_replica
+from api.models import Product, Meal, MealFavorite, MealReaction, CatalogVector, DailyRationItem, PopularityCounter
+from api.services.compression import decompress_text
+from api.services.recommender import meal_scores_for
+from api.services.text_index import collapse_near_duplicates
+
+PRODUCT_FIELDS = ("id", "name", "calories", "proteins", "carbohydrates", "fats", "weight", "type")
+MEAL_FIELDS = PRODUCT_FIELDS
+CHUNK_SIZE = 500
+
+
+def _key(name: str) -> str:
+    return " ".join((name or "").lower().split())
+
+
+def _overlay(model, fields, username: Optional[str]) -> Iterator[Dict[str, Any]]:
+    scope = Q(user__isnull=True)
+    if username:
+        scope |= Q(user__username=username)
+    rows = (
+        model.objects.filter(scope)
+        .order_by(F("user_id").asc(nulls_last=True), "id")
+        .values("user_id", *fields)
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    seen = set()
+    for row in rows:
+        key = _key(row["name"])
+        # Личные записи идут первыми и скрывают одноимённые глобальные
+        if row.pop("user_id") is None and key in seen:
+            continue
+        seen.add(key)
+        yield row
+
+
+def iter_products(username: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    return _overlay(Product, PRODUCT_FIELDS, username)
+
+
+def iter_meals(username: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Meals without recipes; ``load_catalog`` fetches those only for the meals it keeps."""
+    return _overlay(Meal, MEAL_FIELDS, username)
+
+
+def _meal_rows(username: Optional[str]):
+    scope = Q(user__isnull=True)
+    if username:
+        scope |= Q(user__username=username)
+    popular = PopularityCounter.objects.filter(
+        kind=PopularityCounter.KIND_MEAL, object_id=OuterRef("id"),
+    ).values("score")[:1]
+    return (
+        Meal.objects.filter(scope)
+        .annotate(popularity=Coalesce(Subquery(popular), 0))
+        .order_by("-popularity", F("user_id").asc(nulls_last=True), "id")
+        .values("user_id", *MEAL_FIELDS)
+    )
+
+
+def iter_ranked_meals(username: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Visible meals in ranking order, streamed so that the caller can stop at its limit.
+
+    Meals the offline model scored for the user go first (by that score), the
+    ones it scored negatively go last, the rest follow popularity as ordered by
+    the database. Of same-named global meals the first in this order is kept.
+    """
+    rows = _meal_rows(username)
+    scores = meal_scores_for(username) if username else {}
+    personal = set()
+    if username:
+        personal = {_key(n) for n in Meal.objects.filter(user__username=username).values_list("name", flat=True)}
+    # Оценённых моделью блюд не больше top-N, их можно отсортировать в памяти;
+    # sorted устойчив, поэтому при равной оценке сохраняется порядок популярности
+    head = sorted(rows.filter(id__in=[pk for pk, s in scores.items() if s > 0]), key=lambda r: -scores[r["id"]])
+    tail = sorted(rows.filter(id__in=[pk for pk, s in scores.items() if s < 0]), key=lambda r: -scores[r["id"]])
+    body = (row for row in rows.iterator(chunk_size=CHUNK_SIZE) if not scores.get(row["id"]))
+    seen = set()
+    for row in chain(head, body, tail):
+        key = _key(row["name"])
+        # Личные записи скрывают одноимённые глобальные
+        if row.pop("user_id") is None and (key in personal or key in seen):
+            continue
+        seen.add(key)
+        yield row
+
+
+def _collapse(kind: str, rows: Iterable[Dict[str, Any]], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    walked: Dict[int, Dict[str, Any]] = {}
+
+    def ids() -> Iterator[int]:
+        for row in rows:
+            walked[row["id"]] = row
+            yield row["id"]
+
+    return [walked[pk] for pk in collapse_near_duplicates(kind, ids(), limit=limit)]
+
+
+def _recipes(meal_ids: List[int]) -> Dict[int, str]:
+    bodies = Meal.objects.filter(id__in=meal_ids).values_list("id", "recipe_ref__body")
+    return {pk: decompress_text(body) if body else "" for pk, body in bodies}
+
+
+@use_replica()
+def load_catalog(
+    username: Optional[str] = None,
+    max_products: Optional[int] = None,
+    max_meals: Optional[int] = None,
+) -> Dict[str, Any]:
+    max_products = max_products or settings.CATALOG_MAX_PRODUCTS
+    max_meals = max_meals or settings.CATALOG_MAX_MEALS
+
+    products = []
+    for row in iter_products(username):
+        products.append(row)
+        if len(products) >= max_products:
+            break
+
+    # Дубли отсеиваются по ранжированному потоку, чтение обрывается на первых max_meals уникальных
+    ranked = iter_ranked_meals(username)
+    try:
+        meals = _collapse(CatalogVector.KIND_MEAL, ranked, limit=max_meals)
+    finally:
+        ranked.close()
+    recipes = _recipes([m["id"] for m in meals])
+    for m in meals:
+        m["recipe"] = recipes.get(m["id"], "")
+
+    catalog = {"products": _collapse(CatalogVector.KIND_PRODUCT, products), "meals": meals}
+    if username:
+        catalog["preferences"] = preferences(username)
+    return catalog
+
+
+def preferences(username: str) -> Dict[str, List[int]]:
+    """Favourite and disliked meal ids; the prompt sends them with the request, not in catalog order."""
+    return {
+        "favorite_meal_ids": sorted(MealFavorite.objects.filter(username=username).values_list("meal_id", flat=True)),
+        "excluded_meal_ids": sorted(
+            MealReaction.objects.filter(username=username, reaction="dislike").values_list("meal_id", flat=True)
+        ),
+    }
+
+
+def _ids_by_name(model, names, username: Optional[str]) -> Dict[str, int]:
+    scope = Q(user__isnull=True)
+    if username:
+        scope |= Q(user__username=username)
+    rows = (
+        model.objects.filter(scope, reduce(or_, (Q(name__iexact=n) for n in names)))
+        .order_by(F("user_id").asc(nulls_last=True), "id")
+        .values_list("id", "name")
+    )
+    ids: Dict[str, int] = {}
+    for pk, name in rows:
+        ids.setdefault(_key(name), pk)
+    return ids
+
+
+def link_items(items: Iterable[DailyRationItem], username: Optional[str] = None) -> List[DailyRationItem]:
+    """Point unsaved plan items at the catalog meal (or else product) they were named after, in place."""
+    items = list(items)
+    pending = [it for it in items if not (it.meal_id or it.product_id) and it.name]
+    if not pending:
+        return items
+    names = {it.name for it in pending}
+    meals = _ids_by_name(Meal, names, username)
+    rest = {n for n in names if _key(n) not in meals}
+    products = _ids_by_name(Product, rest, username) if rest else {}
+    for it in pending:
+        key = _key(it.name)
+        if key in meals:
+            it.meal_id = meals[key]
+        elif key in products:
+            it.product_id = products[key]
+    return items
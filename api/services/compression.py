@@ -0,0 +1,48 @@
+# api/services/compression.py
+import gzip
+import hashlib
+import json
+import zlib
+from typing import Any, Tuple
+
+COMPRESSION_LEVEL = 9
+
+try:  # zstd is optional; gzip is always available
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+CODEC_GZIP = "gzip"
+CODEC_ZSTD = "zstd"
+DEFAULT_CODEC = CODEC_ZSTD if zstandard is not None else CODEC_GZIP
+
+
+def content_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def compress_text(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def decompress_text(blob) -> str:
+    return zlib.decompress(bytes(blob)).decode("utf-8")
+
+
+def compress_json(data: Any, codec: str = DEFAULT_CODEC) -> Tuple[str, bytes, int]:
+    """Serialize ``data`` compactly and compress it; returns (codec, blob, raw_size)."""
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if codec == CODEC_ZSTD:
+        return codec, zstandard.ZstdCompressor(level=10).compress(raw), len(raw)
+    return CODEC_GZIP, gzip.compress(raw, compresslevel=COMPRESSION_LEVEL, mtime=0), len(raw)
+
+
+def decompress_json(codec: str, blob) -> Any:
+    blob = bytes(blob)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("The 'zstandard' package is required to read zstd payloads")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raw = gzip.decompress(blob)
+    return json.loads(raw.decode("utf-8"))
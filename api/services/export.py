@@ -0,0 +1,183 @@
+# api/services/export.py
+"""Streaming CSV/JSONL export of plan and intake history.
+
+Rows are read with ``values_list(...).iterator(chunk_size=EXPORT_CHUNK_SIZE)``
+(a server-side cursor on Postgres) and serialized one at a time, so memory
+stays flat however long the history is. Plans come from the archive first
+(older, already flattened to JSON) and then from the hot tables, both in
+``created_at`` order; date ranges are range scans of the (username,
+created_at) indexes, or of the created_at index when exporting all users.
+
+Under ASGI a synchronous iterator would be collected into a list before
+sending, so ``streaming_response()`` feeds it through an async generator
+that pulls one batch of lines per ``sync_to_async`` call.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+from itertools import groupby, islice
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from api.models import DailyRationPlan, DailyRationPlanArchive, UserIntake
+
+KIND_PLANS = "plans"
+KIND_INTAKES = "intakes"
+KINDS = (KIND_PLANS, KIND_INTAKES)
+FORMATS = ("csv", "jsonl")
+CONTENT_TYPES = {"csv": "text/csv; charset=utf-8", "jsonl": "application/x-ndjson; charset=utf-8"}
+
+ITEM_FIELDS = ("position", "name", "proteins", "carbohydrates", "fats", "fiber", "eaten", "meal_id", "product_id")
+PLAN_FIELDS = ("plan_id", "username", "created_at", "plan_date", "model", "archived")
+PLAN_COLUMNS = PLAN_FIELDS + ITEM_FIELDS
+INTAKE_COLUMNS = (
+    "id", "username", "created_at", "display_name", "gender", "age", "height", "weight", "goal",
+    "activity_level", "dietary_restrictions", "allergies", "cooking_skill", "kitchen_equipment",
+    "preferred_units", "target_calories", "target_proteins", "target_carbohydrates", "target_fats",
+)
+# Строк на один sync_to_async-переход и одну запись в сокет
+LINES_PER_CHUNK = 200
+
+
+def parse_range(since: Optional[str], until: Optional[str]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """Inclusive ``YYYY-MM-DD`` bounds -> [start of ``since``, start of the day after ``until``)."""
+    bounds = []
+    for name, value, shift in (("since", since, 0), ("until", until, 1)):
+        if not value:
+            bounds.append(None)
+            continue
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"{name} must be a date (YYYY-MM-DD), got {value!r}")
+        bounds.append(timezone.make_aware(datetime.combine(day + timedelta(days=shift), time.min)))
+    return bounds[0], bounds[1]
+
+
+def _filtered(qs, username: Optional[str], since: Optional[datetime], until: Optional[datetime]):
+    if username:
+        qs = qs.filter(username=username)
+    if since is not None:
+        qs = qs.filter(created_at__gte=since)
+    if until is not None:
+        qs = qs.filter(created_at__lt=until)
+    return qs
+
+
+def plans(
+    username: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    using: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Plans with their items (``{**plan, "items": [...]}``), oldest first, archived ones included."""
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    archived = (
+        _filtered(DailyRationPlanArchive.objects.using(using), username, since, until)
+        .order_by("created_at", "plan_id")
+        .values_list("plan_id", "username", "created_at", "model", "items")
+    )
+    for plan_id, name, created_at, model, items in archived.iterator(chunk_size=chunk_size):
+        yield {
+            "plan_id": plan_id, "username": name, "created_at": created_at, "plan_date": None, "model": model,
+            "archived": True, "items": [{f: it.get(f) for f in ITEM_FIELDS} for it in items],
+        }
+
+    # LEFT JOIN позиций: по строке на позицию, план без позиций — одной строкой с NULL
+    rows = (
+        _filtered(DailyRationPlan.objects.using(using).filter(speculative=False), username, since, until)
+        .order_by("created_at", "id", "dailyrationitem__position")
+        .values_list(
+            "id", "username", "created_at", "plan_date", "model",
+            *(f"dailyrationitem__{f}" for f in ITEM_FIELDS),
+        )
+    )
+    # Строки плана идут подряд, поэтому группировка не держит в памяти больше одного плана
+    for _, group in groupby(rows.iterator(chunk_size=chunk_size), key=lambda row: row[0]):
+        group = list(group)
+        plan_id, name, created_at, plan_date, model = group[0][:5]
+        yield {
+            "plan_id": plan_id, "username": name, "created_at": created_at, "plan_date": plan_date, "model": model,
+            "archived": False,
+            "items": [dict(zip(ITEM_FIELDS, row[5:])) for row in group if row[5] is not None],
+        }
+
+
+def intakes(
+    username: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    using: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    qs = _filtered(UserIntake.objects.using(using), username, since, until).order_by("created_at", "id")
+    for row in qs.values_list(*INTAKE_COLUMNS).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE):
+        yield dict(zip(INTAKE_COLUMNS, row))
+
+
+class _Echo:
+    """File-like object whose ``write`` returns the line, so ``csv.writer`` can serialize one row at a time."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def _cell(value: Any) -> Any:
+    if isinstance(value, list):
+        return ",".join(map(str, value))
+    return "" if value is None else value
+
+
+def csv_lines(columns: Iterable[str], records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for record in records:
+        yield writer.writerow([_cell(record.get(c)) for c in columns])
+
+
+def jsonl_lines(records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+
+def _item_rows(records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    # В CSV — по строке на позицию плана
+    for plan in records:
+        head = {f: plan[f] for f in PLAN_FIELDS}
+        for item in plan["items"] or [{}]:
+            yield {**head, **item}
+
+
+def render(kind: str, fmt: str, **filters) -> Iterator[str]:
+    """Lines of the ``kind`` export in ``fmt``; ``filters`` are those of ``plans()``/``intakes()``."""
+    if kind == KIND_PLANS:
+        records, columns = plans(**filters), PLAN_COLUMNS
+        if fmt == "csv":
+            records = _item_rows(records)
+    else:
+        records, columns = intakes(**filters), INTAKE_COLUMNS
+    return csv_lines(columns, records) if fmt == "csv" else jsonl_lines(records)
+
+
+def _take(lines: Iterator[str], n: int) -> str:
+    return "".join(islice(lines, n))
+
+
+async def _aiterate(lines: Iterator[str]):
+    while True:
+        chunk = await sync_to_async(_take)(lines, LINES_PER_CHUNK)
+        if not chunk:
+            return
+        yield chunk
+
+
+def streaming_response(request, lines: Iterator[str], fmt: str, filename: str) -> StreamingHttpResponse:
+    content = _aiterate(lines) if isinstance(request, ASGIRequest) else iter(lambda: _take(lines, LINES_PER_CHUNK), "")
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,203 @@
+# api/services/hot_cache.py
+"""Two-tier cache for small, hot values read on nearly every request.
+
+Tier 1 is a bounded in-process LRU, tier 2 the shared Django cache (Redis).
+``invalidate()`` drops the value from both and publishes the key on a Redis
+pub/sub channel; a daemon thread in every process (web workers and Celery
+alike) listens and evicts its local copy. Local entries also expire after
+HOT_CACHE_LOCAL_TTL, which bounds staleness if a message is ever missed.
+
+Hit/miss counters are kept per namespace in-process and flushed by the
+listener thread into a Redis hash, so ``stats()`` reports all processes.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from app.db import use_primary
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "hot_cache:invalidate"
+STATS_KEY = "hot_cache:stats"
+STATS_FLUSH_SECONDS = 10
+TIERS = ("local", "shared", "miss")
+
+_MISSING = object()
+
+
+class _LRU:
+    def __init__(self):
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + settings.HOT_CACHE_LOCAL_TTL, value)
+            self._data.move_to_end(key)
+            while len(self._data) > settings.HOT_CACHE_LOCAL_SIZE:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+_local = _LRU()
+_counts: Dict[str, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(TIERS, 0))
+_counts_lock = threading.Lock()
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def redis_connection():
+    """Raw Redis connection, or None when the default cache is not django-redis."""
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def _full_key(namespace: str, key: Any) -> str:
+    return f"hot:{namespace}:{key}"
+
+
+def _count(namespace: str, tier: str) -> None:
+    with _counts_lock:
+        _counts[namespace][tier] += 1
+
+
+def _take_counts() -> Dict[str, Dict[str, int]]:
+    global _counts
+    with _counts_lock:
+        taken, _counts = _counts, defaultdict(lambda: dict.fromkeys(TIERS, 0))
+    return taken
+
+
+def _flush_stats(conn) -> None:
+    counts = _take_counts()
+    if not counts:
+        return
+    pipe = conn.pipeline()
+    for namespace, tiers in counts.items():
+        for tier, n in tiers.items():
+            if n:
+                pipe.hincrby(STATS_KEY, f"{namespace}:{tier}", n)
+    pipe.execute()
+
+
+def _listen(conn) -> None:
+    while True:
+        try:
+            pubsub = conn.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
+            flushed = time.monotonic()
+            while True:
+                message = pubsub.get_message(timeout=1.0)
+                if message:
+                    _local.delete(message["data"].decode())
+                if time.monotonic() - flushed >= STATS_FLUSH_SECONDS:
+                    _flush_stats(conn)
+                    flushed = time.monotonic()
+        except Exception:
+            logger.warning("hot_cache invalidation listener failed; reconnecting", exc_info=True)
+            # Пока не были подписаны, могли пропустить инвалидации
+            _local.clear()
+            time.sleep(1.0)
+
+
+def _ensure_listener() -> None:
+    """Start the invalidation listener once per process (again after a fork)."""
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_lock:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+        # Записи, унаследованные от родителя до fork, ничья подписка не охраняла
+        _local.clear()
+        conn = redis_connection()
+        if conn is not None:
+            threading.Thread(target=_listen, args=(conn,), name="hot-cache-listener", daemon=True).start()
+
+
+def get_or_set(namespace: str, key: Any, loader: Callable[[], Any], timeout: int = None) -> Any:
+    _ensure_listener()
+    full = _full_key(namespace, key)
+    value = _local.get(full)
+    if value is not _MISSING:
+        _count(namespace, "local")
+        return value
+    value = cache.get(full, _MISSING)
+    if value is _MISSING:
+        _count(namespace, "miss")
+        # С реплики можно прочитать значение до инвалидации и закэшировать его надолго
+        with use_primary():
+            value = loader()
+        cache.set(full, value, settings.HOT_CACHE_TIMEOUT if timeout is None else timeout)
+    else:
+        _count(namespace, "shared")
+    _local.set(full, value)
+    return value
+
+
+def _broadcast(full: str) -> None:
+    _local.delete(full)
+    try:
+        cache.delete(full)
+        conn = redis_connection()
+        if conn is not None:
+            conn.publish(CHANNEL, full)
+    except Exception:
+        # Запись уже закоммичена; устаревшие копии доживут максимум до своих TTL
+        logger.warning("hot_cache invalidation of %s failed", full, exc_info=True)
+
+
+def invalidate(namespace: str, key: Any) -> None:
+    # После коммита: иначе другой процесс успеет перечитать и закэшировать старое значение
+    full = _full_key(namespace, key)
+    transaction.on_commit(lambda: _broadcast(full))
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """Per-namespace hits by tier and hit rates, summed over all processes."""
+    conn = redis_connection()
+    if conn is not None:
+        _flush_stats(conn)
+        raw = {k.decode(): int(v) for k, v in conn.hgetall(STATS_KEY).items()}
+    else:
+        raw = {f"{ns}:{tier}": n for ns, tiers in _counts.items() for tier, n in tiers.items()}
+    totals: Dict[str, Dict[str, Any]] = defaultdict(lambda: dict.fromkeys(TIERS, 0))
+    for field, n in raw.items():
+        namespace, tier = field.rsplit(":", 1)
+        totals[namespace][tier] += n
+    for row in totals.values():
+        requests = sum(row[t] for t in TIERS)
+        row["hit_rate"] = round((row["local"] + row["shared"]) / requests, 3) if requests else None
+        row["local_hit_rate"] = round(row["local"] / requests, 3) if requests else None
+    return dict(totals)
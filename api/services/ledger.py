@@ -0,0 +1,264 @@
+# api/services/ledger.py
+"""Append-only ledger of LLM calls (``LLMCall``): latency, tokens, cost, outcome, caller.
+
+``llm`` hands every finished call to ``record()``, which only puts the row on
+an in-process queue; a daemon writer thread (one per process, restarted after
+a fork) drains it with ``bulk_create`` every LLM_LEDGER_FLUSH_SECONDS or
+LLM_LEDGER_BATCH_SIZE rows, so the request path never waits on the insert.
+Who made the call comes from ``context()``: the middleware below sets the
+view name and the request user, Celery sets the task name, and background
+jobs add the username they work for.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Aggregate, Count, FloatField, Q, Sum
+from django.utils import timezone
+
+from api.models import LLMCall
+from api.services import profiling
+
+logger = logging.getLogger(__name__)
+
+_context: ContextVar[Dict[str, Any]] = ContextVar("llm_ledger_context", default={})
+
+_queue: "queue.Queue[LLMCall]" = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+class context(ContextDecorator):
+    """Attribute LLM calls in this block, e.g. ``context(username=...)`` or ``context(endpoint=...)``."""
+
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def __enter__(self):
+        self._token = _context.set({**_context.get(), **self.fields})
+        return self
+
+    def __exit__(self, *exc):
+        _context.reset(self._token)
+        return False
+
+
+def set_endpoint(endpoint: str) -> None:
+    """Start a new unit of work (a Celery task) attributed to ``endpoint``."""
+    _context.set({"endpoint": endpoint})
+
+
+class LedgerContextMiddleware:
+    """Attributes LLM calls made while serving a request to its view and user."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _context.set({"request": request})
+        try:
+            return self.get_response(request)
+        finally:
+            _context.reset(token)
+
+    async def __acall__(self, request):
+        token = _context.set({"request": request})
+        try:
+            return await self.get_response(request)
+        finally:
+            _context.reset(token)
+
+
+def _attribution() -> Dict[str, str]:
+    ctx = _context.get()
+    endpoint, username = ctx.get("endpoint", ""), ctx.get("username", "")
+    request = ctx.get("request")
+    if request is not None:
+        # resolver_match и user появляются у запроса уже после middleware, поэтому читаются здесь
+        match = getattr(request, "resolver_match", None)
+        endpoint = endpoint or (match.view_name if match else request.path)[:128]
+        # Только уже загруженный пользователь: ленивый request.user в async-контексте полез бы в БД синхронно
+        user = getattr(request, "_cached_user", None) or getattr(request, "_acached_user", None)
+        if not username and user is not None and user.is_authenticated:
+            username = user.username
+    return {"endpoint": endpoint, "username": username}
+
+
+def prompt_hash(messages: List[Dict[str, str]]) -> str:
+    return hashlib.sha256(json.dumps(messages, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def cost(model: str, prompt_tokens: Optional[int], cached_tokens: Optional[int], completion_tokens: Optional[int]) -> Optional[Decimal]:
+    prices = settings.LLM_PRICES.get(model)
+    if prices is None or prompt_tokens is None:
+        return None
+    cached = cached_tokens or 0
+    usd = ((prompt_tokens - cached) * prices[0] + cached * prices[1] + (completion_tokens or 0) * prices[2]) / 1_000_000
+    return Decimal(str(round(usd, 6)))
+
+
+def record(
+    model: str,
+    messages: List[Dict[str, str]],
+    usage: Dict[str, Any],
+    outcome: str,
+    caller: str = "",
+    first_token_ms: Optional[int] = None,
+    error: str = "",
+) -> None:
+    """Queue a ledger row for the background writer; never raises and never blocks."""
+    try:
+        row = LLMCall(
+            created_at=timezone.now(),
+            model=model,
+            prompt_hash=prompt_hash(messages),
+            caller=caller or "",
+            outcome=outcome,
+            error=error[:256],
+            latency_ms=usage.get("latency_ms") or 0,
+            first_token_ms=first_token_ms,
+            prompt_tokens=usage.get("prompt_tokens"),
+            cached_tokens=usage.get("cached_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            cache_hit=bool(usage.get("cached_tokens")),
+            cost_usd=cost(model, usage.get("prompt_tokens"), usage.get("cached_tokens"), usage.get("completion_tokens")),
+            **_attribution(),
+        )
+        profiling.note_llm(
+            model, row.caller, outcome, row.latency_ms, first_token_ms,
+            prompt_tokens=row.prompt_tokens, completion_tokens=row.completion_tokens,
+        )
+        _ensure_writer()
+        _queue.put_nowait(row)
+    except queue.Full:
+        logger.warning("LLM ledger queue is full, dropping a row for %s", model)
+    except Exception:
+        logger.warning("LLM ledger record failed", exc_info=True)
+
+
+def _drain(block_seconds: float) -> List[LLMCall]:
+    rows = []
+    try:
+        rows.append(_queue.get(timeout=block_seconds))
+        while len(rows) < settings.LLM_LEDGER_BATCH_SIZE:
+            rows.append(_queue.get_nowait())
+    except queue.Empty:
+        pass
+    return rows
+
+
+def _write(rows: List[LLMCall]) -> None:
+    if not rows:
+        return
+    try:
+        LLMCall.objects.bulk_create(rows)
+    except Exception:
+        logger.warning("LLM ledger write of %d rows failed", len(rows), exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def _writer() -> None:
+    while True:
+        _write(_drain(settings.LLM_LEDGER_FLUSH_SECONDS))
+
+
+def flush() -> None:
+    """Write everything queued in this process now (tests, shutdown)."""
+    if _queue is None:
+        return
+    while True:
+        rows = _drain(0)
+        if not rows:
+            break
+        _write(rows)
+
+
+def _ensure_writer() -> None:
+    global _queue, _writer_pid
+    pid = os.getpid()
+    if _writer_pid == pid:
+        return
+    with _writer_lock:
+        if _writer_pid == pid:
+            return
+        # После fork очередь и поток родителя недействительны
+        _queue = queue.Queue(maxsize=settings.LLM_LEDGER_QUEUE_SIZE)
+        _writer_pid = pid
+        threading.Thread(target=_writer, name="llm-ledger-writer", daemon=True).start()
+
+
+atexit.register(flush)
+
+
+class Percentile(Aggregate):
+    """PostgreSQL ordered-set percentile, e.g. ``Percentile("latency_ms", percentile=0.95)``."""
+
+    function = "PERCENTILE_DISC"
+    template = "%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = FloatField()
+
+
+def _percentiles(values: List[int]) -> Dict[str, Optional[int]]:
+    if not values:
+        return {"p50_ms": None, "p95_ms": None}
+    values = sorted(values)
+
+    def pick(q):
+        return values[int(round(q * (len(values) - 1)))]
+
+    return {"p50_ms": pick(0.5), "p95_ms": pick(0.95)}
+
+
+def report(group_by: str = "endpoint", since=None) -> List[Dict[str, Any]]:
+    """Calls, p50/p95 latency, tokens and spend per ``endpoint``/``username``/``model``/``caller``.
+
+    Each row carries the group value under ``key``; rows are ordered by spend.
+    """
+    qs = LLMCall.objects.all()
+    if since is not None:
+        qs = qs.filter(created_at__gte=since)
+    rows = {
+        row[group_by]: row
+        for row in qs.values(group_by).annotate(
+            calls=Count("id"),
+            errors=Count("id", filter=~Q(outcome=LLMCall.OUTCOME_OK)),
+            prompt_tokens=Sum("prompt_tokens"),
+            completion_tokens=Sum("completion_tokens"),
+            cost_usd=Sum("cost_usd"),
+        )
+    }
+    if connection.vendor == "postgresql":
+        for row in qs.values(group_by).annotate(
+            p50_ms=Percentile("latency_ms", percentile=0.5), p95_ms=Percentile("latency_ms", percentile=0.95)
+        ):
+            rows[row[group_by]].update(p50_ms=row["p50_ms"], p95_ms=row["p95_ms"])
+    else:
+        # SQLite и прочие не умеют percentile — считаем в Python
+        latencies: Dict[Any, List[int]] = {}
+        for key, ms in qs.values_list(group_by, "latency_ms").iterator():
+            latencies.setdefault(key, []).append(ms)
+        for key, values in latencies.items():
+            rows[key].update(_percentiles(values))
+    for key, row in rows.items():
+        row["key"] = row.pop(group_by)
+    return sorted(rows.values(), key=lambda r: -(r["cost_usd"] or 0))
+
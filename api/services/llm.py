@@ -0,0 +1,352 @@
+# api/services/llm.py
+"""OpenAI chat calls with usage accounting, timeouts, hedging and a circuit breaker.
+
+Every call gets a timeout (per caller, LLM_TIMEOUTS) clipped to the enclosing
+``deadline()``. Once a caller/model pair has enough latency samples, a call
+still running past the observed p95 is duplicated and the first answer wins.
+Provider failures, timeouts and open circuits raise ``LLMUnavailable``;
+callers then fall back to the local engines (``targets.estimate_macros``,
+``local_planner``).
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from django.conf import settings
+
+from api.services import breaker, ledger
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Токены и задержка последнего вызова в текущем контексте (поток / asyncio-задача)
+_last_usage: ContextVar[Dict[str, Any]] = ContextVar("llm_last_usage", default={})
+
+# Момент (time.monotonic), к которому все вызовы LLM в текущем контексте должны завершиться
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+_client = None
+_hedge_pool = None
+_hedge_pool_pid = None
+# AsyncOpenAI держит httpx-пул, привязанный к event loop, поэтому клиент — на каждый loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+
+
+class LLMUnavailable(RuntimeError):
+    """The provider failed or timed out, its circuit is open, or the deadline is spent."""
+
+
+class deadline(ContextDecorator):
+    """Bound all LLM calls in this block (cascade escalations included) to ``seconds`` from now."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def __enter__(self):
+        ends = time.monotonic() + self.seconds
+        outer = _deadline.get()
+        self._token = _deadline.set(ends if outer is None else min(outer, ends))
+        return self
+
+    def __exit__(self, *exc):
+        _deadline.reset(self._token)
+        return False
+
+
+def default_model() -> str:
+    return os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
+
+
+def _api_key() -> str:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY environment variable is not set")
+    return api_key
+
+
+def get_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        # Повторы сам клиент не делает: их бюджет съел бы дедлайн, эскалацию делает каскад
+        _client = OpenAI(api_key=_api_key(), max_retries=settings.LLM_MAX_RETRIES)
+    return _client
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        from openai import AsyncOpenAI
+        client = _async_clients[loop] = AsyncOpenAI(api_key=_api_key(), max_retries=settings.LLM_MAX_RETRIES)
+    return client
+
+
+def _transient_errors():
+    import openai
+    return (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+def _timeout(caller: str) -> float:
+    timeout = settings.LLM_TIMEOUTS.get(caller, settings.LLM_TIMEOUT)
+    ends = _deadline.get()
+    if ends is not None:
+        left = ends - time.monotonic()
+        if left < settings.LLM_MIN_TIMEOUT:
+            raise LLMUnavailable("deadline exceeded")
+        timeout = min(timeout, left)
+    return timeout
+
+
+def _open_circuit(model: str, caller: str):
+    """Timeout for the call and the model's breaker; raises LLMUnavailable if the call must not be made."""
+    timeout = _timeout(caller)
+    circuit = breaker.breaker_for(model)
+    if not circuit.allow():
+        raise LLMUnavailable(f"circuit for {model} is open")
+    return circuit, timeout
+
+
+def _close_circuit(circuit, caller: str, model: str, started: float, error: Optional[Exception] = None) -> None:
+    latency_ms = int((time.monotonic() - started) * 1000)
+    if error is not None and isinstance(error, _transient_errors()):
+        circuit.record(False, latency_ms)
+        raise LLMUnavailable(f"{model}: {type(error).__name__}") from error
+    # Ошибки запроса (400 и т.п.) говорят о нас, а не о провайдере
+    circuit.record(True, latency_ms)
+    if error is None:
+        breaker.observe(caller, model, latency_ms)
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _hedge_pool, _hedge_pool_pid
+    if _hedge_pool_pid != os.getpid():
+        # Потоки пула не переживают fork
+        _hedge_pool = ThreadPoolExecutor(max_workers=settings.LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+        _hedge_pool_pid = os.getpid()
+    return _hedge_pool
+
+
+def _hedged(call: Callable[[float], Any], caller: str, model: str, timeout: float):
+    delay = breaker.hedge_delay(caller, model)
+    if delay is None or delay >= timeout:
+        return call(timeout)
+    first = _executor().submit(call, timeout)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+    logger.info("hedging %s call to %s after %.1fs", caller, model, delay)
+    # Проигравший запрос отменить нельзя: он доработает в пуле до ответа или своего таймаута
+    second = _executor().submit(call, max(timeout - delay, settings.LLM_MIN_TIMEOUT))
+    error = None
+    for future in as_completed([first, second]):
+        try:
+            return future.result()
+        except Exception as e:
+            error = e
+    raise error
+
+
+async def _ahedged(call: Callable[[float], Any], caller: str, model: str, timeout: float):
+    delay = breaker.hedge_delay(caller, model)
+    if delay is None or delay >= timeout:
+        return await call(timeout)
+    pending = {asyncio.ensure_future(call(timeout))}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            logger.info("hedging %s call to %s after %.1fs", caller, model, delay)
+            pending.add(asyncio.ensure_future(call(max(timeout - delay, settings.LLM_MIN_TIMEOUT))))
+        error = None
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                raise error
+            done, pending = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _create(model: str, caller: str, **kwargs):
+    circuit, timeout = _open_circuit(model, caller)
+    started = time.monotonic()
+    try:
+        completion = _hedged(
+            lambda t: get_client().chat.completions.create(model=model, timeout=t, **kwargs), caller, model, timeout
+        )
+    except Exception as e:
+        _close_circuit(circuit, caller, model, started, e)
+        raise
+    except BaseException:
+        # Отмена (CancelledError) или прерывание: исход неизвестен, пробный вызов освобождается
+        circuit.abort()
+        raise
+    _close_circuit(circuit, caller, model, started)
+    return completion
+
+
+async def _acreate(model: str, caller: str, **kwargs):
+    circuit, timeout = _open_circuit(model, caller)
+    started = time.monotonic()
+    try:
+        completion = await _ahedged(
+            lambda t: get_async_client().chat.completions.create(model=model, timeout=t, **kwargs), caller, model, timeout
+        )
+    except Exception as e:
+        _close_circuit(circuit, caller, model, started, e)
+        raise
+    except BaseException:
+        # Отмена (CancelledError) или прерывание: исход неизвестен, пробный вызов освобождается
+        circuit.abort()
+        raise
+    _close_circuit(circuit, caller, model, started)
+    return completion
+
+
+def parse_json(content: str) -> Dict[str, Any]:
+    try:
+        data = json.loads(content or "{}")
+    except json.JSONDecodeError:
+        return {"raw": content}
+    return data if isinstance(data, dict) else {"raw": content}
+
+
+def _record_usage(model: str, usage, started: float, first_token_at: float = None) -> Dict[str, Any]:
+    details = getattr(usage, "prompt_tokens_details", None)
+    record = {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "cached_tokens": getattr(details, "cached_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "latency_ms": int((time.monotonic() - started) * 1000),
+    }
+    _last_usage.set(record)
+    logger.info(
+        "llm call model=%s prompt_tokens=%s cached_tokens=%s completion_tokens=%s latency_ms=%s first_token_ms=%s",
+        model, record["prompt_tokens"], record["cached_tokens"], record["completion_tokens"], record["latency_ms"],
+        int((first_token_at - started) * 1000) if first_token_at else None,
+    )
+    return record
+
+
+def _ledger_ok(model: str, messages, caller: str, data: Dict[str, Any]) -> None:
+    outcome = ledger.LLMCall.OUTCOME_INVALID_JSON if "raw" in data else ledger.LLMCall.OUTCOME_OK
+    ledger.record(model, messages, last_usage(), outcome, caller=caller)
+
+
+def _ledger_error(model: str, messages, caller: str, started: float, exc: Exception) -> None:
+    usage = {"latency_ms": int((time.monotonic() - started) * 1000)}
+    ledger.record(model, messages, usage, ledger.LLMCall.OUTCOME_ERROR, caller=caller, error=f"{type(exc).__name__}: {exc}")
+
+
+def last_usage() -> Dict[str, Any]:
+    """Prompt/cached/completion token counts and latency of the latest call in this context."""
+    return dict(_last_usage.get())
+
+
+def chat_json(messages: List[Dict[str, str]], model: str = None, temperature: float = 0.6, caller: str = "") -> Dict[str, Any]:
+    model = model or default_model()
+    started = time.monotonic()
+    try:
+        completion = _create(
+            model, caller, messages=messages, temperature=temperature, response_format={"type": "json_object"}
+        )
+    except Exception as e:
+        _ledger_error(model, messages, caller, started, e)
+        raise
+    _record_usage(model, completion.usage, started)
+    data = parse_json(completion.choices[0].message.content)
+    _ledger_ok(model, messages, caller, data)
+    return data
+
+
+async def achat_json(messages: List[Dict[str, str]], model: str = None, temperature: float = 0.6, caller: str = "") -> Dict[str, Any]:
+    model = model or default_model()
+    started = time.monotonic()
+    try:
+        completion = await _acreate(
+            model, caller, messages=messages, temperature=temperature, response_format={"type": "json_object"}
+        )
+    except Exception as e:
+        _ledger_error(model, messages, caller, started, e)
+        raise
+    _record_usage(model, completion.usage, started)
+    data = parse_json(completion.choices[0].message.content)
+    _ledger_ok(model, messages, caller, data)
+    return data
+
+
+def _split_lines(buf: str):
+    lines = buf.split("\n")
+    return [line.strip() for line in lines[:-1] if line.strip()], lines[-1]
+
+
+def stream_lines(messages: List[Dict[str, str]], model: str = None, temperature: float = 0.6, caller: str = "") -> Iterator[str]:
+    """Stream a completion and yield it line by line as soon as each line is complete.
+
+    Not hedged, since lines are consumed as they arrive; the timeout bounds each read.
+    """
+    model = model or default_model()
+    started = time.monotonic()
+    buf = ""
+    usage = first_token_at = None
+    try:
+        circuit, timeout = _open_circuit(model, caller)
+        settled = False
+        try:
+            stream = get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=timeout,
+            )
+            for chunk in stream:
+                # Последний чанк несёт только usage, без choices
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                    # Провайдер оценивается по времени до первого токена, а не по длине ответа
+                    settled = True
+                    _close_circuit(circuit, caller, model, started)
+                buf += chunk.choices[0].delta.content or ""
+                lines, buf = _split_lines(buf)
+                yield from lines
+        except Exception as e:
+            if not settled:
+                settled = True
+                _close_circuit(circuit, caller, model, started, e)
+            elif isinstance(e, _transient_errors()):
+                raise LLMUnavailable(f"{model}: {type(e).__name__}") from e
+            raise
+        else:
+            if not settled:
+                settled = True
+                _close_circuit(circuit, caller, model, started)
+        finally:
+            if not settled:
+                # Закрытый генератор (GeneratorExit) или прерывание до первого токена: исход неизвестен,
+                # но пробный вызов полуоткрытого выключателя должен освободиться
+                circuit.abort()
+    except Exception as e:
+        _ledger_error(model, messages, caller, started, e)
+        raise
+    if buf.strip():
+        yield buf.strip()
+    _record_usage(model, usage, started, first_token_at)
+    first_token_ms = int((first_token_at - started) * 1000) if first_token_at else None
+    ledger.record(model, messages, last_usage(), ledger.LLMCall.OUTCOME_OK, caller=caller, first_token_ms=first_token_ms)
@@ -0,0 +1,98 @@
+# api/services/local_planner.py
+"""Rule-based meal planning, the fallback while the LLM provider is unavailable.
+
+Meals are taken from the user's catalog (already ordered by popularity and
+recommendation scores), minus disliked ones and those containing allergens,
+and picked greedily so each prefix of the day tracks its share of the macro
+targets. Portion scaling then closes the remaining gap as for any plan. The
+output has the same shape as the LLM answers, so it is saved the usual way.
+"""
+from typing import Any, Dict, Iterable, List
+
+from api.models import MealReaction, UserIntake
+from api.services import cascade
+from api.services.targets import estimate_macros
+
+MODEL = "local"
+DAY_SIZE = 5
+# Рассматриваются только первые блюда каталога: он уже отсортирован по предпочтениям
+CANDIDATES = 60
+
+
+def targets_of(intake: UserIntake) -> Dict[str, float]:
+    targets = {
+        "proteins": intake.target_proteins,
+        "carbohydrates": intake.target_carbohydrates,
+        "fats": intake.target_fats,
+    }
+    if not all(targets.values()):
+        _, proteins, carbs, fats = estimate_macros(intake)
+        targets = {"proteins": proteins, "carbohydrates": carbs, "fats": fats}
+    return {macro: float(value) for macro, value in targets.items()}
+
+
+def _item(meal: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "name": meal["name"],
+        "recipe": meal.get("recipe") or "",
+        "proteins_g": float(meal.get("proteins") or 0),
+        "carbohydrates_g": float(meal.get("carbohydrates") or 0),
+        "fats_g": float(meal.get("fats") or 0),
+        "fiber_g": 0.0,
+    }
+
+
+def candidates(catalog: Dict[str, Any], intake: UserIntake, exclude: Iterable[str] = ()) -> List[Dict[str, Any]]:
+    disliked = set(
+        MealReaction.objects.filter(username=intake.username, reaction="dislike").values_list("meal_id", flat=True)
+    )
+    exclude = {name.strip().lower() for name in exclude}
+    items = []
+    for meal in catalog.get("meals", []):
+        if meal["id"] in disliked or meal["name"].strip().lower() in exclude:
+            continue
+        item = _item(meal)
+        if cascade.check_allergens([item], intake.allergies):
+            continue
+        items.append(item)
+        if len(items) >= CANDIDATES:
+            break
+    return items
+
+
+def _error(totals: Dict[str, float], goal: Dict[str, float]) -> float:
+    return sum(((totals[m] - t) / t) ** 2 for m, t in goal.items() if t)
+
+
+def pick(pool: List[Dict[str, Any]], count: int, targets: Dict[str, float]) -> List[Dict[str, Any]]:
+    """Greedy selection of ``count`` items whose macro totals approach ``targets``."""
+    pool = list(pool)
+    chosen: List[Dict[str, Any]] = []
+    totals = dict.fromkeys(cascade.MACROS, 0.0)
+    for k in range(1, count + 1):
+        if not pool:
+            break
+        goal = {m: t * k / count for m, t in targets.items()}
+        best = min(pool, key=lambda it: _error({m: totals[m] + it[m + "_g"] for m in totals}, goal))
+        pool.remove(best)
+        chosen.append(best)
+        for m in totals:
+            totals[m] += best[m + "_g"]
+    return chosen
+
+
+def daily_ration(intake: UserIntake, catalog: Dict[str, Any], exclude: Iterable[str] = ()) -> Dict[str, Any]:
+    return {"daily_ration": pick(candidates(catalog, intake, exclude), DAY_SIZE, targets_of(intake))}
+
+
+def replacements(prepared: Dict[str, Any]) -> Dict[str, Any]:
+    """Replacements for ``ration_updater.prepare_update()`` output, within the remaining macro limits."""
+    positions = prepared["replace_positions"]
+    fixed = [it for it in prepared["items"] if it.position not in positions]
+    limits = prepared["limits"]
+    remaining = {
+        m: max(limits[f"{m}_limit_g"] - sum(getattr(it, m) for it in fixed), 0.0) for m in cascade.MACROS
+    }
+    pool = candidates(prepared["catalog"], prepared["intake"], exclude=[it.name for it in prepared["items"]])
+    chosen = pick(pool, len(positions), remaining)
+    return {"replacements": [dict(item, position=pos) for pos, item in zip(positions, chosen)]}
@@ -0,0 +1,172 @@
+# api/services/plan_history.py
+"""Retention for plan history: hot plans -> monthly-partitioned archive -> purge.
+
+On Postgres ``api_dailyrationplanarchive`` is ``PARTITION BY RANGE (created_at)``
+with one partition per month plus a DEFAULT partition; expired months are
+dropped as whole partitions. Other databases use a plain table and chunked
+deletes. Every step works in small transactions so no long locks are held.
+"""
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import DailyRationPlan, DailyRationItem, DailyRationPlanArchive
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_TABLE = DailyRationPlanArchive._meta.db_table
+
+
+def is_partitioned() -> bool:
+    return connection.vendor == "postgresql"
+
+
+def _month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _next_month(value: date) -> date:
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"{ARCHIVE_TABLE}_p{month:%Y%m}"
+
+
+def ensure_partitions(start, end) -> List[str]:
+    """Create the monthly partitions covering [start, end); no-op off Postgres."""
+    if not is_partitioned():
+        return []
+    created = []
+    month = _month_start(start)
+    end = _next_month(_month_start(end))
+    with connection.cursor() as cur:
+        while month < end:
+            name = _partition_name(month)
+            # Даты генерируем сами, поэтому подставляем их литералами (DDL без параметров)
+            cur.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {ARCHIVE_TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+            )
+            created.append(name)
+            month = _next_month(month)
+    return created
+
+
+def archive_chunk(cutoff: datetime, chunk_size: int) -> int:
+    """Move up to ``chunk_size`` plans created before ``cutoff`` into the archive.
+
+    Only the plan and its items are archived. The raw LLM response
+    (``DailyRationResponse``) is deliberately dropped with the hot plan: it is
+    kept for debugging recent generations, and the items already hold what was
+    served. Speculative plans that were never claimed are deleted, not archived.
+    """
+    with transaction.atomic():
+        selected = list(
+            DailyRationPlan.objects.filter(created_at__lt=cutoff)
+            .order_by("id")
+            .select_for_update(skip_locked=True)
+            .values("id", "username", "model", "created_at", "speculative")[:chunk_size]
+        )
+        if not selected:
+            return 0
+        plans = [p for p in selected if not p["speculative"]]
+        plan_ids = [p["id"] for p in plans]
+
+        items: Dict[int, List[Dict[str, Any]]] = {pid: [] for pid in plan_ids}
+        for it in (
+            DailyRationItem.objects.filter(plan_id__in=plan_ids)
+            .order_by("plan_id", "position")
+            .values(
+                "plan_id", "position", "name", "recipe_ref_id", "meal_id", "product_id",
+                "proteins", "carbohydrates", "fats", "fiber", "portion", "weight", "eaten",
+            )
+        ):
+            pid = it.pop("plan_id")
+            it["recipe_digest"] = it.pop("recipe_ref_id")
+            items[pid].append(it)
+
+        DailyRationPlanArchive.objects.bulk_create(
+            [
+                DailyRationPlanArchive(
+                    plan_id=p["id"],
+                    username=p["username"],
+                    model=p["model"],
+                    created_at=p["created_at"],
+                    items=items[p["id"]],
+                )
+                for p in plans
+            ],
+            ignore_conflicts=True,
+        )
+        DailyRationPlan.objects.filter(id__in=[p["id"] for p in selected]).delete()
+    return len(selected)
+
+
+def oldest_hot_plan() -> Optional[datetime]:
+    return DailyRationPlan.objects.order_by("created_at").values_list("created_at", flat=True).first()
+
+
+def _expired_partitions(before: date) -> List[str]:
+    with connection.cursor() as cur:
+        cur.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [ARCHIVE_TABLE],
+        )
+        names = [row[0] for row in cur.fetchall()]
+    prefix = f"{ARCHIVE_TABLE}_p"
+    expired = []
+    for name in names:
+        suffix = name[len(prefix):] if name.startswith(prefix) else ""
+        if len(suffix) == 6 and suffix.isdigit():
+            month = date(int(suffix[:4]), int(suffix[4:]), 1)
+            if _next_month(month) <= before:
+                expired.append(name)
+    return sorted(expired)
+
+
+def purge_archive_chunk(before: datetime, chunk_size: int) -> int:
+    """Delete up to ``chunk_size`` archived plans created before ``before``."""
+    with transaction.atomic():
+        ids = list(
+            DailyRationPlanArchive.objects.filter(created_at__lt=before)
+            .order_by("created_at")
+            .values_list("plan_id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            return 0
+        DailyRationPlanArchive.objects.filter(created_at__lt=before, plan_id__in=ids).delete()
+    return len(ids)
+
+
+def drop_expired_partitions(before: date) -> List[str]:
+    """Detach and drop whole monthly partitions that end on or before ``before``."""
+    if not is_partitioned():
+        return []
+    dropped = []
+    for name in _expired_partitions(before):
+        with transaction.atomic(), connection.cursor() as cur:
+            cur.execute(f"ALTER TABLE {ARCHIVE_TABLE} DETACH PARTITION {name}")
+            cur.execute(f"DROP TABLE {name}")
+        logger.info("Dropped plan archive partition %s", name)
+        dropped.append(name)
+    return dropped
+
+
+def retention_cutoffs(hot_days: int, retention_months: int):
+    """(hot cutoff, archive cutoff or None) as aware datetimes."""
+    now = timezone.now()
+    hot_cutoff = now - timedelta(days=hot_days)
+    archive_cutoff = None
+    if retention_months:
+        month = _month_start(now)
+        for _ in range(retention_months):
+            month = date(month.year - (month.month == 1), (month.month - 2) % 12 + 1, 1)
+        archive_cutoff = timezone.make_aware(datetime.combine(month, time.min), timezone.get_default_timezone())
+    return hot_cutoff, archive_cutoff
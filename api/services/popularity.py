@@ -0,0 +1,223 @@
+# api/services/popularity.py
+"""Popularity counters (likes, dislikes, favorites) per meal and product.
+
+Reaction and favorite signals don't touch the database: they ``HINCRBY`` a
+per-item delta in Redis, and ``flush()`` (a frequent Celery beat task) moves
+the accumulated deltas into ``PopularityCounter`` in one pass. Bulk upserts
+(``meal_feedback``) bypass signals and old values, so they only mark items
+dirty and the flush recounts those exactly. ``reconcile()`` recounts
+everything daily to repair any drift (a failed flush, a lost Redis key).
+
+Sorting the catalog by popularity reads only the counters of the meals being
+ranked, through the (kind, object_id) unique index; ``top()`` uses (kind, -score).
+"""
+import logging
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from api.models import Meal, MealFavorite, MealReaction, PopularityCounter, Product, ProductFavorite, ProductReaction
+from api.services.hot_cache import redis_connection
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "popularity:pending"
+DIRTY_KEY = "popularity:dirty"
+FIELDS = ("likes", "dislikes", "favorites")
+# Лайк и избранное поднимают блюдо в каталоге, дизлайк опускает
+SCORE = F("likes") + F("favorites") - F("dislikes")
+RECONCILE_CHUNK = 1000
+
+# kind -> (каталог, реакции, избранное, имя FK)
+SOURCES = {
+    PopularityCounter.KIND_MEAL: (Meal, MealReaction, MealFavorite, "meal"),
+    PopularityCounter.KIND_PRODUCT: (Product, ProductReaction, ProductFavorite, "product"),
+}
+REACTION_FIELDS = {"like": "likes", "dislike": "dislikes"}
+
+
+def _after_commit(fn) -> None:
+    # Откаченная реакция не должна попасть в счётчики
+    transaction.on_commit(fn)
+
+
+def record(kind: str, object_id: int, **deltas: int) -> None:
+    """Add e.g. ``likes=1, dislikes=-1`` to an item's counters."""
+    deltas = {f: n for f, n in deltas.items() if n}
+    if not deltas:
+        return
+
+    def push():
+        conn = redis_connection()
+        if conn is None:
+            # Без Redis (dev, тесты) применяем сразу
+            _apply({(kind, object_id): deltas})
+            return
+        try:
+            pipe = conn.pipeline()
+            for field, n in deltas.items():
+                pipe.hincrby(PENDING_KEY, f"{kind}:{object_id}:{field}", n)
+            pipe.execute()
+        except Exception:
+            # Расхождение исправит ночная сверка
+            logger.warning("popularity delta for %s:%s lost", kind, object_id, exc_info=True)
+
+    _after_commit(push)
+
+
+def record_reaction(kind: str, object_id: int, old: Optional[str], new: Optional[str]) -> None:
+    if old == new:
+        return
+    deltas: Dict[str, int] = defaultdict(int)
+    if old in REACTION_FIELDS:
+        deltas[REACTION_FIELDS[old]] -= 1
+    if new in REACTION_FIELDS:
+        deltas[REACTION_FIELDS[new]] += 1
+    record(kind, object_id, **deltas)
+
+
+def mark_dirty(kind: str, object_ids: Iterable[int]) -> None:
+    """Schedule an exact recount for items changed without per-row signals."""
+    object_ids = list(object_ids)
+    if not object_ids:
+        return
+
+    def push():
+        conn = redis_connection()
+        if conn is None:
+            recount(kind, object_ids)
+            return
+        try:
+            conn.sadd(DIRTY_KEY, *(f"{kind}:{pk}" for pk in object_ids))
+        except Exception:
+            logger.warning("popularity dirty marks for %s lost", kind, exc_info=True)
+
+    _after_commit(push)
+
+
+def _take(conn, key: str, read):
+    # RENAME атомарен: всё, что придёт после, копится уже под старым ключом до следующего flush
+    taken = f"{key}:flushing:{uuid.uuid4().hex}"
+    try:
+        conn.rename(key, taken)
+    except Exception as e:
+        if "no such key" in str(e).lower():
+            return None
+        raise
+    try:
+        return read(taken)
+    finally:
+        conn.delete(taken)
+
+
+def _apply(deltas: Dict[tuple, Dict[str, int]]) -> None:
+    if not deltas:
+        return
+    now = timezone.now()
+    with transaction.atomic():
+        PopularityCounter.objects.bulk_create(
+            [PopularityCounter(kind=kind, object_id=pk) for kind, pk in deltas],
+            ignore_conflicts=True,
+        )
+        for (kind, pk), fields in deltas.items():
+            PopularityCounter.objects.filter(kind=kind, object_id=pk).update(
+                **{f: F(f) + n for f, n in fields.items()}, updated_at=now,
+            )
+        for kind in {kind for kind, _ in deltas}:
+            PopularityCounter.objects.filter(kind=kind, object_id__in=[pk for k, pk in deltas if k == kind]).update(score=SCORE)
+
+
+def recount(kind: str, object_ids: Iterable[int]) -> int:
+    """Recompute counters of ``object_ids`` from the reaction/favorite tables; returns rows written."""
+    _, reactions, favorites, fk = SOURCES[kind]
+    ids = list(object_ids)
+    counts = {pk: dict.fromkeys(FIELDS, 0) for pk in ids}
+    rows = (
+        reactions.objects.filter(**{f"{fk}_id__in": ids})
+        .values(f"{fk}_id")
+        .annotate(likes=Count("id", filter=Q(reaction="like")), dislikes=Count("id", filter=Q(reaction="dislike")))
+    )
+    for row in rows:
+        counts[row[f"{fk}_id"]].update(likes=row["likes"], dislikes=row["dislikes"])
+    for pk, n in favorites.objects.filter(**{f"{fk}_id__in": ids}).values_list(f"{fk}_id").annotate(n=Count("id")):
+        counts[pk]["favorites"] = n
+    now = timezone.now()
+    PopularityCounter.objects.bulk_create(
+        [
+            PopularityCounter(kind=kind, object_id=pk, score=c["likes"] + c["favorites"] - c["dislikes"], updated_at=now, **c)
+            for pk, c in counts.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["kind", "object_id"],
+        update_fields=[*FIELDS, "score", "updated_at"],
+    )
+    return len(counts)
+
+
+def flush() -> Dict[str, int]:
+    """Move pending Redis deltas into the counters table and recount dirty items."""
+    conn = redis_connection()
+    if conn is None:
+        return {"deltas": 0, "recounted": 0}
+    pending = _take(conn, PENDING_KEY, conn.hgetall) or {}
+    dirty = _take(conn, DIRTY_KEY, conn.smembers) or set()
+
+    deltas: Dict[tuple, Dict[str, int]] = defaultdict(dict)
+    for field, n in pending.items():
+        kind, pk, name = field.decode().split(":")
+        if int(n):
+            deltas[(kind, int(pk))][name] = int(n)
+    _apply(deltas)
+
+    by_kind: Dict[str, List[int]] = defaultdict(list)
+    for member in dirty:
+        kind, pk = member.decode().split(":")
+        by_kind[kind].append(int(pk))
+    # Пересчёт после дельт: точные значения перекрывают накопленные
+    recounted = sum(recount(kind, ids) for kind, ids in by_kind.items())
+    return {"deltas": len(deltas), "recounted": recounted}
+
+
+def reconcile() -> Dict[str, int]:
+    """Recount every catalog item in chunks and drop counters of deleted items."""
+    result = {}
+    for kind, (catalog, _, _, _) in SOURCES.items():
+        total = 0
+        ids = catalog.objects.order_by("id").values_list("id", flat=True).iterator(chunk_size=RECONCILE_CHUNK)
+        chunk = []
+        for pk in ids:
+            chunk.append(pk)
+            if len(chunk) >= RECONCILE_CHUNK:
+                total += recount(kind, chunk)
+                chunk = []
+        if chunk:
+            total += recount(kind, chunk)
+        deleted, _ = PopularityCounter.objects.filter(kind=kind).exclude(
+            object_id__in=catalog.objects.values("id")
+        ).delete()
+        result[kind] = total
+        result[f"{kind}_deleted"] = deleted
+    return result
+
+
+def scores(kind: str, object_ids: Iterable[int]) -> Dict[int, int]:
+    """Non-zero popularity scores of ``object_ids``, read by (kind, object_id) in chunks."""
+    ids = list(object_ids)
+    result: Dict[int, int] = {}
+    for start in range(0, len(ids), RECONCILE_CHUNK):
+        result.update(
+            PopularityCounter.objects.filter(kind=kind, object_id__in=ids[start:start + RECONCILE_CHUNK])
+            .exclude(score=0).values_list("object_id", "score")
+        )
+    return result
+
+
+def top(kind: str, limit: int = 20) -> List[int]:
+    return list(
+        PopularityCounter.objects.filter(kind=kind, score__gt=0)
+        .order_by("-score").values_list("object_id", flat=True)[:limit]
+    )
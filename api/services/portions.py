@@ -0,0 +1,119 @@
+# api/services/portions.py
+"""Portion scaling: per-item multipliers that bring a plan's macros onto the user's targets.
+
+The LLM picks the meals; the amounts are solved locally. For multipliers
+``x`` (bounded by PORTION_MIN..PORTION_MAX) we minimize the relative error
+``sum(((A @ x - t) / t) ** 2)`` over proteins, carbohydrates, fats and
+calories with projected coordinate descent, which converges to the optimum
+of this small convex box-constrained problem.
+"""
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+
+from api.models import UserIntake, Product, Meal, DailyRationItem
+from api.services import hot_cache
+
+MACROS = ("proteins", "carbohydrates", "fats")
+KCAL_PER_G = {"proteins": 4.0, "carbohydrates": 4.0, "fats": 9.0}
+
+
+def _load_targets(username: str) -> Dict[str, float]:
+    row = (
+        UserIntake.objects.filter(username=username).order_by("-created_at")
+        .values("target_proteins", "target_carbohydrates", "target_fats", "target_calories").first()
+    )
+    if not row:
+        return {}
+    targets = {macro: row[f"target_{macro}"] for macro in MACROS}
+    targets["calories"] = row["target_calories"]
+    return {k: float(v) for k, v in targets.items() if v and v > 0}
+
+
+def targets_for(username: str) -> Dict[str, float]:
+    """Daily targets of the latest intake; unset targets are left out."""
+    return hot_cache.get_or_set("targets", username, lambda: _load_targets(username))
+
+
+def base_weights(items: Iterable[DailyRationItem]) -> List[Optional[float]]:
+    """Base serving weight of each item's linked catalog meal or product (None if unlinked)."""
+    items = list(items)
+    meals = dict(Meal.objects.filter(pk__in={it.meal_id for it in items if it.meal_id}).values_list("id", "weight"))
+    products = dict(
+        Product.objects.filter(pk__in={it.product_id for it in items if it.product_id}).values_list("id", "weight")
+    )
+    return [meals.get(it.meal_id) if it.meal_id else products.get(it.product_id) for it in items]
+
+
+def solve(A, t, lower, upper, iterations: int = 500, tol: float = 1e-9):
+    """Bounded least squares ``min ||(A @ x - t) / t||`` with ``lower <= x <= upper``."""
+    import numpy as np
+
+    W = A / t[:, None]
+    H = W.T @ W
+    g = W.T @ np.ones(len(t))
+    x = np.clip(np.ones(A.shape[1]), lower, upper)
+    for _ in range(iterations):
+        step = 0.0
+        for i in range(len(x)):
+            if H[i, i] <= 0:
+                continue
+            new = min(max(x[i] - (H[i] @ x - g[i]) / H[i, i], lower[i]), upper[i])
+            step = max(step, abs(new - x[i]))
+            x[i] = new
+        if step < tol:
+            break
+    return x
+
+
+def _amount(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def factors(items: List[DailyRationItem], targets: Dict[str, float], locked: Iterable[int] = ()) -> List[float]:
+    """Portion multiplier of each item (1.0 at ``locked`` positions); all 1.0 without targets."""
+    import numpy as np
+
+    keys = [k for k in (*MACROS, "calories") if targets.get(k)]
+    if not items or not keys:
+        return [1.0] * len(items)
+    locked = set(locked)
+    per_item = []
+    for it in items:
+        macros = {m: _amount(getattr(it, m)) for m in MACROS}
+        macros["calories"] = sum(macros[m] * KCAL_PER_G[m] for m in MACROS)
+        per_item.append([macros[k] for k in keys])
+    A = np.array(per_item, dtype=float).T
+    t = np.array([targets[k] for k in keys], dtype=float)
+    lower = np.array([1.0 if it.position in locked else settings.PORTION_MIN for it in items])
+    upper = np.array([1.0 if it.position in locked else settings.PORTION_MAX for it in items])
+    return [round(float(f), 3) for f in solve(A, t, lower, upper)]
+
+
+def fitted_totals(items: List[DailyRationItem], targets: Dict[str, float], locked: Iterable[int] = ()) -> Dict[str, float]:
+    """Macro totals ``fit`` would produce, without touching the items or the database."""
+    totals = dict.fromkeys(MACROS, 0.0)
+    for it, factor in zip(items, factors(items, targets, locked)):
+        for macro in MACROS:
+            totals[macro] += round(_amount(getattr(it, macro)) * factor, 1)
+    return totals
+
+
+def fit(items: List[DailyRationItem], targets: Dict[str, float], locked: Iterable[int] = ()) -> List[DailyRationItem]:
+    """Rescale unsaved ``items`` in place; items at ``locked`` positions keep their portion.
+
+    Serving weights come from the linked catalog rows, so run ``catalog.link_items`` first.
+    """
+    if not items or not targets:
+        return items
+    locked = set(locked)
+    for it, factor, base in zip(items, factors(items, targets, locked), base_weights(items)):
+        if it.position not in locked:
+            for field in (*MACROS, "fiber"):
+                setattr(it, field, round(_amount(getattr(it, field)) * factor, 1))
+            it.portion = factor
+        it.weight = round(base * it.portion) if base else None
+    return items
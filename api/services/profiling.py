@@ -0,0 +1,248 @@
+# api/services/profiling.py
+"""On-demand profiling of single requests, stored as ``RequestProfile``.
+
+A staff user adds ``X-Profile: 1`` (or ``?_profile=1``) to any request, and
+``ProfilingMiddleware`` serves it under a sampling profiler: a background
+thread reads the request's stacks via ``sys._current_frames()`` every
+REQUEST_PROFILING_INTERVAL seconds and counts them in collapsed ("folded")
+form, ready for flamegraph.pl or speedscope. Each SQL statement is timed by an
+execute wrapper installed on every connection, and ``ledger.record()`` adds a
+span per LLM call. The profile is saved after the response and its id
+returned in the ``X-Profile-Id`` header; the admin lists and renders it.
+
+Sampled threads are the one running the middleware plus any thread that runs
+SQL or an LLM call for the request (``sync_to_async`` workers). Under ASGI the
+event loop thread is shared, so stacks of other requests may show up there.
+"""
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+from api.models import RequestProfile
+from api.services.compression import compress_json
+
+logger = logging.getLogger(__name__)
+
+HEADER = "HTTP_X_PROFILE"
+QUERY_FLAG = "_profile"
+MAX_DEPTH = 64
+
+_active: ContextVar[Optional["Profile"]] = ContextVar("request_profile", default=None)
+
+_ROOT = str(settings.BASE_DIR) + "/"
+
+
+def _where(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(_ROOT):
+        return filename[len(_ROOT):]
+    # Для библиотек путь от site-packages, для stdlib — имя файла
+    _, sep, rest = filename.rpartition("site-packages/")
+    return rest if sep else Path(filename).name
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(f"{frame.f_code.co_name} ({_where(frame.f_code)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.threads = {threading.get_ident()}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.queries = []
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.llm = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+
+    def offset_ms(self, at: float = None) -> float:
+        return round(((time.perf_counter() if at is None else at) - self.started) * 1000, 2)
+
+    def join_thread(self) -> None:
+        ident = threading.get_ident()
+        if ident not in self.threads:
+            with self._lock:
+                self.threads.add(ident)
+
+    def _sample(self) -> None:
+        interval = settings.REQUEST_PROFILING_INTERVAL
+        ends = self.started + settings.REQUEST_PROFILING_MAX_SECONDS
+        own = threading.get_ident()
+        while not self._stop.wait(interval) and time.perf_counter() < ends:
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self.threads)
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None and ident != own:
+                    self.stacks[_collapse(frame)] += 1
+            self.samples += 1
+            del frames
+
+    def start(self) -> None:
+        self._sampler.start()
+
+    def stop(self) -> float:
+        self._stop.set()
+        self._sampler.join()
+        return self.offset_ms()
+
+    def add_query(self, sql: str, alias: str, many: bool, started: float, ms: float) -> None:
+        self.join_thread()
+        with self._lock:
+            self.sql_count += 1
+            self.sql_ms += ms
+            if len(self.queries) < settings.REQUEST_PROFILING_MAX_QUERIES:
+                self.queries.append(
+                    {"at_ms": self.offset_ms(started), "ms": round(ms, 2), "db": alias, "many": many, "sql": sql}
+                )
+
+    def add_llm(self, span: Dict[str, Any]) -> None:
+        self.join_thread()
+        with self._lock:
+            self.llm.append(span)
+
+    def artifact(self) -> Dict[str, Any]:
+        return {"stacks": dict(self.stacks.most_common()), "queries": self.queries, "llm": self.llm}
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    profile = _active.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, context["connection"].alias, many, started, (time.perf_counter() - started) * 1000)
+
+
+def _instrument(sender, connection, **kwargs) -> None:
+    # Обёртка ставится на каждое соединение процесса и ничего не делает вне профилируемого запроса
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+connection_created.connect(_instrument, dispatch_uid="api.services.profiling")
+
+
+def note_llm(model: str, caller: str, outcome: str, latency_ms: int, first_token_ms: Optional[int] = None, **tokens) -> None:
+    """Attach an LLM call span to the request being profiled, if any."""
+    profile = _active.get()
+    if profile is None:
+        return
+    ends = profile.offset_ms()
+    profile.add_llm({
+        "at_ms": round(ends - latency_ms, 2), "ms": latency_ms, "model": model, "caller": caller,
+        "outcome": outcome, "first_token_ms": first_token_ms, **tokens,
+    })
+
+
+def _requested(request) -> bool:
+    return settings.REQUEST_PROFILING_ENABLED and (
+        request.META.get(HEADER) == "1" or request.GET.get(QUERY_FLAG) == "1"
+    )
+
+
+def _build(request, response, profile: Profile, duration_ms: float, user) -> RequestProfile:
+    match = getattr(request, "resolver_match", None)
+    codec, body, size = compress_json(profile.artifact())
+    return RequestProfile(
+        username=user.username,
+        method=request.method,
+        path=request.get_full_path()[:512],
+        view_name=(match.view_name if match else "")[:128],
+        status_code=getattr(response, "status_code", None),
+        duration_ms=round(duration_ms),
+        sql_count=profile.sql_count,
+        sql_ms=round(profile.sql_ms),
+        llm_count=len(profile.llm),
+        llm_ms=sum(span["ms"] for span in profile.llm),
+        samples=profile.samples,
+        codec=codec,
+        body=body,
+        size=size,
+    )
+
+
+class ProfilingMiddleware:
+    """Profiles requests of staff users that ask for it with ``X-Profile: 1`` or ``?_profile=1``."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not (_requested(request) and request.user.is_staff):
+            return self.get_response(request)
+        profile = Profile()
+        token = _active.set(profile)
+        profile.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration_ms = profile.stop()
+            _active.reset(token)
+        # Сохранение — уже вне профиля, его запросы в артефакт не попадают
+        try:
+            row = _build(request, response, profile, duration_ms, request.user)
+            row.save()
+            response["X-Profile-Id"] = str(row.pk)
+        except Exception:
+            logger.warning("request profile of %s was not saved", request.path, exc_info=True)
+        return response
+
+    async def __acall__(self, request):
+        if not _requested(request) or not (await request.auser()).is_staff:
+            return await self.get_response(request)
+        profile = Profile()
+        token = _active.set(profile)
+        profile.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            duration_ms = profile.stop()
+            _active.reset(token)
+        try:
+            row = _build(request, response, profile, duration_ms, await request.auser())
+            await row.asave()
+            response["X-Profile-Id"] = str(row.pk)
+        except Exception:
+            logger.warning("request profile of %s was not saved", request.path, exc_info=True)
+        return response
+
+
+def folded(profile: RequestProfile) -> str:
+    """Stacks in the folded format of flamegraph.pl / speedscope: ``frame;frame;frame count`` per line."""
+    return "".join(f"{stack} {n}\n" for stack, n in profile.data["stacks"].items())
+
+
+def purge() -> int:
+    cutoff = timezone.now() - timedelta(days=settings.REQUEST_PROFILING_RETENTION_DAYS)
+    deleted, _ = RequestProfile.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,153 @@
+# api/services/prompts.py
+"""Chat prompts laid out for provider-side prefix caching.
+
+Providers cache the longest byte-identical prefix of a request, so every
+prompt here is built stable-first:
+
+1. system message — rules, output schema and requirements (constant text);
+2. catalog message — the meal/product catalog, rows in id order (changes
+   only with the catalog, not with whose ranking selected it);
+3. request message — the task and everything per-user or per-call, including
+   the meal ranking, favourites and exclusions.
+
+JSON is serialized with sorted keys and fixed separators so the same data
+always produces the same bytes.
+"""
+import json
+from typing import Any, Dict, List, Tuple
+
+CATALOG_KINDS = ("products", "meals")
+ITEM_SCHEMA = {
+    "name": "string",
+    "recipe": "string",
+    "proteins_g": "number",
+    "carbohydrates_g": "number",
+    "fats_g": "number",
+    "fiber_g": "number",
+}
+# Ранжирование и предпочтения идут в запросе: порядок строк каталога от пользователя не зависит
+PREFERENCE_RULE = (
+    "Prefer meals earlier in meal_ranking and those in favorite_meal_ids; never use meals in excluded_meal_ids."
+)
+
+DAILY_RATION_SYSTEM = (
+    "You are a nutrition assistant. Create a practical daily meal plan using ONLY the provided meals/products. "
+    "Respect the user's allergies, dietary restrictions, goal, and available kitchen equipment. "
+    "Daily ration must have exactly 5 meals. Keep recipes feasible for the user's cooking skill. "
+    "Return only valid JSON that conforms to the specified schema."
+)
+DAILY_RATION_RULES = {
+    "output_schema": {"daily_ration": [ITEM_SCHEMA]},
+    "requirements": [
+        "Exactly 5 items in daily_ration.",
+        "Each item must specify name, recipe, proteins_g, carbohydrates_g, fats_g, fiber_g.",
+        "Prefer existing meals; if needed, compose simple meals from products.",
+        "Macros should be realistic and sum up consistent with goal and activity.",
+        "Exclude any item violating allergies or dietary restrictions.",
+        PREFERENCE_RULE,
+    ],
+}
+
+UPDATE_SYSTEM = (
+    "You are a nutrition assistant. Update only the disliked meals in today's plan. "
+    "Keep all non-disliked meals unchanged. Use ONLY the provided catalog of meals/products. "
+    "Respect allergies, dietary restrictions, kitchen equipment, and macro limits. "
+    "Return valid JSON per schema."
+)
+UPDATE_RULES = {
+    "output_schema": {"replacements": [dict(ITEM_SCHEMA, position="number 1-5")]},
+    "requirements": [
+        "Do NOT modify fixed_items.",
+        "Return one replacement per position in replace_positions.",
+        "Sum of fixed_items + replacements must not exceed any macro limit.",
+        "Prefer existing meals from catalog; compose from products if needed.",
+        "Exclude any item violating allergies/dietary restrictions.",
+        PREFERENCE_RULE,
+    ],
+}
+
+WEEKLY_SYSTEM = (
+    "You are a nutrition assistant. Create a practical multi-day meal plan using ONLY the provided meals/products. "
+    "Respect the user's allergies, dietary restrictions, goal, and available kitchen equipment. "
+    "Each day must have exactly 5 meals. Keep recipes feasible for the user's cooking skill. "
+    "Output JSON Lines: exactly one compact JSON object per line, one line per day, no other text."
+)
+WEEKLY_MAX_REPEATS = 2
+WEEKLY_RULES = {
+    "line_schema": {"day": "number, 1-based", "daily_ration": [ITEM_SCHEMA]},
+    "requirements": [
+        "Exactly one line per day, in day order, each line a complete JSON object.",
+        "Exactly 5 items in every daily_ration.",
+        "Do not repeat a meal on two consecutive days.",
+        f"No meal may appear more than {WEEKLY_MAX_REPEATS} times in the whole plan.",
+        "Vary protein sources across the week.",
+        "Daily macros should be realistic and consistent with goal and activity.",
+        "Exclude any item violating allergies or dietary restrictions.",
+        PREFERENCE_RULE,
+    ],
+}
+
+
+def dumps(obj: Any) -> str:
+    """Byte-stable JSON: equal data always serializes to the same string."""
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def split_catalog(catalog: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Catalog rows in canonical (id) order, and the per-user part: meal ranking and preferences."""
+    shared = {kind: sorted(catalog.get(kind, []), key=lambda row: row["id"]) for kind in CATALOG_KINDS}
+    personal = {"meal_ranking": [m["id"] for m in catalog.get("meals", [])]}
+    personal.update(catalog.get("preferences") or {})
+    return shared, personal
+
+
+def compose(system: str, rules: Dict[str, Any], catalog: Dict[str, Any], request: Dict[str, Any]) -> List[Dict[str, str]]:
+    shared, personal = split_catalog(catalog)
+    return [
+        {"role": "system", "content": system + "\n" + dumps(rules)},
+        {"role": "user", "content": "Catalog:\n" + dumps(shared)},
+        {"role": "user", "content": dumps(dict(request, **personal))},
+    ]
+
+
+def _constraints(profile: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "use_only_from_catalog": True,
+        "avoid_allergens": profile.get("allergies", []),
+        "dietary_restrictions": profile.get("dietary_restrictions", []),
+        "kitchen_equipment": profile.get("kitchen_equipment", []),
+        "preferred_units": profile.get("preferred_units", "metric"),
+    }
+
+
+def daily_ration(profile: Dict[str, Any], catalog: Dict[str, Any]) -> List[Dict[str, str]]:
+    return compose(DAILY_RATION_SYSTEM, DAILY_RATION_RULES, catalog, {
+        "task": "Generate a 5-meal daily ration.",
+        "constraints": _constraints(profile),
+        "user_profile": profile,
+    })
+
+
+def ration_update(
+    profile: Dict[str, Any],
+    catalog: Dict[str, Any],
+    fixed_items: List[Dict[str, Any]],
+    replace_positions: List[int],
+    limits: Dict[str, float],
+) -> List[Dict[str, str]]:
+    return compose(UPDATE_SYSTEM, UPDATE_RULES, catalog, {
+        "task": "Replace the disliked items only, keeping others unchanged.",
+        "limits": limits,
+        "fixed_items": fixed_items,
+        "replace_positions": replace_positions,
+        "user_profile": profile,
+    })
+
+
+def weekly_ration(profile: Dict[str, Any], catalog: Dict[str, Any], days: int) -> List[Dict[str, str]]:
+    return compose(WEEKLY_SYSTEM, WEEKLY_RULES, catalog, {
+        "task": f"Generate a {days}-day meal plan, 5 meals per day.",
+        "days": days,
+        "constraints": _constraints(profile),
+        "user_profile": profile,
+    })
@@ -1,103 +1,89 @@
 # api/services/ration_generator.py
-import os
-import json
-from typing import Dict, Any, List, Optional
-from api.models import UserIntake, Product, Meal, DailyRationPlan, DailyRationItem
-from openai import OpenAI
-
-def generate_ration(username: Optional[str] = None, model: str = None) -> Dict[str, Any]:
-    # Загружаем профиль
-    if username:
-        rec = (
-            UserIntake.objects.filter(username=username)
-            .order_by("-created_at")
-            .first()
-        )
-        if rec:
-            profile = {
-                "username": rec.username,
-                "display_name": rec.display_name,
-                "gender": rec.gender,
-                "age": rec.age,
-                "height_cm": rec.height,
-                "weight_kg": rec.weight,
-                "goal": rec.goal,
-                "activity_level": rec.activity_level,
-                "dietary_restrictions": rec.dietary_restrictions or [],
-                "allergies": rec.allergies or [],
-                "cooking_skill": rec.cooking_skill,
-                "kitchen_equipment": rec.kitchen_equipment or [],
-                "preferred_units": rec.preferred_units,
-            }
-        else:
-            raise ValueError(f"No profile found for user {username}")
-    else:
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from api.models import UserIntake, DailyRationPlan, DailyRationItem, Recipe
+from api.services import cascade, llm, local_planner, portions, prompts
+from api.services.catalog import link_items, load_catalog
+
+logger = logging.getLogger(__name__)
+
+
+def profile_from_intake(rec: UserIntake) -> Dict[str, Any]:
+    return {
+        "username": rec.username,
+        "display_name": rec.display_name,
+        "gender": rec.gender,
+        "age": rec.age,
+        "height_cm": rec.height,
+        "weight_kg": rec.weight,
+        "goal": rec.goal,
+        "activity_level": rec.activity_level,
+        "dietary_restrictions": rec.dietary_restrictions or [],
+        "allergies": rec.allergies or [],
+        "cooking_skill": rec.cooking_skill,
+        "kitchen_equipment": rec.kitchen_equipment or [],
+        "preferred_units": rec.preferred_units,
+    }
+
+
+def _latest_intake(username: Optional[str]):
+    if not username:
         raise ValueError("Username is required")
+    return UserIntake.objects.filter(username=username).order_by("-created_at")
+
+
+def load_intake(username: Optional[str]) -> UserIntake:
+    rec = _latest_intake(username).first()
+    if rec is None:
+        raise ValueError(f"No profile found for user {username}")
+    return rec
+
+
+async def aload_intake(username: Optional[str]) -> UserIntake:
+    rec = await _latest_intake(username).afirst()
+    if rec is None:
+        raise ValueError(f"No profile found for user {username}")
+    return rec
+
+
+def load_profile(username: Optional[str]) -> Dict[str, Any]:
+    return profile_from_intake(load_intake(username))
+
+
+async def aload_profile(username: Optional[str]) -> Dict[str, Any]:
+    return profile_from_intake(await aload_intake(username))
+
+
+def build_messages(profile: Dict[str, Any], catalog: Dict[str, Any]) -> List[Dict[str, str]]:
+    return prompts.daily_ration(profile, catalog)
 
-    # Каталог продуктов/блюд
-    products = list(Product.objects.order_by("id")[:100])
-    meals = list(Meal.objects.order_by("id")[:100])
-
-    catalog = {
-        "products": [
-            {
-                "id": p.id,
-                "name": p.name,
-                "calories": p.calories,
-                "proteins": p.proteins,
-                "carbohydrates": p.carbohydrates,
-                "fats": p.fats,
-                "type": p.type,
-            }
-            for p in products
-        ],
-        "meals": [
-            {
-                "id": m.id,
-                "name": m.name,
-                "calories": m.calories,
-                "proteins": m.proteins,
-                "carbohydrates": m.carbohydrates,
-                "fats": m.fats,
-                "type": m.type,
-                "recipe": m.recipe,
-            }
-            for m in meals
-        ],
+
+def validate_ration(data: Dict[str, Any], intake: UserIntake) -> List[str]:
+    """Local acceptance check for the model cascade: 5 items, no allergens, macros near targets.
+
+    Macros are checked after portion scaling, as the plan would be saved: an answer that
+    ``portions.fit`` brings onto the targets is not escalated.
+    """
+    items = data.get("daily_ration")
+    problems = cascade.check_count(items, 5)
+    if problems:
+        return problems
+    targets = {
+        "proteins": intake.target_proteins,
+        "carbohydrates": intake.target_carbohydrates,
+        "fats": intake.target_fats,
     }
+    fit_targets = dict(targets, calories=intake.target_calories)
+    fit_targets = {k: float(v) for k, v in fit_targets.items() if v and v > 0}
+    totals = portions.fitted_totals(_plan_items(None, data), fit_targets)
+    return cascade.check_allergens(items, intake.allergies) + cascade.check_totals(totals, targets)
+
 
-    catalog = {
-			'products': list(Product.objects.filter(user__username=username).order_by('id').values('id','name','calories','proteins','carbohydrates','fats','weight','type')),
-			'meals': list(Meal.objects.filter(user__username=username).order_by('id').values('id','name','calories','proteins','carbohydrates','fats','weight','type','recipe')),
-		}
-
-    # prompt
-    messages = [
-        {"role": "system", "content": "You are a nutrition assistant..."},
-        {"role": "user", "content": json.dumps({
-            "task": "Generate a 5-meal daily ration.",
-            "user_profile": profile,
-            "catalog": catalog,
-        }, ensure_ascii=False)},
-    ]
-
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    completion = client.chat.completions.create(
-        model=model or "gpt-4o-mini",
-        messages=messages,
-        temperature=0.6,
-        response_format={"type": "json_object"},
-    )
-
-    content = completion.choices[0].message.content or "{}"
-    data = json.loads(content)
-
-    # сохраняем план в БД
-    plan = DailyRationPlan.objects.create(
-        username=username,
-        model=model or "gpt-4o-mini",
-        raw_response=data,
-    )
+def _plan_items(plan: DailyRationPlan, data: Dict[str, Any]) -> List[DailyRationItem]:
     bulk = []
     for idx, item in enumerate(data.get("daily_ration", []), start=1):
         bulk.append(
@@ -113,6 +99,69 @@ def generate_ration(username: Optional[str] = None, model: str = None) -> Dict[s
                 eaten=False,
             )
         )
-    DailyRationItem.objects.bulk_create(bulk)
+    return bulk
+
+
+def _prepare_items(username: str, plan: DailyRationPlan, data: Dict[str, Any]) -> List[DailyRationItem]:
+    items = link_items(_plan_items(plan, data), username)
+    items = portions.fit(items, portions.targets_for(username))
+    return Recipe.objects.attach(items)
+
+
+@transaction.atomic
+def save_plan(username: str, model: str, data: Dict[str, Any], **fields) -> DailyRationPlan:
+    # План, ответ и позиции видны только вместе: иначе страница плана закэширует его пустым
+    plan = DailyRationPlan.objects.create(username=username, model=model, **fields)
+    plan.store_response(data)
+    DailyRationItem.objects.bulk_create(_prepare_items(username, plan, data))
+    return plan
+
+
+async def asave_plan(username: str, model: str, data: Dict[str, Any], **fields) -> DailyRationPlan:
+    return await sync_to_async(save_plan)(username, model, data, **fields)
+
 
+def _local_ration(intake: UserIntake, catalog: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+    # И при недоступности моделей, и при cascade.Rejected: ответ, не прошедший проверку, не сохраняется
+    logger.warning("No valid LLM answer (%s), planning the day for %s locally", error, intake.username)
+    return local_planner.daily_ration(intake, catalog)
+
+
+def generate_ration(username: Optional[str] = None, model: str = None, **fields) -> Dict[str, Any]:
+    intake = load_intake(username)
+    catalog = load_catalog(username)
+    try:
+        data, model = cascade.run(
+            cascade.KIND_RATION,
+            build_messages(profile_from_intake(intake), catalog),
+            lambda d: validate_ration(d, intake),
+            cascade.models_for(model),
+        )
+    except llm.LLMUnavailable as e:
+        data = _local_ration(intake, catalog, e)
+        save_plan(username, local_planner.MODEL, data, **fields)
+        return data
+    save_plan(username, model, data, **fields, **llm.last_usage())
     return data
+
+
+async def agenerate_ration(username: Optional[str] = None, model: str = None) -> Dict[str, Any]:
+    """Async variant for ASGI views: the upstream call does not hold a worker thread."""
+    _, data = await agenerate_plan(username, model)
+    return data
+
+
+async def agenerate_plan(username: Optional[str] = None, model: str = None) -> Tuple[DailyRationPlan, Dict[str, Any]]:
+    intake = await aload_intake(username)
+    catalog = await sync_to_async(load_catalog)(username)
+    try:
+        data, model = await cascade.arun(
+            cascade.KIND_RATION,
+            build_messages(profile_from_intake(intake), catalog),
+            lambda d: validate_ration(d, intake),
+            cascade.models_for(model),
+        )
+    except llm.LLMUnavailable as e:
+        data = await sync_to_async(_local_ration)(intake, catalog, e)
+        return await asave_plan(username, local_planner.MODEL, data), data
+    return await asave_plan(username, model, data, **llm.last_usage()), data
@@ -0,0 +1,276 @@
+# api/services/ration_updater.py
+"""Replace only the disliked meals of a user's latest plan (Django ORM port of the old update script)."""
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Q
+
+from api.models import (
+    UserIntake,
+    DailyRationPlan,
+    DailyRationItem,
+    MealReaction,
+    Recipe,
+)
+from api.services import cascade, llm, local_planner, portions, prompts
+from api.services.catalog import link_items, load_catalog
+from api.services.targets import estimate_macros
+
+logger = logging.getLogger(__name__)
+
+
+def _latest_plan_qs(username: str, plan_id: Optional[int], today_only: bool):
+    if plan_id:
+        return DailyRationPlan.objects.filter(username=username, id=plan_id)
+    q = DailyRationPlan.objects.current_for(username)
+    if today_only:
+        now = datetime.now(timezone.utc)
+        start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        # День недельного плана считается "сегодняшним" по своей дате, а не по дате генерации
+        q = q.filter(Q(created_at__gte=start_of_day) | Q(plan_date=now.date()))
+    return q
+
+
+def load_latest_plan(username: str, plan_id: Optional[int], today_only: bool) -> Optional[Tuple[DailyRationPlan, List[DailyRationItem]]]:
+    plan = _latest_plan_qs(username, plan_id, today_only).first()
+    if not plan:
+        return None
+    items = list(DailyRationItem.objects.filter(plan=plan).select_related("recipe_ref").order_by("position"))
+    return plan, items
+
+
+def load_profile(username: str) -> Optional[UserIntake]:
+    return UserIntake.objects.filter(username=username).order_by("-created_at").first()
+
+
+def disliked_positions(username: str, plan: DailyRationPlan) -> List[int]:
+    """Positions of the plan whose catalog meal the user disliked (a semi-join on the linked meal_id)."""
+    disliked = MealReaction.objects.filter(username=username, reaction="dislike").values("meal_id")
+    return list(
+        DailyRationItem.objects.filter(plan=plan, meal_id__in=disliked)
+        .order_by("position").values_list("position", flat=True)
+    )
+
+
+def sum_macros(items: List[DailyRationItem]) -> Dict[str, float]:
+    total = {"proteins": 0.0, "carbohydrates": 0.0, "fats": 0.0, "calories": 0.0}
+    for it in items:
+        total["proteins"] += it.proteins
+        total["carbohydrates"] += it.carbohydrates
+        total["fats"] += it.fats
+        total["calories"] += it.proteins * 4 + it.carbohydrates * 4 + it.fats * 9
+    return total
+
+
+def build_prompt(profile: Dict[str, Any], catalog: Dict[str, Any], fixed_items: List[Dict[str, Any]], disliked_positions: List[int], limits: Dict[str, float]) -> List[Dict[str, str]]:
+    return prompts.ration_update(profile, catalog, fixed_items, disliked_positions, limits)
+
+
+def prepare_update(
+    username: str,
+    plan_id: Optional[int] = None,
+    today_only: bool = True,
+    limits: Optional[Dict[str, float]] = None,
+    max_products: Optional[int] = None,
+    max_meals: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Everything up to the LLM call. Returns {"result": ...} when there is nothing to ask."""
+    plan_items = load_latest_plan(username, plan_id, today_only)
+    if not plan_items:
+        raise RuntimeError("No plan found for user")
+    plan, items = plan_items
+
+    profile_rec = load_profile(username)
+    if not profile_rec:
+        raise RuntimeError("User profile not found")
+
+    # Determine limits
+    if limits and all(limits.get(k) for k in ("calories_limit", "proteins_limit_g", "carbohydrates_limit_g", "fats_limit_g")):
+        calories_limit = limits["calories_limit"]
+        proteins_limit_g = limits["proteins_limit_g"]
+        carbohydrates_limit_g = limits["carbohydrates_limit_g"]
+        fats_limit_g = limits["fats_limit_g"]
+    else:
+        calories_limit, proteins_limit_g, carbohydrates_limit_g, fats_limit_g = estimate_macros(profile_rec)
+
+    limits = {
+        "calories_limit": round(calories_limit, 2),
+        "proteins_limit_g": round(proteins_limit_g, 2),
+        "carbohydrates_limit_g": round(carbohydrates_limit_g, 2),
+        "fats_limit_g": round(fats_limit_g, 2),
+    }
+
+    replace_positions = disliked_positions(username, plan)
+    fixed_items: List[Dict[str, Any]] = [
+        {
+            "position": it.position,
+            "name": it.name,
+            "recipe": it.recipe,
+            "proteins_g": it.proteins,
+            "carbohydrates_g": it.carbohydrates,
+            "fats_g": it.fats,
+            "fiber_g": it.fiber,
+        }
+        for it in items
+        if it.position not in replace_positions
+    ]
+
+    if not replace_positions:
+        return {"result": {"message": "No disliked items to replace.", "plan_id": plan.id}}
+
+    catalog = load_catalog(username, max_products, max_meals)
+
+    profile = {
+        "display_name": profile_rec.display_name,
+        "gender": profile_rec.gender,
+        "age": profile_rec.age,
+        "height_cm": profile_rec.height,
+        "weight_kg": profile_rec.weight,
+        "goal": profile_rec.goal,
+        "activity_level": profile_rec.activity_level,
+        "dietary_restrictions": profile_rec.dietary_restrictions or [],
+        "allergies": profile_rec.allergies or [],
+        "cooking_skill": profile_rec.cooking_skill,
+        "kitchen_equipment": profile_rec.kitchen_equipment or [],
+        "preferred_units": profile_rec.preferred_units,
+    }
+
+    return {
+        "plan": plan,
+        "items": items,
+        "intake": profile_rec,
+        "limits": limits,
+        "replace_positions": replace_positions,
+        "catalog": catalog,
+        "messages": build_prompt(profile, catalog, fixed_items, replace_positions, limits),
+    }
+
+
+def validate_update(data: Dict[str, Any], prepared: Dict[str, Any]) -> List[str]:
+    """Local acceptance check for the model cascade: every position replaced, no allergens, within limits."""
+    replacements = data.get("replacements")
+    problems = cascade.check_count(replacements, len(prepared["replace_positions"]))
+    if problems:
+        return problems
+    try:
+        positions = {int(r.get("position")) for r in replacements}
+    except (TypeError, ValueError):
+        return ["replacement without a valid position"]
+    missing = set(prepared["replace_positions"]) - positions
+    if missing:
+        return [f"positions not replaced: {sorted(missing)}"]
+    limits = prepared["limits"]
+    totals = cascade.item_totals(merge_replacements(prepared["items"], data), suffix="")
+    targets = {
+        "proteins": limits["proteins_limit_g"],
+        "carbohydrates": limits["carbohydrates_limit_g"],
+        "fats": limits["fats_limit_g"],
+    }
+    return (
+        cascade.check_allergens(replacements, prepared["intake"].allergies)
+        + cascade.check_totals(totals, targets, upper_only=True)
+    )
+
+
+def merge_replacements(items: List[DailyRationItem], data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    repl_by_pos = {int(r.get("position")): r for r in data.get("replacements", [])}
+    new_items: List[Dict[str, Any]] = []
+    for it in items:
+        if it.position in repl_by_pos:
+            r = repl_by_pos[it.position]
+            new_items.append(
+                {
+                    "position": it.position,
+                    "name": str(r.get("name", ""))[:256],
+                    "recipe": str(r.get("recipe", "")),
+                    "proteins": float(r.get("proteins_g", 0) or 0),
+                    "carbohydrates": float(r.get("carbohydrates_g", 0) or 0),
+                    "fats": float(r.get("fats_g", 0) or 0),
+                    "fiber": float(r.get("fiber_g", 0) or 0),
+                    "eaten": False,
+                }
+            )
+        else:
+            new_items.append(
+                {
+                    "position": it.position,
+                    "name": it.name,
+                    "meal_id": it.meal_id,
+                    "product_id": it.product_id,
+                    "recipe": it.recipe,
+                    "proteins": it.proteins,
+                    "carbohydrates": it.carbohydrates,
+                    "fats": it.fats,
+                    "fiber": it.fiber,
+                    "portion": it.portion,
+                    "weight": it.weight,
+                    "eaten": it.eaten,
+                }
+            )
+    return sorted(new_items, key=lambda x: x["position"])
+
+
+def _successor_fields(plan: DailyRationPlan) -> Dict[str, Any]:
+    # Обновлённый план занимает тот же день недельного плана
+    return {"week_id": plan.week_id, "day_index": plan.day_index, "plan_date": plan.plan_date}
+
+
+def _updated_items(username: str, plan2: DailyRationPlan, items: List[DailyRationItem], data: Dict[str, Any]) -> List[DailyRationItem]:
+    new_items = link_items([DailyRationItem(plan=plan2, **ni) for ni in merge_replacements(items, data)], username)
+    # Подгоняются только замены; оставленные позиции сохраняют свои порции
+    replaced = {int(r.get("position")) for r in data.get("replacements", [])}
+    portions.fit(new_items, portions.targets_for(username), locked=[it.position for it in new_items if it.position not in replaced])
+    return Recipe.objects.attach(new_items)
+
+
+@transaction.atomic
+def save_updated_plan(username: str, model: str, data: Dict[str, Any], plan: DailyRationPlan, items: List[DailyRationItem]) -> DailyRationPlan:
+    usage = {} if model == local_planner.MODEL else llm.last_usage()
+    plan2 = DailyRationPlan.objects.create(username=username, model=model, **_successor_fields(plan), **usage)
+    plan2.store_response(data)
+    DailyRationItem.objects.bulk_create(_updated_items(username, plan2, items, data))
+    return plan2
+
+
+def _should_save(save: bool, data: Dict[str, Any]) -> bool:
+    return save and isinstance(data, dict) and isinstance(data.get("replacements"), list)
+
+
+def _local_update(prepared: Dict[str, Any], error: Exception) -> Dict[str, Any]:
+    # И при недоступности моделей, и при cascade.Rejected: ответ, не прошедший проверку, не сохраняется
+    logger.warning("No valid LLM answer (%s), replacing plan %s meals locally", error, prepared["plan"].pk)
+    return local_planner.replacements(prepared)
+
+
+def update_ration(username: str, model: Optional[str] = None, save: bool = True, **options) -> Dict[str, Any]:
+    prepared = prepare_update(username, **options)
+    if "result" in prepared:
+        return prepared["result"]
+    try:
+        data, model = cascade.run(
+            cascade.KIND_UPDATE, prepared["messages"], lambda d: validate_update(d, prepared), cascade.models_for(model)
+        )
+    except llm.LLMUnavailable as e:
+        data, model = _local_update(prepared, e), local_planner.MODEL
+    if _should_save(save, data):
+        data["new_plan_id"] = save_updated_plan(username, model, data, prepared["plan"], prepared["items"]).id
+    return data
+
+
+async def aupdate_ration(username: str, model: Optional[str] = None, save: bool = True, **options) -> Dict[str, Any]:
+    prepared = await sync_to_async(prepare_update)(username, **options)
+    if "result" in prepared:
+        return prepared["result"]
+    try:
+        data, model = await cascade.arun(
+            cascade.KIND_UPDATE, prepared["messages"], lambda d: validate_update(d, prepared), cascade.models_for(model)
+        )
+    except llm.LLMUnavailable as e:
+        data, model = await sync_to_async(_local_update)(prepared, e), local_planner.MODEL
+    if _should_save(save, data):
+        plan2 = await sync_to_async(save_updated_plan)(username, model, data, prepared["plan"], prepared["items"])
+        data["new_plan_id"] = plan2.id
+    return data
@@ -0,0 +1,105 @@
+# api/services/recommender.py
+import logging
+from typing import Any, Dict, Iterator, List, Tuple
+
+from django.conf import settings
+
+from api.models import MealReaction, MealFavorite, UserMealScores
+
+logger = logging.getLogger(__name__)
+
+# Веса неявной обратной связи
+REACTION_WEIGHTS = {"like": 1.0, "dislike": -1.0}
+FAVORITE_WEIGHT = 2.0
+
+SCORE_BLOCK_SIZE = 512
+
+
+def build_interaction_matrix():
+    """Sparse user x meal matrix from MealReaction and MealFavorite rows."""
+    import numpy as np
+    from scipy.sparse import coo_matrix
+
+    cells: Dict[Tuple[str, int], float] = {}
+    for username, meal_id, reaction in MealReaction.objects.values_list("username", "meal_id", "reaction").iterator():
+        weight = REACTION_WEIGHTS.get(reaction)
+        if weight is not None and username:
+            cells[(username, meal_id)] = cells.get((username, meal_id), 0.0) + weight
+    for username, meal_id in MealFavorite.objects.values_list("username", "meal_id").iterator():
+        if username:
+            cells[(username, meal_id)] = cells.get((username, meal_id), 0.0) + FAVORITE_WEIGHT
+
+    usernames = sorted({u for u, _ in cells})
+    meal_ids = sorted({m for _, m in cells})
+    user_index = {u: i for i, u in enumerate(usernames)}
+    meal_index = {m: j for j, m in enumerate(meal_ids)}
+
+    rows = np.fromiter((user_index[u] for u, _ in cells), dtype=np.int32, count=len(cells))
+    cols = np.fromiter((meal_index[m] for _, m in cells), dtype=np.int32, count=len(cells))
+    vals = np.fromiter(cells.values(), dtype=np.float32, count=len(cells))
+    matrix = coo_matrix((vals, (rows, cols)), shape=(len(usernames), len(meal_ids))).tocsr()
+    return matrix, usernames, meal_ids
+
+
+def _score_blocks(matrix, factors: int) -> Iterator[Tuple[int, Any]]:
+    """Yield (row_offset, dense scores block) of the rank-k reconstruction."""
+    import numpy as np
+    from scipy.sparse.linalg import svds
+
+    n_users = matrix.shape[0]
+    k = min(factors, min(matrix.shape) - 1)
+    if k < 1:
+        # Слишком мало данных для разложения — используем исходные оценки
+        for start in range(0, n_users, SCORE_BLOCK_SIZE):
+            yield start, matrix[start:start + SCORE_BLOCK_SIZE].toarray()
+        return
+
+    u, s, vt = svds(matrix.astype(np.float32), k=k)
+    user_factors = (u * s).astype(np.float32)
+    vt = vt.astype(np.float32)
+    for start in range(0, n_users, SCORE_BLOCK_SIZE):
+        yield start, user_factors[start:start + SCORE_BLOCK_SIZE] @ vt
+
+
+def rebuild_user_meal_scores(factors: int = None, top_n: int = None) -> Dict[str, Any]:
+    """Factorize the interaction matrix and store per-user top-N meal scores."""
+    import numpy as np
+
+    factors = factors or settings.RECOMMENDER_FACTORS
+    top_n = top_n or settings.RECOMMENDER_TOP_N
+
+    matrix, usernames, meal_ids = build_interaction_matrix()
+    if not usernames:
+        return {"users": 0, "meals": 0}
+
+    meal_ids_arr = np.asarray(meal_ids, dtype=np.int64)
+    rows: List[UserMealScores] = []
+    for start, block in _score_blocks(matrix, factors):
+        # Явно отвергнутые блюда никогда не попадают в топ
+        disliked = matrix[start:start + block.shape[0]].toarray() < 0
+        block = np.where(disliked, -np.inf, block)
+        n = min(top_n, block.shape[1])
+        top = np.argpartition(-block, n - 1, axis=1)[:, :n]
+        for offset, cols in enumerate(top):
+            cols = cols[np.argsort(-block[offset, cols])]
+            scores = [
+                [int(meal_ids_arr[c]), round(float(block[offset, c]), 4)]
+                for c in cols
+                if np.isfinite(block[offset, c])
+            ]
+            rows.append(UserMealScores(username=usernames[start + offset], scores=scores))
+
+    UserMealScores.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["username"],
+        update_fields=["scores", "updated_at"],
+    )
+    logger.info("Rebuilt meal scores for %d users over %d meals", len(usernames), len(meal_ids))
+    return {"users": len(usernames), "meals": len(meal_ids)}
+
+
+def meal_scores_for(username: str) -> Dict[int, float]:
+    scores = UserMealScores.objects.filter(username=username).values_list("scores", flat=True).first()
+    return {int(meal_id): float(score) for meal_id, score in scores or []}
@@ -0,0 +1,91 @@
+# api/services/speculative.py
+"""Speculative first plan, generated in the background right after intake.
+
+The intake pipeline (targets -> plan -> cache warm-up) runs as a Celery chain;
+every step re-checks that its intake is still the user's latest and quietly
+stops otherwise. The plan is saved with ``speculative=True`` and stays hidden
+until the user's Generate click claims it.
+"""
+import logging
+import os
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from api.models import UserIntake, DailyRationPlan, DailyRationItem
+from api.services import ledger
+from api.services.ration_generator import generate_ration
+
+logger = logging.getLogger(__name__)
+
+
+def is_current(intake: UserIntake) -> bool:
+    latest = UserIntake.objects.filter(username=intake.username).order_by("-created_at").values_list("id", flat=True).first()
+    return latest == intake.pk
+
+
+def current_intake(intake_id: int) -> Optional[UserIntake]:
+    """The intake, or None when it was deleted or superseded by a newer one."""
+    intake = UserIntake.objects.filter(pk=intake_id).first()
+    if intake is None or not is_current(intake):
+        logger.info("Intake %s superseded, skipping speculative step", intake_id)
+        return None
+    return intake
+
+
+def generate(intake_id: int) -> Dict[str, Any]:
+    intake = current_intake(intake_id)
+    if intake is None:
+        return {"cancelled": True}
+    if not os.getenv("OPENAI_API_KEY"):
+        return {"error": "OPENAI_API_KEY is not set"}
+    # Неиспользованные заготовки по старым анкетам больше не нужны
+    DailyRationPlan.objects.filter(username=intake.username, speculative=True).exclude(intake=intake).delete()
+    with ledger.context(username=intake.username):
+        generate_ration(intake.username, intake=intake, speculative=True)
+    return {"intake_id": intake_id}
+
+
+def _pending_qs(username: str, intake_id: Optional[int] = None):
+    qs = DailyRationPlan.objects.filter(username=username, speculative=True)
+    if intake_id is not None:
+        qs = qs.filter(intake_id=intake_id)
+    return qs.order_by("-created_at")
+
+
+def warm(intake_id: int) -> Dict[str, Any]:
+    """Pre-render the plan fragment so the first plan page view is served from cache."""
+    intake = current_intake(intake_id)
+    if intake is None:
+        return {"cancelled": True}
+    plan = _pending_qs(intake.username, intake.pk).first()
+    if plan is None:
+        return {"warmed": False}
+    render_to_string("ration_result.html", {
+        "username": intake.username,
+        "plan": plan,
+        "items": DailyRationItem.objects.filter(plan=plan).select_related("recipe_ref").order_by("position"),
+        "FRAGMENT_CACHE_TIMEOUT": settings.FRAGMENT_CACHE_TIMEOUT,
+    })
+    return {"warmed": True, "plan_id": plan.pk}
+
+
+def _latest_intake_id(username: str):
+    return UserIntake.objects.filter(username=username).order_by("-created_at").values_list("id", flat=True)
+
+
+async def aclaim(username: str) -> Optional[int]:
+    """Publish the speculative plan for the user's latest intake; returns its id, or None if there is none."""
+    intake_id = await _latest_intake_id(username).afirst()
+    if intake_id is None:
+        return None
+    plan_id = await _pending_qs(username, intake_id).values_list("id", flat=True).afirst()
+    if plan_id is None:
+        return None
+    # Условие speculative=True в UPDATE защищает от двойного захвата параллельными кликами
+    claimed = await DailyRationPlan.objects.filter(pk=plan_id, speculative=True).aupdate(
+        speculative=False, created_at=timezone.now()
+    )
+    return plan_id if claimed else None
@@ -0,0 +1,167 @@
+# api/services/targets.py
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+
+from api.models import UserIntake
+from api.services import hot_cache, llm
+
+logger = logging.getLogger(__name__)
+
+
+def _to_float(x):
+    try:
+        return float(str(x).strip().lower().replace('kcal','').replace('g','').strip())
+    except Exception:
+        return 0.0
+
+
+def build_messages(intake: UserIntake) -> List[Dict[str, str]]:
+    prompt = {
+        "task": "Compute realistic daily macro targets based on the user's profile.",
+        "user_profile": {
+            "gender": intake.gender,
+            "age": intake.age,
+            "height_cm": intake.height,
+            "weight_kg": intake.weight,
+            "goal": intake.goal,
+            "activity_level": intake.activity_level,
+            "dietary_restrictions": intake.dietary_restrictions or [],
+            "allergies": intake.allergies or [],
+        },
+        "output_schema": {
+            "protein_g_per_day": "number",
+            "carbohydrates_g_per_day": "number",
+            "fats_g_per_day": "number",
+            "calories_kcal_per_day": "number (optional)",
+        },
+        "requirements": [
+            "Return only valid JSON (no commentary).",
+            "Values should be daily totals, in grams for macros, kcal for calories.",
+            "Use standard equations; adjust for goal and activity.",
+        ]
+    }
+    return [
+        {"role": "system", "content": "You are a nutrition calculator."},
+        {"role": "user", "content": json.dumps(prompt, ensure_ascii=False)},
+    ]
+
+
+def estimate_macros(profile: UserIntake) -> Tuple[float, float, float, float]:
+    # Calories via Mifflin-St Jeor, activity factor + goal adj
+    weight = profile.weight
+    height = profile.height
+    age = profile.age
+    gender = profile.gender
+    if gender == "male":
+        bmr = 10 * weight + 6.25 * height - 5 * age + 5
+    elif gender == "female":
+        bmr = 10 * weight + 6.25 * height - 5 * age - 161
+    else:
+        bmr = 10 * weight + 6.25 * height - 5 * age
+    af = {"low": 1.2, "medium": 1.55, "high": 1.725}.get(profile.activity_level, 1.4)
+    tdee = bmr * af
+    adj = {"lose_weight": -500, "maintain_weight": 0, "gain_weight": 500}.get(profile.goal, 0)
+    calories = max(1200.0, tdee + adj)
+    proteins_g = max(60.0, round(1.6 * weight))
+    fats_g = max(40.0, round(0.8 * weight))
+    remaining_kcal = calories - proteins_g * 4 - fats_g * 9
+    carbs_g = max(0.0, remaining_kcal / 4)
+    return calories, proteins_g, carbs_g, fats_g
+
+
+def local_targets(intake: UserIntake) -> Dict[str, float]:
+    """estimate_macros() in the model's answer format; used while the LLM is unavailable."""
+    calories, proteins, carbs, fats = estimate_macros(intake)
+    return {
+        "protein_g_per_day": proteins,
+        "carbohydrates_g_per_day": round(carbs, 1),
+        "fats_g_per_day": fats,
+        "calories_kcal_per_day": round(calories),
+    }
+
+
+def parse_targets(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Map the model's (loosely named) fields onto UserIntake target columns."""
+    prot = (data.get('protein_g_per_day')
+            or data.get('target_proteins_g') or data.get('proteins_g') or data.get('target_proteins'))
+    carb = (data.get('carbohydrates_g_per_day')
+            or data.get('target_carbohydrates_g') or data.get('carbohydrates_g') or data.get('target_carbohydrates'))
+    fat  = (data.get('fats_g_per_day')
+            or data.get('target_fats_g') or data.get('fats_g') or data.get('target_fats'))
+    cal  = (data.get('calories_kcal_per_day')
+            or data.get('target_calories') or data.get('calories'))
+
+    updates = {
+        "target_proteins": _to_float(prot),
+        "target_carbohydrates": _to_float(carb),
+        "target_fats": _to_float(fat),
+    }
+    if cal is not None:
+        updates["target_calories"] = _to_float(cal)
+    updates["updated_at"] = timezone.now()
+    return updates
+
+
+def _result(intake: UserIntake) -> Dict[str, Any]:
+    return {
+        "saved": True,
+        "targets": {
+            "calories": intake.target_calories,
+            "proteins_g": intake.target_proteins,
+            "carbohydrates_g": intake.target_carbohydrates,
+            "fats_g": intake.target_fats,
+        }
+    }
+
+
+def _latest_intake(username: str):
+    return UserIntake.objects.filter(username=username).order_by('-created_at')
+
+
+def _invalidate(username: str) -> None:
+    hot_cache.invalidate("intake", username)
+    hot_cache.invalidate("targets", username)
+
+
+def compute_targets(username: str, model: Optional[str] = None) -> Dict[str, Any]:
+    intake = _latest_intake(username).first()
+    if not intake:
+        return {"error": "No intake found"}
+
+    try:
+        data = llm.chat_json(build_messages(intake), model=model, temperature=0.2, caller="targets")
+    except llm.LLMUnavailable as e:
+        logger.warning("LLM unavailable (%s), estimating targets for %s locally", e, username)
+        data = local_targets(intake)
+    logger.debug("GPT raw targets for %s: %s", username, data)
+    if "raw" in data:
+        return data
+
+    UserIntake.objects.filter(pk=intake.pk).update(**parse_targets(data))
+    # update() не шлёт post_save
+    _invalidate(username)
+    # Return current values for convenience
+    return _result(UserIntake.objects.get(pk=intake.pk))
+
+
+async def acompute_targets(username: str, model: Optional[str] = None) -> Dict[str, Any]:
+    intake = await _latest_intake(username).afirst()
+    if not intake:
+        return {"error": "No intake found"}
+
+    try:
+        data = await llm.achat_json(build_messages(intake), model=model, temperature=0.2, caller="targets")
+    except llm.LLMUnavailable as e:
+        logger.warning("LLM unavailable (%s), estimating targets for %s locally", e, username)
+        data = local_targets(intake)
+    logger.debug("GPT raw targets for %s: %s", username, data)
+    if "raw" in data:
+        return data
+
+    await UserIntake.objects.filter(pk=intake.pk).aupdate(**parse_targets(data))
+    await sync_to_async(_invalidate)(username)
+    return _result(await UserIntake.objects.aget(pk=intake.pk))
@@ -0,0 +1,204 @@
+# api/services/text_index.py
+"""Hashed TF-IDF index over catalog meal/product names and recipes."""
+import re
+import threading
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+
+from api.models import CatalogVector, Meal, Product
+from api.services import hot_cache
+from api.services.compression import decompress_text
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+NAME_WEIGHT = 2.0
+RECIPE_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.5
+
+# kind -> (version, ids, normalized float32 matrix)
+_loaded: Dict[str, Tuple[Any, Any, Any]] = {}
+_lock = threading.Lock()
+
+
+def _dim() -> int:
+    return settings.TEXT_INDEX_DIM
+
+
+def _features(name: str, recipe: str = "") -> Dict[str, float]:
+    feats: Dict[str, float] = {}
+    name = (name or "").lower()
+    for tok in TOKEN_RE.findall(name):
+        feats["w:" + tok] = feats.get("w:" + tok, 0.0) + NAME_WEIGHT
+    # Символьные триграммы названия устойчивы к опечаткам и словоформам
+    compact = " ".join(TOKEN_RE.findall(name))
+    for i in range(len(compact) - 2):
+        gram = "c:" + compact[i:i + 3]
+        feats[gram] = feats.get(gram, 0.0) + TRIGRAM_WEIGHT
+    for tok in TOKEN_RE.findall((recipe or "").lower()):
+        feats["w:" + tok] = feats.get("w:" + tok, 0.0) + RECIPE_WEIGHT
+    return feats
+
+
+def vectorize(name: str, recipe: str = ""):
+    """Signed feature hashing with sublinear term frequency, float32."""
+    import numpy as np
+
+    dim = _dim()
+    vec = np.zeros(dim, dtype=np.float32)
+    for feat, tf in _features(name, recipe).items():
+        h = zlib.crc32(feat.encode("utf-8"))
+        sign = 1.0 if (h >> 31) & 1 else -1.0
+        vec[h % dim] += sign * (1.0 + np.log(tf))
+    return vec
+
+
+def _source(kind: str, batch_size: int):
+    """Yield (id, name, recipe) for every catalog row of ``kind``."""
+    if kind == CatalogVector.KIND_MEAL:
+        rows = Meal.objects.order_by("id").values_list("id", "name", "recipe_ref__body")
+        for object_id, name, body in rows.iterator(chunk_size=batch_size):
+            yield object_id, name, decompress_text(body) if body else ""
+    elif kind == CatalogVector.KIND_PRODUCT:
+        rows = Product.objects.order_by("id").values_list("id", "name")
+        for object_id, name in rows.iterator(chunk_size=batch_size):
+            yield object_id, name, ""
+    else:
+        raise ValueError(f"Unknown catalog kind: {kind}")
+
+
+def index_object(kind: str, object_id: int, name: str, recipe: str = "") -> None:
+    CatalogVector.objects.update_or_create(
+        kind=kind, object_id=object_id,
+        defaults={"vector": vectorize(name, recipe).tobytes()},
+    )
+
+
+def remove_object(kind: str, object_id: int) -> None:
+    CatalogVector.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def rebuild(kind: str, batch_size: int = 1000) -> int:
+    """Full rebuild for one kind; signals keep it current afterwards.
+
+    Runs in one transaction: searches keep seeing the old index until the new
+    one is committed, and a failed rebuild leaves the old one in place.
+    """
+    batch: List[CatalogVector] = []
+    total = 0
+    with transaction.atomic():
+        CatalogVector.objects.filter(kind=kind).delete()
+        for object_id, name, recipe in _source(kind, batch_size):
+            batch.append(CatalogVector(kind=kind, object_id=object_id, vector=vectorize(name, recipe).tobytes()))
+            if len(batch) >= batch_size:
+                CatalogVector.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            CatalogVector.objects.bulk_create(batch)
+            total += len(batch)
+        hot_cache.invalidate("catalog", kind)
+    return total
+
+
+def _load(kind: str):
+    """Return (ids, matrix) with IDF applied and rows L2-normalized; cached per process."""
+    import numpy as np
+
+    vectors = CatalogVector.objects.filter(kind=kind)
+    version = hot_cache.get_or_set(
+        "catalog", kind, lambda: tuple(vectors.aggregate(n=Count("id"), ts=Max("updated_at")).values())
+    )
+    cached = _loaded.get(kind)
+    if cached and cached[0] == version:
+        return cached[1], cached[2]
+
+    with _lock:
+        rows = list(vectors.order_by("object_id").values_list("object_id", "vector"))
+        dim = _dim()
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        matrix = np.zeros((len(rows), dim), dtype=np.float32)
+        for i, (_, blob) in enumerate(rows):
+            vec = np.frombuffer(bytes(blob), dtype=np.float32)
+            if vec.shape[0] == dim:
+                matrix[i] = vec
+        if len(rows):
+            df = np.count_nonzero(matrix, axis=0)
+            idf = (np.log((1.0 + len(rows)) / (1.0 + df)) + 1.0).astype(np.float32)
+            matrix *= idf
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms == 0, 1.0, norms)
+        _loaded[kind] = (version, ids, matrix)
+    return ids, matrix
+
+
+def similar(kind: str, object_id: int, k: int = 10) -> List[Tuple[int, float]]:
+    """Top-k most similar catalog entries to ``object_id`` by cosine similarity."""
+    import numpy as np
+
+    ids, matrix = _load(kind)
+    pos = np.searchsorted(ids, object_id)
+    if pos >= len(ids) or ids[pos] != object_id:
+        return []
+    sims = matrix @ matrix[pos]
+    sims[pos] = -1.0
+    k = min(k, len(ids) - 1)
+    if k <= 0:
+        return []
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top])]
+    return [(int(ids[i]), float(sims[i])) for i in top]
+
+
+def near_duplicates(kind: str, threshold: Optional[float] = None, block_size: int = 1024) -> List[Tuple[int, int, float]]:
+    """All pairs (a, b, similarity) with a < b and similarity >= threshold."""
+    import numpy as np
+
+    threshold = settings.TEXT_INDEX_DUPLICATE_THRESHOLD if threshold is None else threshold
+    ids, matrix = _load(kind)
+    pairs: List[Tuple[int, int, float]] = []
+    for start in range(0, len(ids), block_size):
+        sims = matrix[start:start + block_size] @ matrix.T
+        rows, cols = np.nonzero(sims >= threshold)
+        for r, c in zip(rows, cols):
+            a = start + r
+            if c > a:
+                pairs.append((int(ids[a]), int(ids[c]), float(sims[r, c])))
+    pairs.sort(key=lambda p: -p[2])
+    return pairs
+
+
+def collapse_near_duplicates(
+    kind: str, ordered_ids: Iterable[int], threshold: Optional[float] = None, limit: Optional[int] = None,
+) -> List[int]:
+    """Keep the first of every near-duplicate group, preserving ``ordered_ids`` order.
+
+    ``ordered_ids`` is consumed lazily and the walk stops after ``limit`` ids are kept.
+    """
+    import numpy as np
+
+    threshold = settings.TEXT_INDEX_DUPLICATE_THRESHOLD if threshold is None else threshold
+    ids, matrix = _load(kind)
+    kept: List[int] = []
+    if limit is not None and limit <= 0:
+        return kept
+    # Векторы оставленных строк копятся в заранее выделенной матрице, растущей удвоением
+    kept_matrix = np.empty((min(limit or 64, 1024), matrix.shape[1]), dtype=matrix.dtype)
+    n = 0
+    for object_id in ordered_ids:
+        p = int(np.searchsorted(ids, object_id)) if len(ids) else 0
+        if p < len(ids) and ids[p] == object_id:
+            vec = matrix[p]
+            if n and float((kept_matrix[:n] @ vec).max()) >= threshold:
+                continue
+            if n == len(kept_matrix):
+                kept_matrix = np.concatenate([kept_matrix, np.empty_like(kept_matrix)])
+            kept_matrix[n] = vec
+            n += 1
+        kept.append(object_id)
+        if limit is not None and len(kept) >= limit:
+            break
+    return kept
@@ -0,0 +1,124 @@
+# api/services/weekly_planner.py
+"""Multi-day planning: one streamed LLM pass produces every day of the week.
+
+The model answers in JSON Lines, one day per line, so each day is saved as a
+DailyRationPlan as soon as its line arrives instead of after the whole week.
+If the provider becomes unavailable, or the stream ends short of the requested
+days, the remaining days are planned locally.
+"""
+import json
+import logging
+from collections import Counter
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+from django.utils import timezone
+
+from api.models import DailyRationPlan, WeeklyRationPlan
+from api.services import llm, local_planner, prompts
+from api.services.catalog import load_catalog
+from api.services.ration_generator import load_intake, profile_from_intake, save_plan
+
+logger = logging.getLogger(__name__)
+
+
+def build_messages(profile: Dict[str, Any], catalog: Dict[str, Any], days: int) -> List[Dict[str, str]]:
+    return prompts.weekly_ration(profile, catalog, days)
+
+
+def parse_day(line: str) -> Optional[Dict[str, Any]]:
+    line = line.strip().strip("`").strip()
+    if line.startswith("json"):
+        line = line[4:].strip()
+    if not line.startswith("{"):
+        return None
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        logger.warning("Skipping malformed weekly plan line: %.200s", line)
+        return None
+    return data if isinstance(data.get("daily_ration"), list) else None
+
+
+def variety_issues(days: List[Dict[str, Any]]) -> List[str]:
+    """Check the variety constraints locally; the LLM is asked to follow them but not trusted to."""
+    issues = []
+    names = [[str(it.get("name", "")).strip().lower() for it in d.get("daily_ration", [])] for d in days]
+    for i in range(1, len(names)):
+        for name in sorted(set(names[i]) & set(names[i - 1])):
+            issues.append(f"'{name}' on consecutive days {i} and {i + 1}")
+    counts = Counter(n for day in names for n in set(day))
+    for name, count in sorted(counts.items()):
+        if count > prompts.WEEKLY_MAX_REPEATS:
+            issues.append(f"'{name}' appears on {count} days")
+    return issues
+
+
+class _WeekWriter:
+    """Persists days as they stream in and finalizes the week."""
+
+    def __init__(self, username: str, model: str, days: int, start: date):
+        self.week = WeeklyRationPlan.objects.create(username=username, model=model, start_date=start, days=days)
+        self.saved: List[Dict[str, Any]] = []
+
+    @property
+    def remaining(self) -> int:
+        return self.week.days - len(self.saved)
+
+    def add(self, day: Dict[str, Any], model: Optional[str] = None) -> Optional[DailyRationPlan]:
+        index = len(self.saved)
+        if index >= self.week.days:
+            return None
+        self.saved.append(day)
+        return save_plan(
+            self.week.username,
+            model or self.week.model,
+            day,
+            week=self.week,
+            day_index=index,
+            plan_date=self.week.start_date + timedelta(days=index),
+        )
+
+    def finish(self) -> Dict[str, Any]:
+        self.week.variety_issues = variety_issues(self.saved)
+        self.week.completed_at = timezone.now()
+        self.week.save(update_fields=["variety_issues", "completed_at"])
+        if self.week.variety_issues:
+            logger.warning("Weekly plan %s variety issues: %s", self.week.pk, self.week.variety_issues)
+        return {
+            "week_id": self.week.pk,
+            "days_saved": len(self.saved),
+            "variety_issues": self.week.variety_issues,
+        }
+
+
+def _local_exclusions(saved: List[Dict[str, Any]]) -> List[str]:
+    """Names that would break the variety rules if used on the next day."""
+    names = [[str(it.get("name", "")).strip().lower() for it in d.get("daily_ration", [])] for d in saved]
+    counts = Counter(n for day in names for n in set(day))
+    return (names[-1] if names else []) + [n for n, c in counts.items() if c >= prompts.WEEKLY_MAX_REPEATS]
+
+
+def _finish_locally(writer: _WeekWriter, intake, catalog: Dict[str, Any]) -> None:
+    while writer.remaining > 0:
+        writer.add(local_planner.daily_ration(intake, catalog, exclude=_local_exclusions(writer.saved)), model=local_planner.MODEL)
+
+
+def generate_week(username: str, model: str = None, days: int = 7, start: Optional[date] = None) -> Dict[str, Any]:
+    intake = load_intake(username)
+    catalog = load_catalog(username)
+    model = model or llm.DEFAULT_MODEL
+    writer = _WeekWriter(username, model, days, start or timezone.localdate())
+    messages = build_messages(profile_from_intake(intake), catalog, days)
+    try:
+        for line in llm.stream_lines(messages, model=model, temperature=0.7, caller="weekly"):
+            day = parse_day(line)
+            if day is not None:
+                writer.add(day)
+    except llm.LLMUnavailable as e:
+        logger.warning("LLM unavailable (%s) while planning the week for %s", e, username)
+    if writer.remaining > 0:
+        # Поток мог оборваться, а мог закончиться раньше времени или с неразобранными строками
+        logger.warning("Planning %d remaining days for %s locally", writer.remaining, username)
+        _finish_locally(writer, intake, catalog)
+    return writer.finish()
@@ -0,0 +1,84 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (
+	Meal, Product, CatalogVector, UserIntake, PopularityCounter,
+	MealReaction, ProductReaction, MealFavorite, ProductFavorite,
+)
+from .services import hot_cache, popularity, text_index
+
+POPULARITY_KINDS = {
+	MealReaction: (PopularityCounter.KIND_MEAL, 'meal_id'),
+	ProductReaction: (PopularityCounter.KIND_PRODUCT, 'product_id'),
+	MealFavorite: (PopularityCounter.KIND_MEAL, 'meal_id'),
+	ProductFavorite: (PopularityCounter.KIND_PRODUCT, 'product_id'),
+}
+
+
+@receiver(post_save, sender=Meal)
+def index_meal(sender, instance, **kwargs):
+	text_index.index_object(CatalogVector.KIND_MEAL, instance.pk, instance.name, instance.recipe)
+	hot_cache.invalidate('catalog', CatalogVector.KIND_MEAL)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+	text_index.index_object(CatalogVector.KIND_PRODUCT, instance.pk, instance.name)
+	hot_cache.invalidate('catalog', CatalogVector.KIND_PRODUCT)
+
+
+@receiver(post_delete, sender=Meal)
+def unindex_meal(sender, instance, **kwargs):
+	text_index.remove_object(CatalogVector.KIND_MEAL, instance.pk)
+	hot_cache.invalidate('catalog', CatalogVector.KIND_MEAL)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+	text_index.remove_object(CatalogVector.KIND_PRODUCT, instance.pk)
+	hot_cache.invalidate('catalog', CatalogVector.KIND_PRODUCT)
+
+
+@receiver([post_save, post_delete], sender=UserIntake)
+def invalidate_intake(sender, instance, **kwargs):
+	# Последняя анкета и цели пользователя кэшируются в hot_cache
+	hot_cache.invalidate('intake', instance.username)
+	hot_cache.invalidate('targets', instance.username)
+
+
+@receiver(post_init, sender=MealReaction)
+@receiver(post_init, sender=ProductReaction)
+def remember_reaction(sender, instance, **kwargs):
+	# Для дельты счётчиков нужно прежнее значение (update_or_create меняет реакцию на месте)
+	instance._loaded_reaction = instance.reaction if instance.pk else None
+
+
+@receiver(post_save, sender=MealReaction)
+@receiver(post_save, sender=ProductReaction)
+def count_reaction(sender, instance, created, **kwargs):
+	kind, fk = POPULARITY_KINDS[sender]
+	old = None if created else instance._loaded_reaction
+	popularity.record_reaction(kind, getattr(instance, fk), old, instance.reaction)
+	instance._loaded_reaction = instance.reaction
+
+
+@receiver(post_delete, sender=MealReaction)
+@receiver(post_delete, sender=ProductReaction)
+def uncount_reaction(sender, instance, **kwargs):
+	kind, fk = POPULARITY_KINDS[sender]
+	popularity.record_reaction(kind, getattr(instance, fk), instance._loaded_reaction, None)
+
+
+@receiver(post_save, sender=MealFavorite)
+@receiver(post_save, sender=ProductFavorite)
+def count_favorite(sender, instance, created, **kwargs):
+	if created:
+		kind, fk = POPULARITY_KINDS[sender]
+		popularity.record(kind, getattr(instance, fk), favorites=1)
+
+
+@receiver(post_delete, sender=MealFavorite)
+@receiver(post_delete, sender=ProductFavorite)
+def uncount_favorite(sender, instance, **kwargs):
+	kind, fk = POPULARITY_KINDS[sender]
+	popularity.record(kind, getattr(instance, fk), favorites=-1)
@@ -0,0 +1,36 @@
+from functools import lru_cache
+
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+@lru_cache(maxsize=None)
+def _bundle_built(path: str) -> bool:
+    return bool(finders.find(path)) or staticfiles_storage.exists(path)
+
+
+def _bundle_files(name: str):
+    path = f"{settings.ASSET_BUNDLE_PREFIX}/{name}"
+    # Без build_assets (например, при локальной разработке) отдаём исходные файлы
+    return [path] if _bundle_built(path) else settings.ASSET_BUNDLES[name]
+
+
+@register.simple_tag
+def asset_bundle(name: str):
+    """<link>/<script> tags for a bundle from ASSET_BUNDLES, e.g. {% asset_bundle 'app.css' %}."""
+    files = _bundle_files(name)
+    if name.endswith(".css"):
+        return format_html_join("\n", '<link rel="stylesheet" href="{}">', ((static(f),) for f in files))
+    return format_html_join("\n", '<script src="{}"></script>', ((static(f),) for f in files))
+
+
+@register.simple_tag
+def asset_bundle_preload(name: str):
+    kind = "style" if name.endswith(".css") else "script"
+    return format_html('<link rel="preload" href="{}" as="{}">', static(_bundle_files(name)[0]), kind)
@@ -1,3 +1,760 @@
-from django.test import TestCase
+import json
+import os
+import re
+import subprocess
+import sys
 
-# Create your tests here.
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+# Суммарное время импорта при django.setup(), мс; переопределяется для медленных CI-машин
+IMPORT_TIME_BUDGET_MS = int(os.getenv("IMPORT_TIME_BUDGET_MS", 1000))
+# Грузятся только при первом вызове LLM или расчёте (llm.get_client, portions, text_index)
+LAZY_MODULES = ("openai", "httpx", "pydantic", "numpy")
+
+# Тесты не ходят в Redis: hot_cache без django-redis работает только с локальным уровнем
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+def _importtime(code: str):
+	"""Run ``code`` in a fresh interpreter under ``-X importtime``; returns {module: cumulative_us} and the self-time total."""
+	env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "app.settings")}
+	result = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", code],
+		cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=120,
+	)
+	if result.returncode:
+		raise AssertionError(result.stderr[-2000:])
+	modules, total = {}, 0
+	for line in result.stderr.splitlines():
+		match = _IMPORTTIME.match(line)
+		if match:
+			self_us, cumulative_us, _, name = match.groups()
+			modules[name] = int(cumulative_us)
+			total += int(self_us)
+	return modules, total
+
+
+class StartupImportTests(SimpleTestCase):
+	def test_django_setup_within_budget(self):
+		modules, total = _importtime("import django; django.setup()")
+		slowest = sorted(modules.items(), key=lambda m: -m[1])[:10]
+		self.assertLessEqual(
+			total / 1000, IMPORT_TIME_BUDGET_MS,
+			"django.setup() imports take too long; slowest (cumulative us): %s" % slowest,
+		)
+
+	def test_llm_stack_not_imported_at_startup(self):
+		# То, что воркер импортирует до первого запроса: настройка, URLconf со всеми view, задачи Celery
+		modules, _ = _importtime("import django; django.setup(); import app.urls, api.tasks")
+		loaded = [name for name in LAZY_MODULES if name in modules]
+		self.assertEqual(loaded, [], "heavy modules imported at startup")
+
+
+class CascadeCheckTests(SimpleTestCase):
+	def _item(self, name, recipe="", p=30, c=60, f=15):
+		return {"name": name, "recipe": recipe, "proteins_g": p, "carbohydrates_g": c, "fats_g": f, "fiber_g": 3}
+
+	def test_allergens_match_whole_words(self):
+		from api.services import cascade
+
+		items = [self._item("Grilled eggplant"), self._item("Coconut rice"), self._item("Boiled eggs")]
+		self.assertEqual(cascade.check_allergens(items, ["egg", "nut"]), ["'Boiled eggs' contains egg"])
+
+	def test_count_rejects_non_objects(self):
+		from api.services import cascade
+
+		self.assertEqual(cascade.check_count(["a", "b", "c", "d", "e"], 5), ["items must be JSON objects"])
+		self.assertEqual(cascade.check_count(None, 5), ["items missing"])
+
+	def test_ration_validated_after_portion_scaling(self):
+		from api.models import UserIntake
+		from api.services.ration_generator import validate_ration
+
+		intake = UserIntake(
+			username="u", allergies=[], target_proteins=150, target_carbohydrates=300, target_fats=75, target_calories=2475,
+		)
+		# Вдвое меньше целей: масштабирование порций (до PORTION_MAX = 2) доводит до них
+		half = {"daily_ration": [self._item(f"meal {i}", p=15, c=30, f=7.5) for i in range(5)]}
+		self.assertEqual(validate_ration(half, intake), [])
+		tiny = {"daily_ration": [self._item(f"meal {i}", p=3, c=6, f=1.5) for i in range(5)]}
+		self.assertTrue(validate_ration(tiny, intake))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PlanArchiveTests(TestCase):
+	def _plan(self, days_ago, **fields):
+		from api.models import DailyRationItem, DailyRationPlan, Meal
+
+		plan = DailyRationPlan.objects.create(username="ann", model="m", **fields)
+		plan.store_response({"daily_ration": []})
+		meal = Meal.objects.create(name="Oats", calories=300, proteins=10, carbohydrates=50, fats=5, weight=200, type="breakfast")
+		DailyRationItem.objects.create(
+			plan=plan, position=1, name="Oats", meal=meal, proteins=15, carbohydrates=75, fats=7.5, fiber=4,
+			portion=1.5, weight=300, eaten=True,
+		)
+		DailyRationPlan.objects.filter(pk=plan.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+		return plan, meal
+
+	def test_archive_keeps_catalog_links_and_drops_speculative_plans(self):
+		from api.models import DailyRationPlan, DailyRationPlanArchive, DailyRationResponse
+		from api.services import plan_history
+
+		plan, meal = self._plan(40)
+		speculative, _ = self._plan(40, speculative=True)
+		recent, _ = self._plan(1)
+		self.assertEqual(plan_history.archive_chunk(timezone.now() - timedelta(days=30), 100), 2)
+
+		self.assertEqual(list(DailyRationPlan.objects.values_list("id", flat=True)), [recent.pk])
+		self.assertEqual(list(DailyRationPlanArchive.objects.values_list("plan_id", flat=True)), [plan.pk])
+		item = DailyRationPlanArchive.objects.get().items[0]
+		self.assertEqual(
+			{k: item[k] for k in ("meal_id", "product_id", "portion", "weight", "eaten")},
+			{"meal_id": meal.pk, "product_id": None, "portion": 1.5, "weight": 300, "eaten": True},
+		)
+		# Сырой ответ LLM намеренно не архивируется
+		self.assertEqual(list(DailyRationResponse.objects.values_list("plan_id", flat=True)), [recent.pk])
+
+
+class PortionSolverTests(SimpleTestCase):
+	def _items(self, *macros):
+		from api.models import DailyRationItem
+
+		return [
+			DailyRationItem(position=i, name=f"item {i}", proteins=p, carbohydrates=c, fats=f, fiber=1)
+			for i, (p, c, f) in enumerate(macros, start=1)
+		]
+
+	def test_solve_clips_to_bounds(self):
+		import numpy as np
+		from api.services.portions import solve
+
+		# Независимые строки: оптимум по каждой координате — t_i, обрезанный границами
+		x = solve(np.eye(3), np.array([1.5, 3.0, 0.1]), np.full(3, 0.5), np.full(3, 2.0))
+		np.testing.assert_allclose(x, [1.5, 2.0, 0.5], atol=1e-9)
+
+	def test_solve_matches_least_squares_inside_bounds(self):
+		import numpy as np
+		from api.services.portions import solve
+
+		A = np.array([[20.0, 5.0, 10.0], [30.0, 60.0, 10.0], [5.0, 10.0, 20.0]])
+		t = np.array([50.0, 120.0, 40.0])
+		x = solve(A, t, np.zeros(3), np.full(3, 10.0))
+		np.testing.assert_allclose(x, np.linalg.solve(A, t), rtol=1e-6)
+
+	def test_zero_or_missing_targets_leave_portions(self):
+		from api.services import portions
+
+		items = self._items((20, 40, 10), (30, 50, 10))
+		self.assertEqual(portions.factors(items, {"proteins": 0, "fats": None}), [1.0, 1.0])
+		self.assertIs(portions.fit(items, {}), items)
+		self.assertEqual([it.proteins for it in items], [20, 30])
+
+	def test_items_with_missing_macros_keep_their_portion(self):
+		from api.services import portions
+
+		items = self._items((None, None, None), ("n/a", 0, 0), (25, 50, 10))
+		factors = portions.factors(items, {"proteins": 50, "carbohydrates": 100, "fats": 20})
+		self.assertEqual(factors, [1.0, 1.0, 2.0])
+		self.assertEqual(portions.fitted_totals(items, {"proteins": 50}), {"proteins": 50.0, "carbohydrates": 100.0, "fats": 20.0})
+
+	def test_locked_positions_are_not_scaled(self):
+		from api.services import portions
+
+		items = self._items((20, 40, 10), (20, 40, 10))
+		self.assertEqual(portions.factors(items, {"proteins": 60}, locked=[1]), [1.0, 2.0])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TextIndexTests(TestCase):
+	def setUp(self):
+		from django.contrib.auth.models import User
+		from api.models import Meal
+
+		self.user = User.objects.create_user("ann", password="pw")
+		self.meals = [
+			Meal.objects.create(name=name, calories=400, proteins=20, carbohydrates=40, fats=10, weight=250, type="lunch")
+			for name in ("Chicken rice bowl", "Chicken rice salad", "Chocolate cake")
+		]
+
+	def test_similar_rejects_bad_k(self):
+		self.client.force_login(self.user)
+		for k in ("abc", "0", "-3"):
+			response = self.client.get(f"/meals/{self.meals[0].pk}/similar/", {"k": k})
+			self.assertEqual(response.status_code, 400, k)
+
+	def test_failed_rebuild_keeps_the_old_index(self):
+		from unittest import mock
+		from api.models import CatalogVector
+		from api.services import text_index
+
+		self.assertEqual(text_index.rebuild(CatalogVector.KIND_MEAL), 3)
+		with mock.patch.object(text_index, "vectorize", side_effect=RuntimeError("boom")):
+			with self.assertRaises(RuntimeError):
+				text_index.rebuild(CatalogVector.KIND_MEAL)
+		self.assertEqual(CatalogVector.objects.filter(kind=CatalogVector.KIND_MEAL).count(), 3)
+
+
+# Манифест хэшированных имён появляется только после collectstatic
+@override_settings(
+	CACHES=LOCMEM_CACHES,
+	STORAGES={**settings.STORAGES, "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"}},
+)
+class PageTemplateTests(TestCase):
+	def test_pages_use_base_template_bundles(self):
+		# Без build_assets тег asset_bundle отдаёт исходные файлы бандла
+		response = self.client.get("/login/")
+		self.assertTemplateUsed(response, "base.html")
+		self.assertContains(response, "/static/css/styles.css")
+		self.assertContains(response, "/static/css/intake.css")
+		self.assertContains(response, "/static/images/favicon.svg")
+
+
+def _meal(name="Oats", **fields):
+	from api.models import Meal
+
+	values = {"calories": 300, "proteins": 10, "carbohydrates": 50, "fats": 5, "weight": 200, "type": "breakfast"}
+	values.update(fields)
+	return Meal.objects.create(name=name, **values)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MealFeedbackTests(TestCase):
+	def setUp(self):
+		from django.contrib.auth.models import User
+
+		self.client.force_login(User.objects.create_user("ann", password="pw"))
+		self.oats, self.soup = _meal("Oats"), _meal("Soup")
+
+	def _post(self, payload):
+		with self.captureOnCommitCallbacks(execute=True):
+			return self.client.post("/meals/feedback/", json.dumps(payload), content_type="application/json")
+
+	def test_batch_upserts_reactions_and_recounts(self):
+		from api.models import MealFavorite, MealReaction, PopularityCounter
+
+		response = self._post({
+			"reactions": [{"meal": self.oats.pk, "reaction": "like"}, {"meal": self.soup.pk, "reaction": "like"}],
+			"favorites": [self.oats.pk],
+		})
+		self.assertEqual(response.json(), {"ok": True, "reactions": 2, "favorites": 1})
+		# Повторная партия меняет реакцию на месте; последняя реакция на блюдо выигрывает
+		self._post({"reactions": [{"meal": self.soup.pk, "reaction": "like"}, {"meal": self.soup.pk, "reaction": "dislike"}]})
+
+		self.assertEqual(
+			dict(MealReaction.objects.filter(username="ann").values_list("meal_id", "reaction")),
+			{self.oats.pk: "like", self.soup.pk: "dislike"},
+		)
+		self.assertEqual(MealFavorite.objects.filter(username="ann").count(), 1)
+		counters = {c.object_id: c for c in PopularityCounter.objects.filter(kind=PopularityCounter.KIND_MEAL)}
+		self.assertEqual((counters[self.oats.pk].likes, counters[self.oats.pk].favorites, counters[self.oats.pk].score), (1, 1, 2))
+		self.assertEqual((counters[self.soup.pk].dislikes, counters[self.soup.pk].score), (1, -1))
+
+	def test_bad_batches_are_rejected(self):
+		from api.models import MealReaction
+
+		response = self._post({"reactions": [{"meal": self.oats.pk, "reaction": "meh"}]})
+		self.assertEqual(response.status_code, 400)
+		response = self._post({"reactions": [{"meal": self.oats.pk, "reaction": "like"}], "favorites": [999999]})
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(response.json()["meals"], [999999])
+		self.assertFalse(MealReaction.objects.exists())
+
+
+class _FakeRedis:
+	"""The few Redis commands popularity and hot_cache use, kept in dicts."""
+
+	def __init__(self):
+		self.data = {}
+		self.published = []
+
+	def pipeline(self):
+		return self
+
+	def execute(self):
+		return []
+
+	def hincrby(self, key, field, n):
+		h = self.data.setdefault(key, {})
+		h[field] = h.get(field, 0) + n
+
+	def hgetall(self, key):
+		return {f.encode(): str(n).encode() for f, n in self.data.get(key, {}).items()}
+
+	def sadd(self, key, *members):
+		self.data.setdefault(key, set()).update(members)
+
+	def smembers(self, key):
+		return {m.encode() for m in self.data.get(key, set())}
+
+	def rename(self, key, new):
+		if key not in self.data:
+			raise Exception("ERR no such key")
+		self.data[new] = self.data.pop(key)
+
+	def delete(self, key):
+		self.data.pop(key, None)
+
+	def publish(self, channel, message):
+		self.published.append((channel, message))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PopularityTests(TestCase):
+	def setUp(self):
+		self.oats, self.soup = _meal("Oats"), _meal("Soup")
+
+	def _counter(self, meal):
+		from api.models import PopularityCounter
+
+		c = PopularityCounter.objects.get(kind=PopularityCounter.KIND_MEAL, object_id=meal.pk)
+		return c.likes, c.dislikes, c.favorites, c.score
+
+	def test_reaction_changes_apply_deltas(self):
+		from api.models import MealFavorite, MealReaction
+
+		# Без Redis дельты применяются сразу после коммита
+		with self.captureOnCommitCallbacks(execute=True):
+			reaction = MealReaction.objects.create(meal=self.oats, username="ann", reaction="like")
+			MealFavorite.objects.create(meal=self.oats, username="ann")
+		self.assertEqual(self._counter(self.oats), (1, 0, 1, 2))
+		with self.captureOnCommitCallbacks(execute=True):
+			reaction = MealReaction.objects.get(pk=reaction.pk)
+			reaction.reaction = "dislike"
+			reaction.save()
+		self.assertEqual(self._counter(self.oats), (0, 1, 1, 0))
+		with self.captureOnCommitCallbacks(execute=True):
+			reaction.delete()
+		self.assertEqual(self._counter(self.oats), (0, 0, 1, 1))
+
+	def test_flush_moves_pending_deltas_and_recounts_dirty_items(self):
+		from unittest import mock
+		from api.models import MealReaction, PopularityCounter
+		from api.services import popularity
+
+		redis = _FakeRedis()
+		with mock.patch.object(popularity, "redis_connection", return_value=redis):
+			with self.captureOnCommitCallbacks(execute=True):
+				MealReaction.objects.create(meal=self.oats, username="ann", reaction="like")
+				MealReaction.objects.create(meal=self.oats, username="bob", reaction="like")
+				# Как в meal_feedback: строки без сигналов, затем отметка на пересчёт
+				MealReaction.objects.bulk_create([MealReaction(meal=self.soup, username="ann", reaction="dislike")])
+				popularity.mark_dirty(PopularityCounter.KIND_MEAL, [self.soup.pk])
+			self.assertFalse(PopularityCounter.objects.exists())
+			self.assertEqual(popularity.flush(), {"deltas": 1, "recounted": 1})
+			# Ключи забраны: повторный flush ничего не делает
+			self.assertEqual(popularity.flush(), {"deltas": 0, "recounted": 0})
+		self.assertEqual(self._counter(self.oats), (2, 0, 0, 2))
+		self.assertEqual(self._counter(self.soup), (0, 1, 0, -1))
+		self.assertEqual(popularity.scores(PopularityCounter.KIND_MEAL, [self.oats.pk, self.soup.pk]), {self.oats.pk: 2, self.soup.pk: -1})
+
+	def test_reconcile_fixes_drift_and_drops_deleted_items(self):
+		from api.models import MealReaction, PopularityCounter
+		from api.services import popularity
+
+		MealReaction.objects.bulk_create([MealReaction(meal=self.oats, username="ann", reaction="like")])
+		PopularityCounter.objects.create(kind=PopularityCounter.KIND_MEAL, object_id=self.soup.pk, likes=5, score=5)
+		PopularityCounter.objects.create(kind=PopularityCounter.KIND_MEAL, object_id=999999, likes=1, score=1)
+		result = popularity.reconcile()
+		self.assertEqual(result[f"{PopularityCounter.KIND_MEAL}_deleted"], 1)
+		self.assertEqual(self._counter(self.oats), (1, 0, 0, 1))
+		self.assertEqual(self._counter(self.soup), (0, 0, 0, 0))
+		self.assertEqual(popularity.top(PopularityCounter.KIND_MEAL), [self.oats.pk])
+
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogRankingTests(TestCase):
+	def setUp(self):
+		from django.contrib.auth.models import User
+		from api.models import PopularityCounter, UserMealScores
+
+		user = User.objects.create_user("ann", password="x")
+		self.oats, self.soup, self.stew, self.salad = _meal("Oats"), _meal("Soup"), _meal("Stew"), _meal("Salad")
+		self.own_soup = _meal("soup", user=user)
+		for meal, score in ((self.soup, 9), (self.stew, 3), (self.salad, -2)):
+			PopularityCounter.objects.create(kind=PopularityCounter.KIND_MEAL, object_id=meal.pk, score=score)
+		UserMealScores.objects.create(username="ann", scores=[[self.oats.pk, 0.9], [self.stew.pk, -0.5]])
+
+	def _names(self, username=None, max_meals=10):
+		from api.services.catalog import load_catalog
+
+		return [(m["id"], m["name"]) for m in load_catalog(username, max_meals=max_meals)["meals"]]
+
+	def test_popularity_orders_anonymous_catalog(self):
+		self.assertEqual(
+			[pk for pk, _ in self._names()], [self.soup.pk, self.stew.pk, self.oats.pk, self.salad.pk],
+		)
+
+	def test_personal_scores_and_overlay(self):
+		# Личный суп скрывает глобальный, оценка модели поднимает овсянку и опускает рагу
+		self.assertEqual(
+			[pk for pk, _ in self._names("ann")], [self.oats.pk, self.own_soup.pk, self.salad.pk, self.stew.pk],
+		)
+
+	def test_walk_stops_at_limit(self):
+		from unittest import mock
+		from api.services import catalog
+
+		walked = []
+		ranked = catalog.iter_ranked_meals
+
+		def spy(username=None):
+			for row in ranked(username):
+				walked.append(row["id"])
+				yield row
+
+		with mock.patch.object(catalog, "iter_ranked_meals", spy):
+			self.assertEqual([pk for pk, _ in self._names(max_meals=2)], [self.soup.pk, self.stew.pk])
+		self.assertEqual(walked, [self.soup.pk, self.stew.pk])
+
+class ReplicaRouterTests(SimpleTestCase):
+	def setUp(self):
+		from unittest import mock
+		from app import db
+
+		patcher = mock.patch.object(db, "replica_configured", return_value=True)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		db.reset_write_pin()
+		self.addCleanup(db.reset_write_pin)
+		self.router = db.ReplicaRouter()
+
+	def test_reads_use_replica_only_inside_use_replica(self):
+		from api.models import Meal
+		from app.db import REPLICA, use_primary, use_replica
+
+		self.assertIsNone(self.router.db_for_read(Meal))
+		with use_replica():
+			self.assertEqual(self.router.db_for_read(Meal), REPLICA)
+			with use_primary():
+				self.assertIsNone(self.router.db_for_read(Meal))
+
+	def test_write_sticks_reads_to_primary_until_reset(self):
+		from api.models import Meal
+		from app.db import REPLICA, reset_write_pin, use_replica
+
+		with use_replica():
+			self.assertEqual(self.router.db_for_write(Meal), "default")
+			self.assertIsNone(self.router.db_for_read(Meal))
+			reset_write_pin()
+			self.assertEqual(self.router.db_for_read(Meal), REPLICA)
+
+	def test_middleware_pins_reads_after_a_write(self):
+		import time
+		from django.http import HttpResponse
+		from django.test import RequestFactory
+		from api.models import Meal
+		from app.db import PIN_COOKIE, REPLICA, ReplicaStickinessMiddleware, use_replica
+
+		seen = []
+
+		def view(request):
+			with use_replica():
+				seen.append(self.router.db_for_read(Meal))
+				if request.method == "POST":
+					self.router.db_for_write(Meal)
+			return HttpResponse()
+
+		middleware = ReplicaStickinessMiddleware(view)
+		factory = RequestFactory()
+		self.assertNotIn(PIN_COOKIE, middleware(factory.get("/")).cookies)
+		response = middleware(factory.post("/"))
+		pin = response.cookies[PIN_COOKIE].value
+		self.assertGreater(float(pin), time.time())
+
+		pinned = factory.get("/")
+		pinned.COOKIES[PIN_COOKIE] = pin
+		middleware(pinned)
+		expired = factory.get("/")
+		expired.COOKIES[PIN_COOKIE] = str(time.time() - 1)
+		middleware(expired)
+		garbage = factory.get("/")
+		garbage.COOKIES[PIN_COOKIE] = "abc"
+		middleware(garbage)
+		self.assertEqual(seen, [REPLICA, REPLICA, None, REPLICA, REPLICA])
+
+
+class RecipeStoreMigrationTests(TransactionTestCase):
+	migrate_from = [("api", "0006_recipe")]
+	migrate_to = [("api", "0007_move_recipes_to_store")]
+
+	def _migrate(self, targets):
+		from django.db import connection
+		from django.db.migrations.executor import MigrationExecutor
+
+		executor = MigrationExecutor(connection)
+		executor.loader.build_graph()
+		executor.migrate(targets)
+		return executor.loader.project_state(targets).apps
+
+	def tearDown(self):
+		from django.db import connection
+		from django.db.migrations.executor import MigrationExecutor
+
+		executor = MigrationExecutor(connection)
+		self._migrate(executor.loader.graph.leaf_nodes("api"))
+
+	def test_recipes_are_interned_and_restored(self):
+		import zlib
+
+		apps = self._migrate(self.migrate_from)
+		Meal = apps.get_model("api", "Meal")
+		fields = {"calories": 1, "proteins": 1, "carbohydrates": 1, "fats": 1, "weight": 1, "type": "lunch"}
+		# Больше строк, чем CHUNK_SIZE, и повторяющиеся тексты
+		Meal.objects.bulk_create(
+			[Meal(name=f"meal {i}", recipe=f"recipe {i % 300}", **fields) for i in range(1200)]
+			+ [Meal(name="no recipe", recipe="", **fields)]
+		)
+
+		apps = self._migrate(self.migrate_to)
+		Meal, Recipe = apps.get_model("api", "Meal"), apps.get_model("api", "Recipe")
+		self.assertEqual(Recipe.objects.count(), 300)
+		self.assertEqual(list(Meal.objects.filter(recipe_ref__isnull=True).values_list("name", flat=True)), ["no recipe"])
+		meal = Meal.objects.select_related("recipe_ref").get(name="meal 901")
+		self.assertEqual(zlib.decompress(bytes(meal.recipe_ref.body)).decode(), "recipe 1")
+
+		apps = self._migrate(self.migrate_from)
+		Meal = apps.get_model("api", "Meal")
+		self.assertEqual(Meal.objects.filter(recipe="recipe 1").count(), 4)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, EXPORT_CHUNK_SIZE=2)
+class ExportTests(TestCase):
+	def setUp(self):
+		from api.models import DailyRationItem, DailyRationPlan, DailyRationPlanArchive
+
+		now = timezone.now()
+		DailyRationPlanArchive.objects.create(
+			plan_id=1000, username="ann", model="old", created_at=now - timedelta(days=90),
+			items=[{"position": 1, "name": "Porridge", "proteins": 9, "meal_id": None, "eaten": True}],
+		)
+		self.plan = DailyRationPlan.objects.create(username="ann", model="m")
+		DailyRationItem.objects.bulk_create([
+			DailyRationItem(plan=self.plan, position=p, name=n, proteins=10, carbohydrates=20, fats=5, fiber=1)
+			for p, n in ((2, "Soup, hot"), (1, "Oats"))
+		])
+		self.empty = DailyRationPlan.objects.create(username="ann", model="m")
+		DailyRationPlan.objects.create(username="bob", model="m")
+
+	def test_parse_range_is_inclusive_and_validated(self):
+		from api.services import export
+
+		since, until = export.parse_range("2026-01-01", "2026-01-31")
+		self.assertEqual(until - since, timedelta(days=31))
+		self.assertEqual(export.parse_range(None, ""), (None, None))
+		with self.assertRaisesMessage(ValueError, "until must be a date"):
+			export.parse_range(None, "31/01/2026")
+
+	def test_plans_csv_has_a_row_per_item(self):
+		import csv
+		import io
+		from api.services import export
+
+		rows = list(csv.DictReader(io.StringIO("".join(export.render("plans", "csv", username="ann")))))
+		self.assertEqual(
+			[(r["plan_id"], r["archived"], r["position"], r["name"]) for r in rows],
+			[
+				("1000", "True", "1", "Porridge"),
+				(str(self.plan.pk), "False", "1", "Oats"),
+				(str(self.plan.pk), "False", "2", "Soup, hot"),
+				(str(self.empty.pk), "False", "", ""),
+			],
+		)
+
+	def test_jsonl_nests_items_and_filters_dates(self):
+		from api.services import export
+
+		since, _ = export.parse_range(timezone.localdate().isoformat(), None)
+		records = [json.loads(line) for line in export.render("plans", "jsonl", username="ann", since=since)]
+		self.assertEqual([r["plan_id"] for r in records], [self.plan.pk, self.empty.pk])
+		self.assertEqual([it["name"] for it in records[0]["items"]], ["Oats", "Soup, hot"])
+		self.assertEqual(records[1]["items"], [])
+
+	def test_view_streams_own_history_only(self):
+		from django.contrib.auth.models import User
+
+		self.client.force_login(User.objects.create_user("ann", password="pw"))
+		response = self.client.get("/profile/ann/export/plans.jsonl")
+		self.assertEqual(response["Content-Type"], "application/x-ndjson; charset=utf-8")
+		lines = b"".join(response.streaming_content).decode().splitlines()
+		self.assertEqual(len(lines), 3)
+		self.assertEqual(self.client.get("/profile/bob/export/plans.csv").status_code, 403)
+		self.assertEqual(self.client.get("/profile/ann/export/plans.csv", {"since": "yesterday"}).status_code, 400)
+
+	def test_command_writes_intakes_csv(self):
+		import csv
+		import io
+		import tempfile
+		from django.core.management import call_command
+		from api.models import UserIntake
+
+		UserIntake.objects.create(
+			username="ann", display_name="Ann", gender="female", age=30, height=170, weight=60, goal="maintain_weight",
+			activity_level="medium", allergies=["nuts", "egg"], cooking_skill="beginner", preferred_units="metric",
+		)
+		with tempfile.NamedTemporaryFile("r", suffix=".csv", encoding="utf-8") as out:
+			call_command("export_history", "intakes", "--format", "csv", "--output", out.name, stderr=io.StringIO())
+			rows = list(csv.DictReader(out))
+		self.assertEqual([(r["username"], r["allergies"]) for r in rows], [("ann", "nuts,egg")])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HotCacheTests(TestCase):
+	def setUp(self):
+		from django.core.cache import cache
+		from api.services import hot_cache
+
+		hot_cache._local.clear()
+		cache.clear()
+		self.loads = 0
+
+	def _loader(self):
+		self.loads += 1
+		return self.loads
+
+	def test_tiers_and_invalidation_after_commit(self):
+		from api.services import hot_cache
+
+		self.assertEqual(hot_cache.get_or_set("t", "k", self._loader), 1)
+		self.assertEqual(hot_cache.get_or_set("t", "k", self._loader), 1)
+		# Другой процесс: локального уровня нет, значение берётся из общего кэша
+		hot_cache._local.clear()
+		self.assertEqual(hot_cache.get_or_set("t", "k", self._loader), 1)
+		self.assertEqual(self.loads, 1)
+
+		with self.captureOnCommitCallbacks() as callbacks:
+			hot_cache.invalidate("t", "k")
+			# До коммита старое значение ещё действительно
+			self.assertEqual(hot_cache.get_or_set("t", "k", self._loader), 1)
+		for callback in callbacks:
+			callback()
+		self.assertEqual(hot_cache.get_or_set("t", "k", self._loader), 2)
+
+	def test_invalidation_is_published_to_other_processes(self):
+		from unittest import mock
+		from api.services import hot_cache
+
+		redis = _FakeRedis()
+		with mock.patch.object(hot_cache, "redis_connection", return_value=redis):
+			with self.captureOnCommitCallbacks(execute=True):
+				hot_cache.invalidate("targets", "ann")
+		self.assertEqual(redis.published, [(hot_cache.CHANNEL, "hot:targets:ann")])
+
+	def test_new_intake_refreshes_cached_targets(self):
+		from api.models import UserIntake
+		from api.services import portions
+
+		def intake(proteins):
+			return UserIntake.objects.create(
+				username="ann", display_name="Ann", gender="female", age=30, height=170, weight=60,
+				goal="maintain_weight", activity_level="medium", cooking_skill="beginner", preferred_units="metric",
+				target_proteins=proteins, target_carbohydrates=200, target_fats=60, target_calories=1800,
+			)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			intake(100)
+		self.assertEqual(portions.targets_for("ann")["proteins"], 100)
+		with self.captureOnCommitCallbacks(execute=True):
+			intake(120)
+		self.assertEqual(portions.targets_for("ann")["proteins"], 120)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WeeklyStreamTests(TestCase):
+	def _day(self, n, prefix="meal"):
+		items = [
+			{"name": f"{prefix} {n}.{i}", "recipe": "", "proteins_g": 30, "carbohydrates_g": 60, "fats_g": 15, "fiber_g": 3}
+			for i in range(5)
+		]
+		return json.dumps({"day": n, "daily_ration": items})
+
+	def test_parse_day(self):
+		from api.services.weekly_planner import parse_day
+
+		self.assertEqual(parse_day(self._day(1))["day"], 1)
+		self.assertEqual(parse_day("```json " + self._day(2) + "```")["day"], 2)
+		for line in ("Here is your plan:", '{"day": 3, "daily_ration": [', '{"day": 4}', "[1, 2]"):
+			self.assertIsNone(parse_day(line), line)
+
+	def test_week_is_saved_from_split_chunks_and_finished_locally(self):
+		from types import SimpleNamespace as NS
+		from unittest import mock
+		from api.models import DailyRationPlan, UserIntake, WeeklyRationPlan
+		from api.services import ledger, llm, weekly_planner
+
+		UserIntake.objects.create(
+			username="ann", display_name="Ann", gender="female", age=30, height=170, weight=60, goal="maintain_weight",
+			activity_level="medium", allergies=[], cooking_skill="beginner", preferred_units="metric",
+			target_proteins=150, target_carbohydrates=300, target_fats=75, target_calories=2475,
+		)
+		for i in range(6):
+			_meal(f"Local meal {i}")
+		# Строка второго дня разрезана между чанками; между днями — мусор, который пропускается
+		text = self._day(1) + "\nnot a day\n" + self._day(2)
+		chunks = [NS(choices=[NS(delta=NS(content=text[i:i + 40]))], usage=None) for i in range(0, len(text), 40)]
+		client = NS(chat=NS(completions=NS(create=lambda **kw: iter(chunks))))
+		start = timezone.localdate()
+		# Журнал вызовов пишет фоновый поток, которому тестовая SQLite-база недоступна
+		with mock.patch.object(llm, "get_client", return_value=client), mock.patch.object(ledger, "record"):
+			result = weekly_planner.generate_week("ann", model="test-model", days=3, start=start)
+
+		self.assertEqual(result["days_saved"], 3)
+		plans = list(DailyRationPlan.objects.filter(week_id=result["week_id"]).order_by("day_index"))
+		self.assertEqual([p.plan_date for p in plans], [start + timedelta(days=i) for i in range(3)])
+		self.assertEqual([p.model for p in plans][:2], ["test-model", "test-model"])
+		self.assertNotEqual(plans[2].model, "test-model")
+		self.assertIsNotNone(WeeklyRationPlan.objects.get(pk=result["week_id"]).completed_at)
+		# Сегодняшний день недели — текущий план, будущие дни скрыты
+		self.assertEqual([p.pk for p in DailyRationPlan.objects.current_for("ann")], [plans[0].pk])
+
+
+class BatchGenerateCommandTests(SimpleTestCase):
+	def test_bad_lines_fail_alone_and_the_batch_finishes(self):
+		import io
+		import tempfile
+		from types import SimpleNamespace as NS
+		from unittest import mock
+		from django.core.management import call_command
+		from api.management.commands import generate_daily_ration as command
+
+		async def fake_generate(username, model=None):
+			if username == "ghost":
+				raise ValueError(f"No profile found for user {username}")
+			return NS(pk=len(username), model=model or "m"), {}
+
+		with tempfile.TemporaryDirectory() as tmp:
+			src, out, checkpoint = (os.path.join(tmp, name) for name in ("in.jsonl", "out.jsonl", "done.jsonl"))
+			with open(src, "w", encoding="utf-8") as f:
+				f.write('ann\n12345\n{"model": "x"}\nghost\n{"username": "bob", "model": "big"}\n')
+			with mock.patch.object(command, "agenerate_plan", fake_generate):
+				call_command(
+					"generate_daily_ration", "--batch", "--input", src, "--output", out, "--checkpoint", checkpoint,
+					stderr=io.StringIO(),
+				)
+			with open(out, encoding="utf-8") as f:
+				results = sorted((json.loads(line) for line in f), key=lambda r: r["username"] or "")
+			with open(checkpoint, encoding="utf-8") as f:
+				done = sorted(json.loads(line)["username"] for line in f)
+
+		self.assertEqual(
+			[(r["username"], r["ok"]) for r in results],
+			[(None, False), ("12345", True), ("ann", True), ("bob", True), ("ghost", False)],
+		)
+		self.assertIn("Bad batch line", results[0]["error"])
+		self.assertEqual(done, ["12345", "ann", "bob"])
+
+
+class BeatScheduleTests(SimpleTestCase):
+	def test_scheduled_tasks_exist_and_use_the_default_scheduler(self):
+		from app.celery import app
+
+		app.loader.import_default_modules()
+		self.assertEqual(app.conf.beat_scheduler, "celery.beat:PersistentScheduler")
+		missing = [entry["task"] for entry in app.conf.beat_schedule.values() if entry["task"] not in app.tasks]
+		self.assertEqual(missing, [])
@@ -9,10 +9,18 @@ urlpatterns = [
 	path('logout/', views.logout_view, name='logout'),
 	path('intake/', views.intake_wizard, name='intake'),
 	path('profile/<str:username>/', views.profile, name='profile'),
+	path('profile/<str:username>/plan/', views.ration_plan, name='ration_plan'),
     path('profile/<str:username>/generate/', views.generate_daily_ration, name='generate_daily_ration'),
+	path('profile/<str:username>/generate-week/', views.generate_weekly_ration, name='generate_weekly_ration'),
 	path('profile/<str:username>/update/', views.update_daily_ration, name='update_daily_ration'),
+	path('profile/<str:username>/targets/', views.compute_targets, name='compute_targets'),
+	path('profile/<str:username>/export/<slug:kind>.<slug:fmt>', views.export_history, name='export_history'),
     path('products/new/', views.product_new, name='product_new'),
 	path('meals/new/', views.meal_new, name='meal_new'),
 	path('meals/<int:pk>/favorite/', views.meal_favorite, name='meal_favorite'),
 	path('meals/<int:pk>/reaction/', views.meal_reaction, name='meal_reaction'),
+	path('meals/<int:pk>/similar/', views.meal_similar, name='meal_similar'),
+	path('meals/feedback/', views.meal_feedback, name='meal_feedback'),
+	path('plan-items/<int:pk>/reaction/', views.plan_item_reaction, name='plan_item_reaction'),
+	path('ops/db-pool/', views.db_pool_stats, name='db_pool_stats'),
 ]
\ No newline at end of file
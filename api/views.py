@@ -1,15 +1,26 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_http_methods, condition
+from django.views.decorators.cache import cache_control
+from django.conf import settings
 from django.contrib import messages
-from django.core import management
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.http import Http404, HttpResponseForbidden, JsonResponse
+from django.middleware.csrf import get_token
+from django.db import IntegrityError, connection, router, transaction
+from django.db.models import Count, Q
+from app.db import pool_stats, use_replica
 
-from .models import UserIntake, Product, Meal, MealFavorite, MealReaction
-from .tasks import compute_daily_targets_for_user
+from .models import UserIntake, Product, Meal, MealFavorite, MealReaction, ProductReaction, CatalogVector, DailyRationPlan, DailyRationItem, PopularityCounter
+from .tasks import start_intake_pipeline, generate_weekly_ration_for_user
 
-from api.services.ration_generator import generate_ration
+from api.services.ration_generator import agenerate_ration
+from api.services.ration_updater import aupdate_ration
+from api.services.targets import acompute_targets
+from api.services import export, hot_cache, llm, popularity, speculative, text_index
+import hashlib
+import json
 import subprocess
 import sys
 import os
@@ -75,7 +86,7 @@ def intake_wizard(request):
         if age < 13 or age > 120 or height < 100 or height > 250 or weight < 30 or weight > 300:
             messages.error(request, 'Please correct the fields and try again.')
         else:
-            UserIntake.objects.create(
+            intake = UserIntake.objects.create(
                 user=request.user,            # link to auth user
                 username=username_str,        # store string
                 display_name=display_name,
@@ -91,8 +102,9 @@ def intake_wizard(request):
                 kitchen_equipment=kitchen_equipment,
                 preferred_units=preferred_units,
             )
-            compute_daily_targets_for_user.delay(username_str)  # pass string
-            messages.info(request, 'Profile saved. Daily targets are being computed in the background.')
+            # Цели, затем заготовка первого плана и прогрев кэша — в фоне
+            start_intake_pipeline(intake)
+            messages.info(request, 'Profile saved. Daily targets and your first ration are being prepared in the background.')
             return redirect('profile', username=username_str)
 
     context = {
@@ -106,10 +118,83 @@ def intake_wizard(request):
     }
     return render(request, 'intake_wizard.html', context)
 
+def _etag(request, *parts) -> str:
+	# Страница содержит CSRF-токен сессии, поэтому его секрет тоже входит в валидатор
+	get_token(request)
+	parts = (request.user.pk, request.META.get('CSRF_COOKIE', ''), *parts)
+	return hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+
+def _load_intake_version(username: str):
+	return (
+		UserIntake.objects.filter(username=username).order_by('-created_at')
+		.values_list('id', 'updated_at').first()
+	)
+
+def _intake_version(request, username: str):
+	"""(id, updated_at) of the latest intake, computed once per request."""
+	if not hasattr(request, '_intake_version'):
+		request._intake_version = hot_cache.get_or_set('intake', username, lambda: _load_intake_version(username))
+	return request._intake_version
+
+def _profile_etag(request, username: str):
+	return _etag(request, 'profile', username, *(_intake_version(request, username) or ('none',)))
+
+def _profile_last_modified(request, username: str):
+	version = _intake_version(request, username)
+	return version[1] if version else None
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_profile_etag, last_modified_func=_profile_last_modified)
+@use_replica()
 def profile(request, username: str):
-	latest = UserIntake.objects.filter(username=username).order_by('-created_at').first()
-	return render(request, 'profile.html', { 'username': username, 'profile': latest })
+	version = _intake_version(request, username)
+	latest = UserIntake.objects.filter(pk=version[0]).first() if version else None
+	return render(request, 'profile.html', {
+		'username': username,
+		'profile': latest,
+		'profile_version': '{}:{}'.format(*version) if version else 'none',
+		'FRAGMENT_CACHE_TIMEOUT': settings.FRAGMENT_CACHE_TIMEOUT,
+	})
+
+def _plan_version(request, username: str):
+	"""(id, created_at, items, eaten items) of the latest plan: items get marked eaten after the plan is saved."""
+	if not hasattr(request, '_plan_version'):
+		with use_replica():
+			request._plan_version = (
+				DailyRationPlan.objects.current_for(username)
+				.annotate(
+					n_items=Count('dailyrationitem'),
+					n_eaten=Count('dailyrationitem', filter=Q(dailyrationitem__eaten=True)),
+				)
+				.values_list('id', 'created_at', 'n_items', 'n_eaten').first()
+			)
+	return request._plan_version
+
+def _plan_etag(request, username: str):
+	return _etag(request, 'plan', username, *(_plan_version(request, username) or ('none',)))
+
+def _plan_last_modified(request, username: str):
+	version = _plan_version(request, username)
+	return version[1] if version else None
+
+@login_required
+@require_http_methods(["GET"])
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_plan_etag, last_modified_func=_plan_last_modified)
+@use_replica()
+def ration_plan(request, username: str):
+	version = _plan_version(request, username)
+	plan = DailyRationPlan.objects.filter(pk=version[0]).first() if version else None
+	# Сами позиции читаются лениво из шаблона, только если фрагмента нет в кэше
+	items = DailyRationItem.objects.filter(plan=plan).select_related('recipe_ref').order_by('position') if plan else []
+	return render(request, 'ration_result.html', {
+		'username': username,
+		'plan': plan,
+		'items': items,
+		'items_version': '{}:{}'.format(*version[2:]) if version else 'none',
+		'FRAGMENT_CACHE_TIMEOUT': settings.FRAGMENT_CACHE_TIMEOUT,
+	})
 
 @login_required
 @require_http_methods(["GET", "POST"])
@@ -165,6 +250,113 @@ def meal_reaction(request, pk: int):
 	messages.success(request, f'Reaction set: {reaction}')
 	return redirect('home')
 
+REACTIONS = ('like', 'dislike')
+FEEDBACK_BATCH_LIMIT = 500
+
+@login_required
+@require_http_methods(["POST"])
+def plan_item_reaction(request, pk: int):
+	"""Like/dislike the catalog meal or product behind an item of the user's own plan."""
+	username = request.user.username
+	item = get_object_or_404(DailyRationItem, pk=pk, plan__username=username)
+	reaction = request.POST.get('reaction')
+	if reaction not in REACTIONS:
+		return JsonResponse({'ok': False, 'error': f"reaction must be one of {REACTIONS}"}, status=400)
+	if item.meal_id:
+		MealReaction.objects.update_or_create(meal_id=item.meal_id, username=username, defaults={'reaction': reaction})
+	elif item.product_id:
+		ProductReaction.objects.update_or_create(product_id=item.product_id, username=username, defaults={'reaction': reaction})
+	else:
+		return JsonResponse({'ok': False, 'error': 'item is not linked to the catalog'}, status=409)
+	return JsonResponse({'ok': True, 'meal': item.meal_id, 'product': item.product_id, 'reaction': reaction})
+
+def _parse_feedback(body: bytes):
+	"""({meal_id: reaction}, {meal_id}) from a JSON batch; the last reaction per meal wins."""
+	payload = json.loads(body or b'{}')
+	reactions = {}
+	for entry in payload.get('reactions') or []:
+		if entry.get('reaction') not in REACTIONS:
+			raise ValueError(f"reaction must be one of {REACTIONS}")
+		reactions[int(entry['meal'])] = entry['reaction']
+	favorites = {int(pk) for pk in payload.get('favorites') or []}
+	if len(reactions) + len(favorites) > FEEDBACK_BATCH_LIMIT:
+		raise ValueError(f"at most {FEEDBACK_BATCH_LIMIT} entries per batch")
+	return reactions, favorites
+
+@login_required
+@require_http_methods(["POST"])
+def meal_feedback(request):
+	"""Batch upsert of meal reactions and favorites: one INSERT ... ON CONFLICT per table."""
+	try:
+		reactions, favorites = _parse_feedback(request.body)
+	except (ValueError, TypeError, KeyError, AttributeError) as e:
+		return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+	username = request.user.username
+	try:
+		with transaction.atomic():
+			if reactions:
+				MealReaction.objects.bulk_create(
+					[MealReaction(meal_id=pk, username=username, reaction=r) for pk, r in reactions.items()],
+					update_conflicts=True, unique_fields=['meal', 'username'], update_fields=['reaction'],
+				)
+			if favorites:
+				MealFavorite.objects.bulk_create(
+					[MealFavorite(meal_id=pk, username=username) for pk in favorites],
+					ignore_conflicts=True,
+				)
+			# Внешние ключи отложены до коммита; во внешней транзакции ошибка всплыла бы уже после ответа
+			connection.check_constraints(table_names=[MealReaction._meta.db_table, MealFavorite._meta.db_table])
+	except IntegrityError:
+		# Несуществующие блюда ищем только на пути ошибки, чтобы не тратить запрос в обычном случае
+		ids = set(reactions) | favorites
+		unknown = sorted(ids - set(Meal.objects.filter(pk__in=ids).values_list('pk', flat=True)))
+		return JsonResponse({'ok': False, 'error': 'unknown meals', 'meals': unknown}, status=400)
+	# bulk_create не шлёт сигналов и не знает прежних реакций — счётчики этих блюд пересчитает flush
+	popularity.mark_dirty(PopularityCounter.KIND_MEAL, set(reactions) | favorites)
+	return JsonResponse({'ok': True, 'reactions': len(reactions), 'favorites': len(favorites)})
+
+@login_required
+@require_http_methods(["GET"])
+def meal_similar(request, pk: int):
+	try:
+		k = int(request.GET.get('k') or 10)
+	except ValueError:
+		k = 0
+	if k <= 0:
+		return JsonResponse({'ok': False, 'error': 'k must be a positive integer'}, status=400)
+	k = min(k, 50)
+	matches = text_index.similar(CatalogVector.KIND_MEAL, pk, k=k)
+	names = dict(Meal.objects.filter(pk__in=[mid for mid, _ in matches]).values_list('id', 'name'))
+	return JsonResponse({
+		'meal_id': pk,
+		'similar': [{'id': mid, 'name': names.get(mid), 'similarity': round(sim, 4)} for mid, sim in matches],
+	})
+
+@login_required
+@require_http_methods(["GET"])
+def export_history(request, username: str, kind: str, fmt: str):
+	"""Stream the plan or intake history of ``username`` as CSV or JSONL, optionally ?since=&until= (dates)."""
+	# Свою историю выгружает сам пользователь, любую — сотрудник
+	if username != request.user.username and not request.user.is_staff:
+		return HttpResponseForbidden()
+	if kind not in export.KINDS or fmt not in export.FORMATS:
+		raise Http404
+	try:
+		since, until = export.parse_range(request.GET.get('since'), request.GET.get('until'))
+	except ValueError as e:
+		return JsonResponse({'ok': False, 'error': str(e)}, status=400)
+	# Строки читаются уже после выхода из view, поэтому базу выбираем сейчас, пока действует use_replica
+	with use_replica():
+		using = router.db_for_read(DailyRationPlan)
+	lines = export.render(kind, fmt, username=username, since=since, until=until, using=using)
+	return export.streaming_response(request, lines, fmt, f'{username}-{kind}.{fmt}')
+
+@user_passes_test(lambda u: u.is_staff)
+@require_http_methods(["GET"])
+def db_pool_stats(request):
+	# Счётчики пула — на процесс; у каждого воркера gunicorn свои
+	return JsonResponse({'pid': os.getpid(), 'pools': pool_stats()})
+
 def _run_script(module_path: str, args: list[str]) -> tuple[int, str]:
 	py = sys.executable
 	cmd = [py, module_path, *args]
@@ -174,19 +366,36 @@ def _run_script(module_path: str, args: list[str]) -> tuple[int, str]:
 
 @login_required
 @require_http_methods(["POST"])
-def generate_daily_ration(request, username: str):
-    if request.method == "POST":
-        data = generate_ration(username='vosh') #request.user.username
-        # Можно показать результат на отдельной странице
-        return render(request, "ration_result.html", {"ration": data})
-    return redirect("profile", username='vosh') #username
+async def generate_daily_ration(request, username: str):
+	# Заготовленный после анкеты план отдаётся сразу, без обращения к LLM
+	if await speculative.aclaim(username) is None:
+		# Дедлайн на весь каскад: при деградации провайдера план строится локально, а не висит
+		with llm.deadline(settings.LLM_REQUEST_DEADLINE):
+			await agenerate_ration(username=username)
+	# POST-redirect-GET: страница плана отдаётся с ETag и кэшируется
+	return redirect("ration_plan", username=username)
+
+@login_required
+@require_http_methods(["POST"])
+def generate_weekly_ration(request, username: str):
+	# Неделя генерируется в фоне; дни появляются в БД по мере стриминга ответа
+	generate_weekly_ration_for_user.delay(username)
+	messages.info(request, 'Weekly ration is being generated; days will appear as they are ready.')
+	return redirect('profile', username=username)
 
 @login_required
 @require_http_methods(["POST"])
-def update_daily_ration(request, username: str):
+async def update_daily_ration(request, username: str):
 	try:
-		management.call_command('update_daily_ration', username=username)
+		with llm.deadline(settings.LLM_REQUEST_DEADLINE):
+			await aupdate_ration(username)
 		messages.success(request, 'Daily ration updated.')
 	except Exception as e:
 		messages.error(request, f'Update failed: {e}')
-	return redirect('profile', username=username)
\ No newline at end of file
+	return redirect('profile', username=username)
+
+@login_required
+@require_http_methods(["POST"])
+async def compute_targets(request, username: str):
+	with llm.deadline(settings.LLM_REQUEST_DEADLINE):
+		return JsonResponse(await acompute_targets(username))
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import task_prerun
 import ssl
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
@@ -13,4 +14,17 @@ app = Celery('app',
      }
 )
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+@task_prerun.connect
+def _reset_replica_pin(**kwargs):
+    # Воркер переиспользует поток: запись прошлой задачи не должна закреплять чтения следующей за primary
+    from app.db import reset_write_pin
+    reset_write_pin()
+
+
+@task_prerun.connect
+def _ledger_endpoint(task=None, **kwargs):
+    # Вызовы LLM из задачи учитываются в журнале под её именем
+    from api.services import ledger
+    ledger.set_endpoint(task.name)
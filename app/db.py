@@ -0,0 +1,123 @@
+"""Read-replica routing and connection pool introspection.
+
+Reads go to the ``replica`` database only inside ``use_replica()`` blocks,
+which wrap the read-only paths (catalog loads, plan history, profile reads).
+Everything else, and every write, uses ``default``. After a user writes
+something, their reads stay on the primary for ``DB_REPLICA_STICKY_SECONDS``
+(tracked with a cookie) so they never see replication lag on their own data.
+"""
+import time
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+REPLICA = "replica"
+PIN_COOKIE = "db_pin"
+
+_replica_allowed: ContextVar[bool] = ContextVar("db_replica_allowed", default=False)
+# Закреплён за primary по cookie после недавней записи
+_pinned: ContextVar[bool] = ContextVar("db_pinned", default=False)
+# В текущем запросе/задаче уже была запись
+_wrote: ContextVar[bool] = ContextVar("db_wrote", default=False)
+
+
+def replica_configured() -> bool:
+    return REPLICA in settings.DATABASES
+
+
+class use_replica(ContextDecorator):
+    """Allow reads in this block to be served by the replica (if one is configured)."""
+
+    def __enter__(self):
+        self._token = _replica_allowed.set(True)
+        return self
+
+    def __exit__(self, *exc):
+        _replica_allowed.reset(self._token)
+        return False
+
+
+class use_primary(ContextDecorator):
+    """Force reads in this block to the primary, even inside ``use_replica()``."""
+
+    def __enter__(self):
+        self._token = _replica_allowed.set(False)
+        return self
+
+    def __exit__(self, *exc):
+        _replica_allowed.reset(self._token)
+        return False
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_allowed.get() and not (_pinned.get() or _wrote.get()) and replica_configured():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Дальнейшие чтения в этом запросе/задаче — только с primary
+        _wrote.set(True)
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+class ReplicaStickinessMiddleware:
+    """Pins a user's reads to the primary for a while after their own writes."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        try:
+            pinned = float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        return _pinned.set(pinned), _wrote.set(False)
+
+    def _finish(self, response, tokens):
+        if _wrote.get():
+            seconds = settings.DB_REPLICA_STICKY_SECONDS
+            response.set_cookie(PIN_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True, samesite="Lax")
+        _pinned.reset(tokens[0])
+        _wrote.reset(tokens[1])
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        tokens = self._start(request)
+        return self._finish(self.get_response(request), tokens)
+
+    async def __acall__(self, request):
+        tokens = self._start(request)
+        return self._finish(await self.get_response(request), tokens)
+
+
+def reset_write_pin() -> None:
+    """Start a new unit of work (e.g. a Celery task) without the previous one's primary pin."""
+    _wrote.set(False)
+
+
+def pool_stats() -> dict:
+    """psycopg pool counters of this process, per database alias."""
+    stats = {}
+    for alias in connections:
+        conn = connections[alias]
+        # Свойство pool создаёт пул при обращении: читаем только уже открытые
+        if alias in getattr(conn, "_connection_pools", {}):
+            stats[alias] = conn.pool.get_stats()
+    return stats
@@ -29,7 +29,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = env.str('SECRET_KEY')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = env.bool("DEBUG", True)
 
 ALLOWED_HOSTS = ['*']
 
@@ -63,6 +63,9 @@ MIDDLEWARE = [
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
+    "app.db.ReplicaStickinessMiddleware",
+    "api.services.ledger.LedgerContextMiddleware",
+    "api.services.profiling.ProfilingMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
@@ -93,6 +96,32 @@ WSGI_APPLICATION = "app.wsgi.application"
 DATABASES = {
     "default": env.dj_db_url('DB_URL')
 }
+# Необязательная реплика для чтения каталога, истории планов и профилей (см. app.db)
+if env.str("DB_REPLICA_URL", ""):
+    DATABASES["replica"] = env.dj_db_url("DB_REPLICA_URL")
+    DATABASES["replica"]["TEST"] = {"MIRROR": "default"}
+
+DATABASE_ROUTERS = ["app.db.ReplicaRouter"]
+# Сколько секунд после своей записи пользователь читает только с primary
+DB_REPLICA_STICKY_SECONDS = env.int("DB_REPLICA_STICKY_SECONDS", 10)
+
+# Встроенный пул psycopg 3 (Django 5.1+): соединения переживают запросы и задачи Celery
+DB_POOL = env.bool("DB_POOL", True)
+for _alias, _db in DATABASES.items():
+    # С пулом Django проверяет соединение (ConnectionPool.check_connection) при выдаче из пула
+    _db["CONN_HEALTH_CHECKS"] = True
+    if DB_POOL and _db["ENGINE"] == "django.db.backends.postgresql":
+        _db["CONN_MAX_AGE"] = 0  # пул несовместим с persistent connections
+        _db.setdefault("OPTIONS", {})["pool"] = {
+            "name": _alias,
+            "min_size": env.int("DB_POOL_MIN_SIZE", 2),
+            "max_size": env.int("DB_POOL_MAX_SIZE", 10),
+            "timeout": env.float("DB_POOL_TIMEOUT", 10.0),
+            "max_idle": env.float("DB_POOL_MAX_IDLE", 300.0),
+        }
+    elif _db["ENGINE"] == "django.db.backends.sqlite3":
+        # Фоновые писатели (журнал LLM): без IMMEDIATE апгрейд блокировки в транзакции падает сразу с "database is locked"
+        _db.setdefault("OPTIONS", {}).setdefault("transaction_mode", "IMMEDIATE")
 
 
 # Password validation
@@ -133,6 +162,25 @@ STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 
+# Хэшированные имена + gzip/brotli; WhiteNoise отдаёт их с вечным Cache-Control
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
+
+# Бандлы собираются командой build_assets в static/dist/
+ASSET_BUNDLE_PREFIX = "dist"
+ASSET_BUNDLE_DIR = BASE_DIR / "static" / ASSET_BUNDLE_PREFIX
+# Страницы выбирают свой CSS-бандл в блоке stylesheets шаблона base.html
+ASSET_BUNDLES = {
+    "app.css": ["css/styles.css"],
+    "intake.css": ["css/styles.css", "css/intake.css"],
+    "profile.css": ["css/profile.css"],
+    "meal_new.css": ["css/meal_new.css"],
+    "product_new.css": ["css/product_new.css"],
+    "app.js": ["js/utils.js", "js/components.js", "js/forms.js", "js/main.js"],
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -150,6 +198,17 @@ if REDIS_URL.startswith("rediss://"):
     # Для django-redis верхний регистр SSL_CERT_REQS
     cache_options["ssl_cert_reqs"] = ssl.CERT_NONE
 
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": REDIS_URL,
+        "OPTIONS": cache_options,
+    }
+}
+
+# Фрагменты страниц профиля/плана; ключи включают версию данных, так что TTL — лишь верхняя граница
+FRAGMENT_CACHE_TIMEOUT = env.int("FRAGMENT_CACHE_TIMEOUT", 24 * 60 * 60)
+
 
 # ========================
 # Celery
@@ -165,4 +224,152 @@ else:
     CELERY_BROKER_USE_SSL = None
     CELERY_RESULT_BACKEND_USE_SSL = None
 
-CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
+# Стандартный планировщик beat: расписание берётся из CELERY_BEAT_SCHEDULE ниже,
+# состояние — в файле (django_celery_beat не установлен)
+CELERY_BEAT_SCHEDULER = "celery.beat:PersistentScheduler"
+CELERY_BEAT_SCHEDULE_FILENAME = env.str("CELERY_BEAT_SCHEDULE_FILENAME", "/tmp/celerybeat-schedule")
+
+CELERY_BEAT_SCHEDULE = {
+    "rebuild-meal-recommendations": {
+        "task": "api.tasks.rebuild_meal_recommendations",
+        "schedule": env.int("RECOMMENDER_REBUILD_INTERVAL", 6 * 60 * 60),
+    },
+    "purge-ration-history": {
+        "task": "api.tasks.purge_ration_history",
+        "schedule": 24 * 60 * 60,
+    },
+    "flush-popularity-counters": {
+        "task": "api.tasks.flush_popularity_counters",
+        "schedule": env.int("POPULARITY_FLUSH_INTERVAL", 60),
+    },
+    "reconcile-popularity-counters": {
+        "task": "api.tasks.reconcile_popularity_counters",
+        "schedule": 24 * 60 * 60,
+    },
+    "purge-request-profiles": {
+        "task": "api.tasks.purge_request_profiles",
+        "schedule": 24 * 60 * 60,
+    },
+}
+
+
+# ========================
+# Recommendations
+# ========================
+RECOMMENDER_FACTORS = env.int("RECOMMENDER_FACTORS", 16)
+RECOMMENDER_TOP_N = env.int("RECOMMENDER_TOP_N", 50)
+
+
+# ========================
+# Catalog text index
+# ========================
+TEXT_INDEX_DIM = env.int("TEXT_INDEX_DIM", 512)
+TEXT_INDEX_DUPLICATE_THRESHOLD = env.float("TEXT_INDEX_DUPLICATE_THRESHOLD", 0.92)
+
+
+# ========================
+# Plan history retention
+# ========================
+# Планы старше HOT_DAYS переезжают в помесячно секционированный архив
+RATION_HISTORY_HOT_DAYS = env.int("RATION_HISTORY_HOT_DAYS", 90)
+# 0 — хранить архив бессрочно
+RATION_HISTORY_RETENTION_MONTHS = env.int("RATION_HISTORY_RETENTION_MONTHS", 0)
+
+
+# ========================
+# LLM model cascade
+# ========================
+# Модели в порядке эскалации: следующая вызывается, только если ответ предыдущей не прошёл локальную проверку
+OPENAI_MODEL_CASCADE = env.list("OPENAI_MODEL_CASCADE", [env.str("OPENAI_MODEL", "gpt-4o-mini"), "gpt-4o"])
+# Допустимое относительное отклонение суммы макросов от целей пользователя
+CASCADE_MACRO_TOLERANCE = env.float("CASCADE_MACRO_TOLERANCE", 0.15)
+
+
+# ========================
+# Catalog
+# ========================
+# Сколько продуктов/блюд попадает в промпт (личные записи — в первую очередь)
+CATALOG_MAX_PRODUCTS = env.int("CATALOG_MAX_PRODUCTS", 100)
+CATALOG_MAX_MEALS = env.int("CATALOG_MAX_MEALS", 200)
+
+
+# ========================
+# Portion scaling
+# ========================
+# Границы множителя порции при подгонке плана под цели пользователя
+PORTION_MIN = env.float("PORTION_MIN", 0.5)
+PORTION_MAX = env.float("PORTION_MAX", 2.0)
+
+
+# ========================
+# Hot cache (api.services.hot_cache)
+# ========================
+HOT_CACHE_LOCAL_SIZE = env.int("HOT_CACHE_LOCAL_SIZE", 1024)
+# Страховка на случай пропущенного pub/sub-сообщения
+HOT_CACHE_LOCAL_TTL = env.int("HOT_CACHE_LOCAL_TTL", 30)
+HOT_CACHE_TIMEOUT = env.int("HOT_CACHE_TIMEOUT", 10 * 60)
+
+
+# ========================
+# LLM call ledger (api.services.ledger)
+# ========================
+# Строки пишутся фоновым потоком пачками: раз в FLUSH_SECONDS или по набору BATCH_SIZE
+LLM_LEDGER_BATCH_SIZE = env.int("LLM_LEDGER_BATCH_SIZE", 100)
+LLM_LEDGER_FLUSH_SECONDS = env.float("LLM_LEDGER_FLUSH_SECONDS", 2.0)
+# При переполнении очереди строки отбрасываются, а не тормозят запрос
+LLM_LEDGER_QUEUE_SIZE = env.int("LLM_LEDGER_QUEUE_SIZE", 10000)
+# USD за 1M токенов: (prompt, cached prompt, completion)
+LLM_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+}
+
+
+# ========================
+# LLM timeouts, hedging and circuit breaker (api.services.llm, api.services.breaker)
+# ========================
+# Таймаут вызова в секундах по вызывающему (caller); остальным — LLM_TIMEOUT
+LLM_TIMEOUT = env.float("LLM_TIMEOUT", 30)
+LLM_TIMEOUTS = {
+    "targets": env.float("LLM_TIMEOUT_TARGETS", 20),
+    "ration": env.float("LLM_TIMEOUT_RATION", 45),
+    "update": env.float("LLM_TIMEOUT_UPDATE", 45),
+    "weekly": env.float("LLM_TIMEOUT_WEEKLY", 120),
+}
+# Меньше этого до дедлайна — вызов не начинается, сразу локальный движок
+LLM_MIN_TIMEOUT = env.float("LLM_MIN_TIMEOUT", 1.0)
+# Дедлайн на все вызовы LLM одного пользовательского запроса (каскад включительно)
+LLM_REQUEST_DEADLINE = env.float("LLM_REQUEST_DEADLINE", 60)
+LLM_MAX_RETRIES = env.int("LLM_MAX_RETRIES", 0)
+# Дублирующий запрос уходит, когда первый дольше наблюдаемого p95
+LLM_HEDGE_ENABLED = env.bool("LLM_HEDGE_ENABLED", True)
+LLM_HEDGE_MIN_SAMPLES = env.int("LLM_HEDGE_MIN_SAMPLES", 20)
+LLM_HEDGE_WINDOW = env.int("LLM_HEDGE_WINDOW", 200)
+LLM_HEDGE_WORKERS = env.int("LLM_HEDGE_WORKERS", 8)
+# Размыкание по последним WINDOW вызовам модели: доля ошибок или p95 задержки выше порога
+LLM_BREAKER_WINDOW = env.int("LLM_BREAKER_WINDOW", 20)
+LLM_BREAKER_MIN_CALLS = env.int("LLM_BREAKER_MIN_CALLS", 10)
+LLM_BREAKER_ERROR_RATE = env.float("LLM_BREAKER_ERROR_RATE", 0.5)
+LLM_BREAKER_SLOW_MS = env.int("LLM_BREAKER_SLOW_MS", 40000)
+LLM_BREAKER_COOLDOWN = env.float("LLM_BREAKER_COOLDOWN", 30)
+
+
+# ========================
+# On-demand request profiling (api.services.profiling)
+# ========================
+# Сотрудник включает профиль заголовком X-Profile: 1 или параметром ?_profile=1
+REQUEST_PROFILING_ENABLED = env.bool("REQUEST_PROFILING_ENABLED", True)
+# Период сэмплирования стеков, секунды
+REQUEST_PROFILING_INTERVAL = env.float("REQUEST_PROFILING_INTERVAL", 0.005)
+# Дольше сэмплер не работает, даже если запрос не закончился
+REQUEST_PROFILING_MAX_SECONDS = env.float("REQUEST_PROFILING_MAX_SECONDS", 300)
+# Сверх этого SQL-запросы только считаются, текст не сохраняется
+REQUEST_PROFILING_MAX_QUERIES = env.int("REQUEST_PROFILING_MAX_QUERIES", 2000)
+REQUEST_PROFILING_RETENTION_DAYS = env.int("REQUEST_PROFILING_RETENTION_DAYS", 30)
+
+
+# ========================
+# History export (api.services.export)
+# ========================
+# Строк на одну выборку курсора при выгрузке
+EXPORT_CHUNK_SIZE = env.int("EXPORT_CHUNK_SIZE", 2000)
@@ -0,0 +1,34 @@
+# gunicorn.conf.py — picked up automatically by `gunicorn` started from the project root (see Procfile)
+"""Gunicorn settings: the app is imported once in the master and forked into workers.
+
+With ``preload_app`` the master runs ``django.setup()``, builds the ASGI
+handler and imports the URLconf with every view and service it pulls in;
+workers inherit those modules copy-on-write and start serving at once.
+Anything holding sockets or threads must not cross the fork: the master
+closes its database connections and pools before forking, and per-process
+threads (hot cache listener, LLM ledger writer, hedge pool) are started
+lazily in each worker by pid.
+"""
+import gc
+import os
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    from django.db import connections
+    from django.urls import get_resolver
+
+    # Импорт всех view заранее: иначе его платит первый запрос каждого воркера
+    get_resolver().url_patterns
+    for conn in connections.all(initialized_only=True):
+        conn.close()
+    for conn in connections.all():
+        # Свойство pool создаёт пул при обращении, поэтому проверяем, открыт ли он уже
+        if conn.alias in getattr(conn, "_connection_pools", {}):
+            conn.close_pool()
+    # Объекты мастера — в постоянное поколение: сборщик мусора воркеров не трогает их страницы
+    gc.freeze()
+